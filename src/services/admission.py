@@ -0,0 +1,337 @@
+import re
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional, Tuple
+from fastapi.responses import JSONResponse # type: ignore
+
+# (method, path pattern, class) checked in order; None leaves the route
+# unmanaged. Unlisted /api routes are "standard".
+ROUTE_CLASSES = [
+    (None, r"^/api/health$", None),
+    (None, r"^/api/metrics/", None),
+    # Long-lived event streams would pin a slot for their whole life
+    ("GET", r"^/api/jobs/[^/]+/events$", None),
+    ("GET", r"^/api/admin/export$", None),
+    ("POST", r"^/api/chat(/interactive)?$", "interactive"),
+    ("POST", r"^/api/search$", "interactive"),
+    ("GET", r"^/api/tenants/[^/]+/search$", "interactive"),
+    ("GET", r"^/api/plans(/[^/]+)?$", "interactive"),
+    ("GET", r"^/api/jobs/[^/]+$", "interactive"),
+    ("POST", r"^/api/jobs$", "interactive"),
+    ("POST", r"^/api/form(/batch|/prefetch)?$", "batch"),
+    ("POST", r"^/api/generate-plan$", "batch"),
+    # Bulk uploads for background ingestion; not latency sensitive
+    ("POST", r"^/api/tenants/[^/]+/documents$", "batch"),
+]
+_ROUTE_PATTERNS = [(method, re.compile(pattern), priority) for method, pattern, priority in ROUTE_CLASSES]
+
+# Queue-wait samples kept per class for percentiles
+WAIT_SAMPLES = 1000
+
+
+class AdmissionRejected(Exception):
+    """A request was refused a slot; retry_after is the suggested wait in seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PriorityClass:
+    """Slots, per-client wait queues and counters of one priority class."""
+
+    def __init__(self, name: str, rank: int, max_concurrency: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.rank = rank
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        # client -> deque of waiter futures; served round-robin across clients
+        self.queues = OrderedDict()
+        self.service_seconds = None
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.metrics = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "shed_deadline": 0,
+            "cancelled": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0
+        }
+
+    def push(self, client: str, waiter: asyncio.Future):
+        self.queues.setdefault(client, deque()).append(waiter)
+        self.waiting += 1
+
+    def pop(self) -> Optional[asyncio.Future]:
+        """Next live waiter, taking one from each client in turn."""
+        while self.queues:
+            client, waiters = next(iter(self.queues.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self.queues.move_to_end(client)
+            else:
+                del self.queues[client]
+            if not waiter.done():
+                self.waiting -= 1
+                return waiter
+        return None
+
+    def remove(self, client: str, waiter: asyncio.Future):
+        waiters = self.queues.get(client)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del self.queues[client]
+        self.waiting -= 1
+
+    def estimated_wait(self, position: int) -> Optional[float]:
+        """Expected queue wait for the request at this queue position, from recent service times."""
+        if self.service_seconds is None:
+            return None
+        return (position // max(self.max_concurrency, 1) + 1) * self.service_seconds
+
+    def record_wait(self, waited: float):
+        self.metrics["admitted"] += 1
+        self.metrics["queue_wait_seconds_total"] += waited
+        self.metrics["queue_wait_seconds_max"] = max(self.metrics["queue_wait_seconds_max"], waited)
+        self.waits.append(waited)
+
+    def record_service(self, seconds: float):
+        # Exponentially weighted, so the estimate follows load changes
+        if self.service_seconds is None:
+            self.service_seconds = seconds
+        else:
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * seconds
+
+    def stats(self) -> Dict[str, Any]:
+        samples = sorted(self.waits)
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))], 4)
+
+        stats = dict(self.metrics)
+        stats.update({
+            "in_flight": self.in_flight,
+            "queued": self.waiting,
+            "clients_queued": len(self.queues),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait,
+            "service_seconds_ewma": round(self.service_seconds, 4) if self.service_seconds is not None else None,
+            "queue_wait_seconds_p50": percentile(0.5),
+            "queue_wait_seconds_p99": percentile(0.99),
+            "queue_wait_seconds_total": round(stats["queue_wait_seconds_total"], 4)
+        })
+        return stats
+
+
+class AdmissionController:
+    """
+    Admission control for HTTP requests, run on the event loop.
+
+    Each managed route belongs to a priority class (interactive, standard,
+    batch). A request runs once a slot is free both in the process-wide
+    pool (ADMISSION_MAX_CONCURRENCY) and in its class; batch and standard
+    classes get fewer slots than the pool, so interactive turns always find
+    room. Freed slots go to the most urgent class first and, within a
+    class, round-robin across clients so one client's burst queues behind
+    itself. Queues are bounded, and a request whose expected or actual
+    wait exceeds its class deadline (or the client's X-Request-Deadline-Ms)
+    is shed with 429 and Retry-After instead of being served late.
+    """
+
+    def __init__(self, config):
+        self.enabled = config.admission_enabled
+        self.max_concurrency = config.admission_max_concurrency
+        self.in_flight = 0
+        self.classes = {
+            "interactive": PriorityClass("interactive", 0, config.admission_max_concurrency,
+                                         config.admission_interactive_max_queue,
+                                         config.admission_interactive_max_wait_seconds),
+            "standard": PriorityClass("standard", 1, config.admission_standard_max_concurrency,
+                                      config.admission_standard_max_queue,
+                                      config.admission_standard_max_wait_seconds),
+            "batch": PriorityClass("batch", 2, config.admission_batch_max_concurrency,
+                                   config.admission_batch_max_queue,
+                                   config.admission_batch_max_wait_seconds)
+        }
+
+    @staticmethod
+    def classify(method: str, path: str) -> Optional[str]:
+        """Priority class of a route, or None for routes admission control leaves alone."""
+        for route_method, pattern, priority in _ROUTE_PATTERNS:
+            if (route_method is None or route_method == method) and pattern.match(path):
+                return priority
+        return "standard" if path.startswith("/api/") else None
+
+    def _can_start(self, priority: PriorityClass) -> bool:
+        return self.in_flight < self.max_concurrency and priority.in_flight < priority.max_concurrency
+
+    def _start(self, priority: PriorityClass):
+        self.in_flight += 1
+        priority.in_flight += 1
+
+    def _dispatch(self):
+        """Hand free slots to waiters, most urgent class first."""
+        for priority in sorted(self.classes.values(), key=lambda c: c.rank):
+            while priority.waiting and self._can_start(priority):
+                waiter = priority.pop()
+                if waiter is None:
+                    break
+                self._start(priority)
+                waiter.set_result(True)
+
+    def _retry_after(self, priority: PriorityClass) -> float:
+        estimate = priority.estimated_wait(priority.waiting)
+        return max(1.0, estimate if estimate is not None else priority.max_wait)
+
+    async def acquire(self, name: str, client: str, max_wait: Optional[float] = None) -> Tuple[PriorityClass, float]:
+        """
+        Wait for a slot in the named class.
+
+        Args:
+            name (str): Priority class
+            client (str): Key requests are fair-queued by
+            max_wait (float, optional): Client deadline; the class deadline applies when shorter
+
+        Returns:
+            tuple: (class, start time) to hand back to release()
+
+        Raises:
+            AdmissionRejected: The queue is full or the wait would exceed the deadline
+        """
+        priority = self.classes[name]
+        max_wait = priority.max_wait if max_wait is None else min(max_wait, priority.max_wait)
+        queued_at = time.monotonic()
+        # Nobody of this class is waiting, so starting now cannot jump the queue
+        if not priority.waiting and self._can_start(priority):
+            self._start(priority)
+            priority.record_wait(0.0)
+            return priority, queued_at
+
+        if priority.waiting >= priority.max_queue:
+            priority.metrics["rejected_queue_full"] += 1
+            raise AdmissionRejected(f"Too many {name} requests queued", self._retry_after(priority))
+        estimate = priority.estimated_wait(priority.waiting)
+        if estimate is not None and estimate > max_wait:
+            # Would miss its deadline anyway: refuse now rather than after waiting
+            priority.metrics["shed_deadline"] += 1
+            raise AdmissionRejected(f"Server busy, expected wait {estimate:.1f}s exceeds the deadline", estimate)
+
+        waiter = asyncio.get_running_loop().create_future()
+        priority.push(client, waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=max(max_wait, 0))
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                waiter.cancel()
+                priority.remove(client, waiter)
+                priority.metrics["shed_deadline"] += 1
+                raise AdmissionRejected(f"Timed out after {max_wait:.1f}s waiting for a {name} slot",
+                                        self._retry_after(priority))
+        except BaseException:
+            # Client disconnected while queued
+            if waiter.done() and not waiter.cancelled():
+                self.release(priority, time.monotonic(), served=False)
+            else:
+                waiter.cancel()
+                priority.remove(client, waiter)
+            priority.metrics["cancelled"] += 1
+            raise
+        started = time.monotonic()
+        priority.record_wait(started - queued_at)
+        return priority, started
+
+    def try_acquire(self, name: str) -> Optional[Tuple[PriorityClass, float]]:
+        """
+        A slot in the named class for background work, only if one is free
+        now and no request of the class is waiting; never queues.
+
+        Returns:
+            tuple: (class, start time) to hand back to release(), or None
+        """
+        priority = self.classes[name]
+        if priority.waiting or not self._can_start(priority):
+            return None
+        self._start(priority)
+        return priority, time.monotonic()
+
+    def release(self, priority: PriorityClass, started: float, served: bool = True):
+        """Give a slot back and pass it on to the next waiter."""
+        self.in_flight -= 1
+        priority.in_flight -= 1
+        if served:
+            priority.record_service(time.monotonic() - started)
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        """Slots in use, queue depths, rejections and queue-wait percentiles per class."""
+        return {
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "classes": {name: priority.stats() for name, priority in self.classes.items()}
+        }
+
+
+def client_key(scope: Dict[str, Any]) -> str:
+    """Fair-queuing key: X-Client-Id, else the first X-Forwarded-For hop, else the peer address."""
+    headers = dict(scope.get("headers") or [])
+    client_id = headers.get(b"x-client-id")
+    if client_id:
+        return client_id.decode("latin-1")
+    forwarded = headers.get(b"x-forwarded-for")
+    if forwarded:
+        return forwarded.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def request_deadline(scope: Dict[str, Any]) -> Optional[float]:
+    """Queue-wait budget in seconds from the X-Request-Deadline-Ms header, if sent."""
+    value = dict(scope.get("headers") or []).get(b"x-request-deadline-ms")
+    try:
+        return max(float(value) / 1000.0, 0.0) if value else None
+    except ValueError:
+        return None
+
+
+class AdmissionMiddleware:
+    """ASGI middleware putting every managed HTTP request through an AdmissionController."""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.controller.enabled:
+            await self.app(scope, receive, send)
+            return
+        name = self.controller.classify(scope["method"], scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            priority, started = await self.controller.acquire(name, client_key(scope), request_deadline(scope))
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": str(e)},
+                headers={"Retry-After": str(int(math.ceil(e.retry_after)))}
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            # Streaming responses keep the slot until the last chunk is sent
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(priority, started)
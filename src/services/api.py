@@ -1,19 +1,43 @@
-from fastapi import FastAPI, HTTPException # type: ignore
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Header, WebSocket, WebSocketDisconnect # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
+from fastapi.responses import JSONResponse, Response, StreamingResponse # type: ignore
 from pydantic import BaseModel
-from typing import List, Dict, Optional, Union
+from typing import Callable, List, Dict, Optional, Union
 import os
 from dotenv import load_dotenv
 from .rag_system import RAGSystem
 from .config import Config
+from .chat_retention import RetentionEngine
+from .llm_gateway import LLMGatewayError, LLMProviderError
+from .scheduler import build_schedule, assign_tasks, parse_start_date
+from .plan_generation import PlanGenerator, parse_plan_response
+from .plan_store import PlanStore, week_numbers
+from .job_queue import JobQueue, TERMINAL_STATES
+from .tenant_kb import TenantKnowledgeBase, validate_tenant_id
+from .vector_db import SnapshotWatcher
+from .prefetch import PlanPrefetcher
+from .goal_clusters import GoalClusters
+from .chat_export import ChatExport, parse_export_time
+from .admission import AdmissionController, AdmissionMiddleware, AdmissionRejected, client_key
+from datetime import date
 import json
 import logging
+import asyncio
+import threading
+import uuid
+import hmac
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
 
 # Initialize FastAPI app
 app = FastAPI(title="Flex AI API", description="API for Flex AI productivity assistant")
+config = Config()
+
+# Admission control; added before CORS so it runs inside it and 429s still carry CORS headers
+admission = AdmissionController(config)
+app.add_middleware(AdmissionMiddleware, controller=admission)
 
 # Add CORS middleware
 app.add_middleware(
@@ -24,9 +48,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(LLMGatewayError)
+async def llm_gateway_error_handler(request: Request, exc: LLMGatewayError):
+    """Shed load with 503 + Retry-After instead of failing as a 500"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, int(round(exc.retry_after))))}
+    )
+
+@app.exception_handler(LLMProviderError)
+async def llm_provider_error_handler(request: Request, exc: LLMProviderError):
+    """The provider rejected the call; retrying the same request will not help"""
+    return JSONResponse(status_code=502, content={"detail": str(exc)})
+
 # Initialize RAG system
-config = Config()
-rag_system = RAGSystem(config)
+rag_system = RAGSystem(config, load_materials=not config.defer_ingest)
+plan_generator = PlanGenerator(rag_system.llm, config)
+retention_engine = RetentionEngine(rag_system.llm.chat_storage, config)
+plan_store = PlanStore(config)
+job_queue = JobQueue(config)
+knowledge_base = TenantKnowledgeBase(config, rag_system.vector_db)
+goal_clusters = GoalClusters(config, rag_system.vector_db, rag_system.compressor)
+if config.goal_clusters_enabled:
+    goal_clusters.load()
+prefetcher = PlanPrefetcher(config, knowledge_base, rag_system.compressor, rag_system.llm.gateway,
+                            goal_clusters=goal_clusters if config.goal_clusters_enabled else None)
+snapshot_watcher = SnapshotWatcher(rag_system.vector_db, interval=config.index_watch_interval_seconds)
+# Shared by every batch request, so concurrent cohorts split one LLM budget
+batch_executor = ThreadPoolExecutor(max_workers=config.batch_plan_concurrency, thread_name_prefix="plan-batch")
 
 # Pydantic models for request/response
 class UserProfile(BaseModel):
@@ -39,6 +89,10 @@ class UserProfile(BaseModel):
     habits: Union[str, None] = None
     rest_days: Union[str, None] = None
     learning_duration: int
+    focus_length: Union[int, None] = None
+    peak_focus_time: Union[str, None] = None
+    fixed_commitments: Union[str, List[dict], None] = None
+    start_date: Union[str, None] = None
 
 class ChatMessage(BaseModel):
     message: str
@@ -50,11 +104,48 @@ class RoadmapRequest(BaseModel):
 class FormSubmission(BaseModel):
     form_data: dict
     user_profile: Union[UserProfile, None] = None
+    user_id: Union[str, None] = None
+    session_id: Union[str, None] = None
+    tenant_id: Union[str, None] = None
+    where: Union[dict, None] = None
+    draft_id: Union[str, None] = None
+
+class FormPrefetch(BaseModel):
+    form_data: dict
+    draft_id: Union[str, None] = None
+    tenant_id: Union[str, None] = None
+    where: Union[dict, None] = None
+    speculate: bool = False
+
+class SearchRequest(BaseModel):
+    query: str
+    n_results: int = 5
+    where: Union[dict, None] = None
+    tenant_id: Union[str, None] = None
+
+class PlanRegeneration(BaseModel):
+    weeks: str
+    feedback: Union[str, None] = None
+
+class FormBatch(BaseModel):
+    submissions: List[FormSubmission]
+
+# Job kinds anyone may queue; the others rebuild shared state and need X-Admin-Token
+PUBLIC_JOB_KINDS = ("plan", "roadmap")
+# Queued by the server itself (document uploads), never through /api/jobs
+INTERNAL_JOB_KINDS = ("tenant_ingest",)
+
+class JobRequest(BaseModel):
+    kind: str
+    payload: dict = {}
+    priority: int = 0
+    webhook_url: Union[str, None] = None
 
 class ChatInteraction(BaseModel):
     message: str
     context: dict = {}
     history: list = []
+    session_id: Union[str, None] = None
 
 def map_preferences_to_profile(prefs: dict) -> UserProfile:
     """Map frontend form data to backend UserProfile"""
@@ -90,6 +181,15 @@ def map_preferences_to_profile(prefs: dict) -> UserProfile:
         except (ValueError, TypeError):
             learning_duration = 4
         
+        try:
+            focus_length = int(prefs['focus_length']) if prefs.get('focus_length') else None
+        except (ValueError, TypeError):
+            focus_length = None
+
+        start_date = prefs.get('start_date') or None
+        if start_date:
+            start_date = parse_start_date(start_date).isoformat()
+        
         # Create and return the profile
         return UserProfile(
             goal=goal,
@@ -100,7 +200,11 @@ def map_preferences_to_profile(prefs: dict) -> UserProfile:
             work_style=prefs.get('work_style', 'structured'),
             habits=prefs.get('habits', ''),
             rest_days=prefs.get('rest_days', ''),
-            learning_duration=learning_duration
+            learning_duration=learning_duration,
+            focus_length=focus_length,
+            peak_focus_time=prefs.get('peak_focus_time') or None,
+            fixed_commitments=prefs.get('fixed_commitments') or None,
+            start_date=start_date
         )
     except Exception as e:
         print("Error mapping preferences to profile:", str(e))
@@ -114,98 +218,280 @@ def normalize_plan_tasks(plan):
         ]
     return plan
 
+def build_plan_prompt(profile: UserProfile) -> str:
+    """
+    Prompt for a weekly-phase plan. Retrieved literature is passed to the
+    LLM separately; the daily schedule is computed locally, so the model
+    only produces milestones and tasks.
+    """
+    learning_duration = profile.learning_duration
+    focus_length = profile.focus_length or config.schedule_focus_length
+    return (
+        f"Create a detailed, actionable plan for the following specific goal as a JSON object with the following structure:\n"
+        f'{{"header_note": string, "goal": string, "weekly_phases": [{{"week": number, "milestone": string, "tasks": [string, ...]}}]}}\n'
+        f"- header_note: A motivating summary, overall strategy, tips, tricks, user state, mindset advice, and any high-level information from the productivity literature provided.\n"
+        f"- goal: The main goal.\n"
+        f"- weekly_phases: An array of weeks, each with a week number, milestone, and a list of actionable tasks.\n"
+        f"- The plan should be for the specific goal only (not a daily schedule; time blocks are assigned separately).\n"
+        f"- Present the plan ONLY as a valid JSON object, no markdown, no explanation, no extra text.\n"
+        f"- Make the plan motivating and easy to follow.\n"
+        f"- Use the productivity literature to provide personalized tips, mindset shifts, and strategies in the header_note.\n"
+        f"- Goal: {profile.goal}\n"
+        f"- Learning Duration (weeks): {learning_duration}\n"
+        f"- Available time: {profile.focus_periods} focus blocks of {focus_length} minutes per day\n"
+        f"- Work Style: {profile.work_style}\n"
+        f"- Habits: {profile.habits}\n"
+        f"- Rest Days: {profile.rest_days}\n\n"
+        f"Instructions:\n"
+        f"- **Strict Weekly Structure Requirement:**\n"
+        f"  - Divide the plan into exactly {learning_duration} weeks.\n"
+        f"  - Each week must have its own milestone, objectives, and tasks.\n"
+        f"  - Do not combine multiple weeks into a single milestone or section.\n"
+        f"  - The output must have one milestone and one section per week, matching the user's specified duration.\n"
+        f"- Break the main goal into weekly milestones and actionable tasks that fit the available focus time.\n"
+        f"- Keep each task to one short sentence.\n"
+    )
+
+def plan_request_summary(profile: UserProfile) -> str:
+    """The user turn stored for a plan request: what was asked for, not the whole prompt"""
+    return f"Create a plan\nGoal: {profile.goal}\nLearning Duration (weeks): {profile.learning_duration}"
+
+def roadmap_request_summary(goal: str) -> str:
+    """The user turn stored for a roadmap request"""
+    return f"Create a roadmap\nGoal: {goal}"
+
+def generate_plan_data(profile: UserProfile, retrieval: dict, context: Optional[List[str]] = None) -> dict:
+    """Single LLM call for short plans; outline plus parallel week blocks for long ones"""
+    if context is None:
+        context = rag_system.compressor.compress(profile.goal, retrieval)['documents']
+    if plan_generator.should_fan_out(profile):
+        return plan_generator.generate(profile, context=context)
+
+    response = rag_system.llm.generate_response(
+        build_plan_prompt(profile),
+        context=context,
+        context_refs=retrieval.get('refs'),
+        task="plan",
+        weeks=profile.learning_duration,
+        stored_query=plan_request_summary(profile)
+    )
+    response_content = response.get("response", "")
+    if not response_content:
+        raise ValueError("Empty response from LLM")
+    return parse_plan_response(response_content)
+
+def schedule_plan(profile: UserProfile, plan_data: dict) -> dict:
+    """Lay out focus/break blocks for every plan day and pack the weekly tasks into them"""
+    schedule = build_schedule(profile, default_focus_length=config.schedule_focus_length)
+    return assign_tasks(schedule, plan_data.get("weekly_phases", []))
+
+def store_plan(profile: UserProfile, plan_data: dict, retrieval: dict,
+               user_id: Optional[str] = None, session_id: Optional[str] = None) -> Optional[str]:
+    """
+    Persist a generated plan so later views are served from storage; None if
+    storage is unavailable. A plan the store rejects raises ValueError.
+    """
+    try:
+        # Pin the start date so the stored plan's schedule does not drift
+        if not profile.start_date:
+            profile.start_date = date.today().isoformat()
+        return plan_store.save_plan(
+            plan_data,
+            profile=profile.dict(),
+            user_id=user_id,
+            session_id=session_id,
+            context_refs=retrieval.get('refs')
+        )
+    except ValueError:
+        raise
+    except Exception as e:
+        print(f"Error storing plan: {str(e)}")
+        return None
+
+def parse_week_range(weeks: Optional[str]) -> Optional[range]:
+    """'3' or '3-5' -> range of week numbers; None means every week"""
+    if not weeks:
+        return None
+    try:
+        first, _, last = weeks.partition('-')
+        start, end = int(first), int(last or first)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="weeks must be a week number or a range like 3-5")
+    if start < 1 or end < start:
+        raise HTTPException(status_code=400, detail="Invalid week range")
+    return range(start, end + 1)
+
+def plan_etag(plan_id: str, version: int, weeks: Optional[range]) -> str:
+    suffix = f"-w{weeks.start}-{weeks.stop - 1}" if weeks else ""
+    return f'"{plan_id}-v{version}{suffix}"'
+
+def build_roadmap_prompt(goal: str, rag_context: List[str]) -> str:
+    context_text = "\n".join(rag_context)
+    return (
+        f"Context from productivity literature:\n{context_text}\n\n"
+        f"Create a detailed, actionable roadmap for the following goal:\n"
+        f"Goal: {goal}\n\n"
+        f"Instructions:\n"
+        f"- Break the goal into 3-6 major milestones.\n"
+        f"- For each milestone, list 3-5 actionable tasks.\n"
+        f"- If relevant, show dependencies.\n"
+        f"- Suggest a logical order or timeline for milestones.\n"
+        f"- Present the roadmap in a clear, structured format.\n"
+        f"- Make the roadmap motivating and easy to follow.\n"
+    )
+
+def validate_plan_data(plan_data: dict):
+    if not all(key in plan_data for key in ["header_note", "goal", "weekly_phases"]):
+        raise ValueError("Invalid plan structure: missing required fields")
+    if not isinstance(plan_data["weekly_phases"], list):
+        raise ValueError("Invalid plan structure: weekly_phases must be a list")
+    week_numbers(plan_data["weekly_phases"])
+
+def generate_validated_plan(profile: UserProfile, retrieval: dict, context: Optional[List[str]] = None) -> dict:
+    """Generate a plan, check its structure and normalize its tasks"""
+    plan_data = generate_plan_data(profile, retrieval, context=context)
+    validate_plan_data(plan_data)
+    return normalize_plan_tasks(plan_data)
+
+def form_fingerprint(profile: UserProfile, tenant_id: Optional[str], where: Optional[dict]) -> str:
+    """Everything a generated plan depends on, for matching a speculative plan to its submit"""
+    return prefetcher.fingerprint(tenant_id, where, profile.dict())
+
+def stored_plan_response(stored: dict, week_range: Optional[range]) -> dict:
+    """Response body for a stored plan, with its schedule limited to week_range"""
+    plan_data = {
+        "header_note": stored["header_note"],
+        "goal": stored["goal"],
+        "weekly_phases": stored["weekly_phases"]
+    }
+    if stored["profile"]:
+        schedule = schedule_plan(UserProfile(**stored["profile"]), plan_data)
+        if week_range:
+            schedule["days"] = [day for day in schedule["days"] if day["week"] in week_range]
+        plan_data["schedule"] = schedule
+    return {
+        "plan": plan_data,
+        "plan_id": stored["plan_id"],
+        "version": stored["version"],
+        "user_id": stored["user_id"],
+        "session_id": stored["session_id"],
+        "created_at": stored["created_at"],
+        "updated_at": stored["updated_at"]
+    }
+
+# Background job handlers
+def run_plan_job(payload: dict, progress) -> dict:
+    """Generate and store a plan from form data; the result points at the stored plan"""
+    profile = map_preferences_to_profile(payload.get('form_data', {}))
+    progress(0.1, "Retrieving context")
+    retrieval = knowledge_base.search(payload.get('tenant_id'), profile.goal, n_results=5, where=payload.get('where'))
+    progress(0.2, "Generating plan")
+    plan_data = generate_validated_plan(profile, retrieval)
+    progress(0.9, "Saving plan")
+    plan_id = store_plan(profile, plan_data, retrieval,
+                         user_id=payload.get('user_id'), session_id=payload.get('session_id'))
+    if plan_id is None:
+        raise RuntimeError("Failed to store the generated plan")
+    return {"plan_id": plan_id}
+
+def run_roadmap_job(payload: dict, progress) -> dict:
+    goal = payload.get('goal', '').strip()
+    if not goal:
+        raise ValueError("Goal is required")
+    progress(0.1, "Retrieving context")
+    rag_context = rag_system.compressor.compress(goal, rag_system.vector_db.search(goal, n_results=5))['documents']
+    progress(0.2, "Generating roadmap")
+    return {"roadmap": rag_system.llm.generate_response(build_roadmap_prompt(goal, rag_context), task="roadmap",
+                                                        stored_query=roadmap_request_summary(goal))}
+
+def run_ingest_job(payload: dict, progress) -> dict:
+    """Build the vector database from Study_Materials"""
+    report = rag_system._load_study_materials(progress=progress)
+    return {"documents": rag_system.vector_db.count(), "dedup": report}
+
+def tenant_upload_path(payload: dict) -> str:
+    """The job's uploaded file, which must lie in UPLOAD_DIR/<tenant_id>; ValueError otherwise"""
+    tenant_dir = os.path.realpath(os.path.join(config.upload_dir, validate_tenant_id(payload.get('tenant_id'))))
+    path = os.path.realpath(str(payload.get('path') or ''))
+    if os.path.dirname(path) != tenant_dir or not os.path.isfile(path):
+        raise ValueError("Upload path is not a file in the tenant's upload directory")
+    return path
+
+def run_tenant_ingest_job(payload: dict, progress) -> dict:
+    """Chunk an uploaded document into its tenant's namespace"""
+    path = tenant_upload_path(payload)
+    progress(0.1, f"Processing {payload['source']}")
+    report = knowledge_base.ingest(payload['tenant_id'], path, payload['source'])
+    return {"tenant_id": payload['tenant_id'], "source": payload['source'], "chunks": report["kept"], "dedup": report}
+
+def remove_tenant_upload(payload: dict):
+    """Delete the uploaded file once its ingest job has succeeded or finally failed"""
+    try:
+        os.remove(tenant_upload_path(payload))
+    except ValueError:
+        # Already removed, or never an upload: nothing of ours to delete
+        pass
+
+def run_goal_cluster_job(payload: dict, progress) -> dict:
+    """Cluster historical goals and precompute a context pack per cluster"""
+    return goal_clusters.rebuild(plan_store, rag_system.llm.chat_storage, progress=progress)
+
+job_queue.register("plan", run_plan_job)
+job_queue.register("roadmap", run_roadmap_job)
+job_queue.register("ingest", run_ingest_job)
+job_queue.register("tenant_ingest", run_tenant_ingest_job, on_finish=remove_tenant_upload)
+job_queue.register("goal_clusters", run_goal_cluster_job)
+
 # API endpoints
 @app.post("/api/chat")
-async def chat(message: ChatMessage):
+def chat(message: ChatMessage):
     """Chat endpoint for interactive conversation"""
     try:
         response = rag_system.query(message.message)
         return {"response": response}
+    except (LLMGatewayError, LLMProviderError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/generate-plan")
-async def generate_plan(profile: UserProfile):
+def generate_plan(profile: UserProfile, user_id: Optional[str] = None, session_id: Optional[str] = None,
+                  tenant_id: Optional[str] = None):
     """Generate a personalized productivity plan"""
+    if profile.start_date:
+        try:
+            profile.start_date = parse_start_date(profile.start_date).isoformat()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     try:
         # Get relevant context from RAG
-        rag_context = rag_system.vector_db.search(profile.goal, n_results=5)['documents']
-        context_text = "\n".join(rag_context)
-
-        # Get learning_duration if present (default to 4 if not)
-        learning_duration = getattr(profile, 'learning_duration', 4)
-
-        plan_prompt = (
-            f"Context from productivity literature:\n{context_text}\n\n"
-            f"Create a detailed, actionable plan for the following specific goal as a JSON object with the following structure:\n"
-            f'{{"header_note": string, "goal": string, "weekly_phases": [{{"week": number, "milestone": string, "tasks": [string, ...]}}]}}\n'
-            f"- header_note: A motivating summary, overall strategy, tips, tricks, user state, mindset advice, and any high-level information from the RAG documents.\n"
-            f"- goal: The main goal.\n"
-            f"- weekly_phases: An array of weeks, each with a week number, milestone, and a list of actionable tasks.\n"
-            f"- The plan should be for the specific goal only (not a full daily schedule).\n"
-            f"- Present the plan ONLY as a valid JSON object, no markdown, no explanation, no extra text.\n"
-            f"- Make the plan motivating and easy to follow.\n"
-            f"- Use the RAG context to provide personalized tips, mindset shifts, and strategies in the header_note.\n"
-            f"- Goal: {profile.goal}\n"
-            f"- Learning Duration (weeks): {learning_duration}\n"
-            f"- Wake Up Time: {profile.wake_time}\n"
-            f"- Sleep Time: {profile.sleep_time}\n"
-            f"- Focus Periods Per Day: {profile.focus_periods}\n"
-            f"- Break Duration: {profile.break_duration} minutes\n"
-            f"- Work Style: {profile.work_style}\n"
-            f"- Habits: {profile.habits}\n"
-            f"- Rest Days: {profile.rest_days}\n\n"
-            f"Instructions:\n"
-            f"- **Strict Weekly Structure Requirement:**\n"
-            f"  - Divide the plan into exactly {learning_duration} weeks.\n"
-            f"  - Each week must have its own milestone, objectives, and tasks.\n"
-            f"  - Do not combine multiple weeks into a single milestone or section.\n"
-            f"  - The output must have one milestone and one section per week, matching the user's specified duration.\n"
-            f"- Break the main goal into weekly milestones and actionable tasks.\n"
-            f"- Distribute tasks over the available focus periods.\n"
-            f"- Suggest a daily schedule.\n"
-        )
+        retrieval, context = prefetcher.retrieve(tenant_id, profile.goal, n_results=5)
 
-        response = rag_system.llm.generate_response(plan_prompt)
-        cleaned = response.strip()
-        if cleaned.startswith('```json'):
-            cleaned = cleaned.replace('```json', '').replace('```', '').strip()
-        elif cleaned.startswith('```'):
-            cleaned = cleaned.replace('```', '').replace('```', '').strip()
-        plan_data = json.loads(cleaned)
-        plan_data = normalize_plan_tasks(plan_data)
-        return {"plan": plan_data}
+        plan_data = generate_validated_plan(profile, retrieval, context=context)
+        plan_id = store_plan(profile, plan_data, retrieval, user_id=user_id, session_id=session_id)
+        plan_data["schedule"] = schedule_plan(profile, plan_data)
+        return {"plan": plan_data, "plan_id": plan_id}
+    except (LLMGatewayError, LLMProviderError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/generate-roadmap")
-async def generate_roadmap(request: RoadmapRequest):
+def generate_roadmap(request: RoadmapRequest):
     """Generate a detailed roadmap for a specific goal"""
     try:
-        # Get relevant context from RAG
-        rag_context = rag_system.vector_db.search(request.goal, n_results=5)['documents']
-        context_text = "\n".join(rag_context)
-
-        roadmap_prompt = (
-            f"Context from productivity literature:\n{context_text}\n\n"
-            f"Create a detailed, actionable roadmap for the following goal:\n"
-            f"Goal: {request.goal}\n\n"
-            f"Instructions:\n"
-            f"- Break the goal into 3-6 major milestones.\n"
-            f"- For each milestone, list 3-5 actionable tasks.\n"
-            f"- If relevant, show dependencies.\n"
-            f"- Suggest a logical order or timeline for milestones.\n"
-            f"- Present the roadmap in a clear, structured format.\n"
-            f"- Make the roadmap motivating and easy to follow.\n"
-        )
-
-        roadmap = rag_system.llm.generate_response(roadmap_prompt)
+        # Get relevant context from RAG, precomputed for recurring goals
+        _, rag_context = prefetcher.retrieve(None, request.goal, n_results=5)
+        roadmap = rag_system.llm.generate_response(build_roadmap_prompt(request.goal, rag_context), task="roadmap",
+                                                   stored_query=roadmap_request_summary(request.goal))
         return {"roadmap": roadmap}
+    except (LLMGatewayError, LLMProviderError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/form")
-async def handle_form(form_data: FormSubmission):
+def handle_form(form_data: FormSubmission):
     print("Received /api/form request")
     try:
         # Extract form data from the request
@@ -213,16 +499,16 @@ async def handle_form(form_data: FormSubmission):
         print("Form data received:", form_data_dict)
         
         # Map form data to profile
-        profile = map_preferences_to_profile(form_data_dict)
+        try:
+            profile = map_preferences_to_profile(form_data_dict)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         print("Mapped profile:", profile)
         
-        # Get learning duration from form data
-        learning_duration = form_data_dict.get('learning_duration', 4)
-        
-        # Search for relevant context
+        # Search for relevant context, usually already fetched by /api/form/prefetch
         try:
-            rag_context = rag_system.vector_db.search(profile.goal, n_results=5)['documents']
-            print("RAG context found:", len(rag_context), "documents")
+            retrieval, context = prefetcher.retrieve(form_data.tenant_id, profile.goal, n_results=5, where=form_data.where)
+            print("RAG context found:", len(retrieval['documents']), "documents")
         except Exception as e:
             print("Error searching vector DB:", str(e))
             raise HTTPException(
@@ -230,68 +516,26 @@ async def handle_form(form_data: FormSubmission):
                 detail="Failed to retrieve relevant context for your goal. Please try again."
             )
         
-        context_text = "\n".join(rag_context)
-        
-        # Generate plan prompt
-        plan_prompt = (
-            f"Context from productivity literature:\n{context_text}\n\n"
-            f"Create a detailed, actionable plan for the following specific goal as a JSON object with the following structure:\n"
-            f'{{"header_note": string, "goal": string, "weekly_phases": [{{"week": number, "milestone": string, "tasks": [string, ...]}}]}}\n'
-            f"- header_note: A motivating summary, overall strategy, tips, tricks, user state, mindset advice, and any high-level information from the RAG documents.\n"
-            f"- goal: The main goal.\n"
-            f"- weekly_phases: An array of weeks, each with a week number, milestone, and a list of actionable tasks.\n"
-            f"- The plan should be for the specific goal only (not a full daily schedule).\n"
-            f"- Present the plan ONLY as a valid JSON object, no markdown, no explanation, no extra text.\n"
-            f"- Make the plan motivating and easy to follow.\n"
-            f"- Use the RAG context to provide personalized tips, mindset shifts, and strategies in the header_note.\n"
-            f"- Goal: {profile.goal}\n"
-            f"- Learning Duration (weeks): {learning_duration}\n"
-            f"- Wake Up Time: {profile.wake_time}\n"
-            f"- Sleep Time: {profile.sleep_time}\n"
-            f"- Focus Periods Per Day: {profile.focus_periods}\n"
-            f"- Break Duration: {profile.break_duration} minutes\n"
-            f"- Work Style: {profile.work_style}\n"
-            f"- Habits: {profile.habits}\n"
-            f"- Rest Days: {profile.rest_days}\n\n"
-            f"Instructions:\n"
-            f"- **Strict Weekly Structure Requirement:**\n"
-            f"  - Divide the plan into exactly {learning_duration} weeks.\n"
-            f"  - Each week must have its own milestone, objectives, and tasks.\n"
-            f"  - Do not combine multiple weeks into a single milestone or section.\n"
-            f"  - The output must have one milestone and one section per week, matching the user's specified duration.\n"
-            f"- Break the main goal into weekly milestones and actionable tasks.\n"
-            f"- Distribute tasks over the available focus periods.\n"
-            f"- Suggest a daily schedule.\n"
-        )
-        
         # Generate response
         try:
-            response = rag_system.llm.generate_response(plan_prompt)
-            print("LLM response received:", response)
-            
-            # Get the response content from the dictionary
-            response_content = response.get("response", "")
-            if not response_content:
-                raise ValueError("Empty response from LLM")
-            
-            # Clean and parse the response
-            cleaned = response_content.strip()
-            if cleaned.startswith('```json'):
-                cleaned = cleaned.replace('```json', '').replace('```', '').strip()
-            elif cleaned.startswith('```'):
-                cleaned = cleaned.replace('```', '').replace('```', '').strip()
-            
             # Parse JSON and validate structure
             try:
-                plan_data = json.loads(cleaned)
-                if not all(key in plan_data for key in ["header_note", "goal", "weekly_phases"]):
-                    raise ValueError("Invalid plan structure: missing required fields")
-                if not isinstance(plan_data["weekly_phases"], list):
-                    raise ValueError("Invalid plan structure: weekly_phases must be a list")
+                # Adopt the plan speculatively generated for this exact draft, if any
+                plan_data = prefetcher.claim(form_data.draft_id,
+                                             form_fingerprint(profile, form_data.tenant_id, form_data.where))
+                if plan_data is not None:
+                    print("Adopted speculative plan for draft", form_data.draft_id)
+                else:
+                    plan_data = generate_plan_data(profile, retrieval, context=context)
+                    print("Plan generated with", len(plan_data.get("weekly_phases", [])), "weekly phases")
+                    validate_plan_data(plan_data)
+                    plan_data = normalize_plan_tasks(plan_data)
                 
-                # Normalize tasks
-                plan_data = normalize_plan_tasks(plan_data)
-                return {"plan": plan_data}
+                # Lay the tasks out on the local schedule
+                plan_id = store_plan(profile, plan_data, retrieval,
+                                     user_id=form_data.user_id, session_id=form_data.session_id)
+                plan_data["schedule"] = schedule_plan(profile, plan_data)
+                return {"plan": plan_data, "plan_id": plan_id}
                 
             except json.JSONDecodeError as e:
                 print("JSON decode error:", str(e))
@@ -306,6 +550,8 @@ async def handle_form(form_data: FormSubmission):
                     detail=str(e)
                 )
                 
+        except (LLMGatewayError, LLMProviderError):
+            raise
         except Exception as e:
             print("LLM error:", str(e))
             raise HTTPException(
@@ -315,6 +561,8 @@ async def handle_form(form_data: FormSubmission):
             
     except HTTPException:
         raise
+    except (LLMGatewayError, LLMProviderError):
+        raise
     except Exception as e:
         print("Unexpected error in /api/form:", str(e))
         raise HTTPException(
@@ -322,21 +570,572 @@ async def handle_form(form_data: FormSubmission):
             detail="An unexpected error occurred. Please try again."
         )
 
+def admit_speculation() -> Optional[Callable[[], None]]:
+    """
+    Batch admission slot for a speculative plan generation, as the function
+    giving it back (safe to call from any thread); None when no slot is free.
+    Must be called on the event loop.
+    """
+    slot = admission.try_acquire("batch")
+    if slot is None:
+        return None
+    loop = asyncio.get_running_loop()
+    return lambda: loop.call_soon_threadsafe(admission.release, *slot)
+
+@app.post("/api/form/prefetch", status_code=202)
+async def prefetch_form(prefetch: FormPrefetch):
+    """
+    Called by the onboarding wizard with the draft form once the goal is
+    known. Warms retrieval and the compressed context for the goal. With
+    speculate=true and a draft_id it also starts generating the plan, at
+    low priority, which /api/form adopts when submitted with the same
+    draft_id and an identical profile. Speculative generations hold a batch
+    admission slot and are skipped when none is free.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        profile = map_preferences_to_profile(prefetch.form_data)
+        if prefetch.tenant_id:
+            validate_tenant_id(prefetch.tenant_id)
+        retrieval, context = await loop.run_in_executor(
+            None, lambda: prefetcher.retrieve(prefetch.tenant_id, profile.goal, n_results=5, where=prefetch.where)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    speculating = False
+    if prefetch.speculate and prefetch.draft_id and config.prefetch_speculation_enabled:
+        speculating = prefetcher.speculate(
+            prefetch.draft_id,
+            form_fingerprint(profile, prefetch.tenant_id, prefetch.where),
+            lambda: generate_validated_plan(profile, retrieval, context),
+            admit=admit_speculation if admission.enabled else None
+        )
+    return {"draft_id": prefetch.draft_id, "documents": len(retrieval['documents']), "speculating": speculating}
+
+@app.post("/api/form/batch")
+async def handle_form_batch(batch: FormBatch):
+    """
+    Generate plans for a cohort and stream one NDJSON line per submission
+    as its plan finishes. Submissions with identical profiles share one
+    generation, identical goals share one retrieval, and all retrievals run
+    as a single batched search. Lines carry the submission's index.
+    Retrieval, storage and scheduling run in the threadpool, never on the
+    event loop.
+    """
+    loop = asyncio.get_running_loop()
+    if len(batch.submissions) > config.batch_max_submissions:
+        raise HTTPException(status_code=413, detail=f"At most {config.batch_max_submissions} submissions per batch")
+
+    errors = []
+    groups = {}
+    for index, submission in enumerate(batch.submissions):
+        try:
+            profile = map_preferences_to_profile(submission.form_data)
+            if submission.tenant_id:
+                validate_tenant_id(submission.tenant_id)
+        except ValueError as e:
+            errors.append({"index": index, "user_id": submission.user_id, "error": str(e)})
+            continue
+        key = json.dumps([submission.tenant_id, submission.where, profile.dict()], sort_keys=True)
+        groups.setdefault(key, []).append((index, submission, profile))
+
+    def retrieval_key(submission: FormSubmission, profile: UserProfile) -> tuple:
+        where = json.dumps(submission.where, sort_keys=True) if submission.where else None
+        return submission.tenant_id, profile.goal.strip().lower(), where
+
+    def retrieve_all() -> dict:
+        # One batched search over the shared corpus per distinct filter, then
+        # merge in each tenant's namespace (which may load it from disk)
+        goals_by_filter = {}
+        for members in groups.values():
+            _, goal, where = retrieval_key(members[0][1], members[0][2])
+            goals_by_filter.setdefault(where, {})[goal] = None
+        shared_results = {}
+        for where, goals in goals_by_filter.items():
+            results = rag_system.vector_db.search_batch(list(goals), n_results=5,
+                                                        where=json.loads(where) if where else None)
+            shared_results.update({(goal, where): result for goal, result in zip(goals, results)})
+        retrievals = {}
+        for members in groups.values():
+            tenant_id, goal, where = retrieval_key(members[0][1], members[0][2])
+            if (tenant_id, goal, where) not in retrievals:
+                retrievals[(tenant_id, goal, where)] = knowledge_base.search(
+                    tenant_id, goal, n_results=5, shared_results=shared_results[(goal, where)],
+                    where=members[0][1].where
+                )
+        return retrievals
+
+    try:
+        retrievals = await loop.run_in_executor(None, retrieve_all)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def finish(index: int, submission: FormSubmission, profile: UserProfile, plan: dict, retrieval: dict) -> dict:
+        """Store one submission's plan and lay out its schedule (a SQLite write and CPU work)"""
+        plan_id = store_plan(profile, plan, retrieval, user_id=submission.user_id, session_id=submission.session_id)
+        plan["schedule"] = schedule_plan(profile, plan)
+        return {"index": index, "user_id": submission.user_id, "plan_id": plan_id, "plan": plan}
+
+    async def generate(key: str, profile: UserProfile, retrieval: dict):
+        try:
+            return key, await loop.run_in_executor(batch_executor, generate_validated_plan, profile, retrieval), None
+        except Exception as e:
+            return key, None, e
+
+    async def stream():
+        for error in errors:
+            yield json.dumps(error) + "\n"
+
+        tasks = []
+        for key, members in groups.items():
+            submission, profile = members[0][1], members[0][2]
+            retrieval = retrievals[retrieval_key(submission, profile)]
+            tasks.append(asyncio.ensure_future(generate(key, profile, retrieval)))
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                key, plan_data, error = await next_done
+                for index, submission, profile in groups[key]:
+                    if error is not None:
+                        print(f"Error generating batch plan {index}: {str(error)}")
+                        line = {"index": index, "user_id": submission.user_id, "error": str(error)}
+                        if isinstance(error, LLMGatewayError):
+                            line["retry_after"] = error.retry_after
+                        yield json.dumps(line) + "\n"
+                        continue
+                    retrieval = retrievals[retrieval_key(submission, profile)]
+                    try:
+                        line = await loop.run_in_executor(None, finish, index, submission, profile,
+                                                          dict(plan_data), retrieval)
+                    except Exception as e:
+                        print(f"Error storing batch plan {index}: {str(e)}")
+                        yield json.dumps({"index": index, "user_id": submission.user_id, "error": str(e)}) + "\n"
+                        continue
+                    yield json.dumps(line) + "\n"
+        finally:
+            # Client went away: drop generations that have not started yet
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/api/tenants/{tenant_id}/documents", status_code=202)
+async def upload_tenant_document(tenant_id: str, file: UploadFile = File(...)):
+    """
+    Stream an uploaded PDF, DOCX or TXT file to disk and queue it for
+    ingestion into the tenant's knowledge base namespace.
+    """
+    try:
+        validate_tenant_id(tenant_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    source = os.path.basename(file.filename or '')
+    extension = os.path.splitext(source)[1].lower()
+    if extension not in ('.pdf', '.docx', '.txt'):
+        raise HTTPException(status_code=400, detail="Only PDF, DOCX and TXT files are supported")
+
+    upload_dir = os.path.join(config.upload_dir, tenant_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, f"{uuid.uuid4()}{extension}")
+    max_bytes = int(config.upload_max_mb * 1024 * 1024)
+    written = 0
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                block = await file.read(1024 * 1024)
+                if not block:
+                    break
+                written += len(block)
+                if written > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Files are limited to {config.upload_max_mb:g} MB")
+                f.write(block)
+    except HTTPException:
+        os.remove(path)
+        raise
+    finally:
+        await file.close()
+
+    job_id = job_queue.enqueue("tenant_ingest", {"tenant_id": tenant_id, "path": path, "source": source})
+    return {
+        "job_id": job_id,
+        "tenant_id": tenant_id,
+        "source": source,
+        "bytes": written,
+        "status_url": f"/api/jobs/{job_id}"
+    }
+
+@app.get("/api/tenants/{tenant_id}/search")
+def search_tenant_knowledge(tenant_id: str, q: str, n_results: int = 5):
+    """Search the tenant's namespace together with the shared corpus"""
+    try:
+        validate_tenant_id(tenant_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return knowledge_base.search(tenant_id, q, n_results=max(1, min(n_results, 20)))
+
+@app.post("/api/search")
+def search_knowledge(search: SearchRequest):
+    """
+    Search the knowledge base, optionally restricted by metadata, e.g.
+    {"where": {"source": {"$in": ["Deep Work.pdf"]}}}
+    """
+    try:
+        if search.tenant_id:
+            validate_tenant_id(search.tenant_id)
+        return knowledge_base.search(search.tenant_id, search.query,
+                                     n_results=max(1, min(search.n_results, 20)), where=search.where)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/api/chat/interactive")
-async def interactive_chat(interaction: ChatInteraction):
+def interactive_chat(interaction: ChatInteraction):
     print("Received /api/chat/interactive request")
     try:
         chat_response = rag_system.process_chat_interaction(
             interaction.message,
             interaction.context,
-            interaction.history
+            interaction.history,
+            session_id=interaction.session_id
         )
         print("Chat response:", chat_response)
         return {"response": chat_response}
+    except (LLMGatewayError, LLMProviderError):
+        raise
     except Exception as e:
         print("Error in /api/chat/interactive:", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def stream_chat_turn(websocket: WebSocket, session_id: str, message: str):
+    """Run one chat turn in the threadpool and forward its tokens to the socket as they arrive."""
+    loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def on_token(text: str):
+        loop.call_soon_threadsafe(tokens.put_nowait, text)
+
+    def finished(future):
+        # Read here too, so a turn abandoned on disconnect does not log an unretrieved exception
+        if not future.cancelled():
+            future.exception()
+        # Queued after every token the turn produced, so it marks the end of the stream
+        tokens.put_nowait(None)
+
+    turn = loop.run_in_executor(None, rag_system.stream_chat_interaction, message, session_id, on_token, cancelled)
+    turn.add_done_callback(finished)
+    try:
+        while True:
+            text = await tokens.get()
+            if text is None:
+                break
+            await websocket.send_json({"type": "token", "content": text})
+    except BaseException:
+        # Client went away mid-stream: stop generating
+        cancelled.set()
+        raise
+    try:
+        await turn
+    except LLMGatewayError as e:
+        await websocket.send_json({"type": "error", "status": 503, "detail": str(e), "retry_after": e.retry_after})
+        return
+    except LLMProviderError as e:
+        await websocket.send_json({"type": "error", "status": 502, "detail": str(e)})
+        return
+    except Exception as e:
+        print(f"Error in chat turn {session_id}: {str(e)}")
+        await websocket.send_json({"type": "error", "status": 500, "detail": str(e)})
+        return
+    await websocket.send_json({"type": "done", "session_id": session_id})
+
+@app.websocket("/ws/chat/{session_id}")
+async def chat_socket(websocket: WebSocket, session_id: str):
+    """
+    Chat over a WebSocket bound to one session. The server holds the
+    history, so each client frame carries only the new message, either as
+    text or as {"message": "..."}. The reply streams back as
+    {"type": "token", "content": ...} frames and ends with
+    {"type": "done"} or {"type": "error"}. Turns are admitted as
+    interactive requests.
+    """
+    if not session_id or len(session_id) > 128:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    client = client_key(websocket.scope)
+    try:
+        while True:
+            frame = await websocket.receive_text()
+            try:
+                message = json.loads(frame).get("message", "")
+            except (ValueError, AttributeError):
+                message = frame
+            message = (message or "").strip() if isinstance(message, str) else ""
+            if not message:
+                await websocket.send_json({"type": "error", "status": 400, "detail": "Please enter a message to continue."})
+                continue
+
+            slot = None
+            if admission.enabled:
+                try:
+                    slot = await admission.acquire("interactive", client)
+                except AdmissionRejected as e:
+                    await websocket.send_json({"type": "error", "status": 429, "detail": str(e), "retry_after": e.retry_after})
+                    continue
+            try:
+                await stream_chat_turn(websocket, session_id, message)
+            finally:
+                if slot is not None:
+                    admission.release(*slot)
+    except WebSocketDisconnect:
+        return
+    except Exception as e:
+        print(f"Error in chat socket {session_id}: {str(e)}")
+
+@app.get("/api/plans")
+def list_plans(user_id: Optional[str] = None, session_id: Optional[str] = None,
+               goal: Optional[str] = None, limit: int = 20):
+    """List stored plans, newest first"""
+    return {"plans": plan_store.list_plans(user_id=user_id, session_id=session_id,
+                                           goal=goal, limit=max(1, min(limit, 100)))}
+
+@app.get("/api/plans/{plan_id}")
+def get_plan(plan_id: str, request: Request, weeks: Optional[str] = None):
+    """
+    Stored plan with its schedule, without calling the LLM.
+    `weeks` ("3" or "3-5") limits the response to those weeks; the ETag
+    changes whenever the plan does, so If-None-Match gets a 304.
+    """
+    week_range = parse_week_range(weeks)
+    version = plan_store.get_version(plan_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Plan not found")
+
+    etag = plan_etag(plan_id, version, week_range)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    stored = plan_store.get_plan(plan_id, weeks=week_range)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    return JSONResponse(content=stored_plan_response(stored, week_range), headers=headers)
+
+@app.post("/api/plans/{plan_id}/regenerate")
+def regenerate_plan_weeks(plan_id: str, regeneration: PlanRegeneration, request: Request):
+    """
+    Re-plan a week or range of weeks of a stored plan, reusing its profile,
+    header note and retrieved literature. Send If-Match with the plan's
+    ETag to avoid overwriting a concurrent edit.
+    """
+    week_range = parse_week_range(regeneration.weeks)
+    if week_range is None:
+        raise HTTPException(status_code=400, detail="weeks is required")
+    stored = plan_store.get_plan(plan_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Plan not found")
+
+    if_match = request.headers.get("if-match")
+    if if_match and if_match.strip() != plan_etag(plan_id, stored["version"], None):
+        raise HTTPException(status_code=412, detail="Plan has changed since it was fetched")
+    known_weeks = {phase["week"] for phase in stored["weekly_phases"]}
+    if not all(week in known_weeks for week in week_range):
+        raise HTTPException(status_code=400, detail="Week range is outside the plan")
+    if not stored["profile"]:
+        raise HTTPException(status_code=400, detail="Plan has no stored profile to regenerate from")
+
+    try:
+        profile = UserProfile(**stored["profile"])
+        milestones = " ".join(phase.get("milestone") or "" for phase in stored["weekly_phases"] if phase["week"] in week_range)
+        context = rag_system.compressor.compress(
+            f"{profile.goal} {milestones} {regeneration.feedback or ''}",
+            rag_system.vector_db.get_chunks(stored["context_refs"] or [])
+        )['documents']
+        phases = plan_generator.regenerate(profile, stored, list(week_range),
+                                           context=context, feedback=regeneration.feedback)
+    except (LLMGatewayError, LLMProviderError):
+        raise
+    except json.JSONDecodeError as e:
+        print("JSON decode error:", str(e))
+        raise HTTPException(status_code=500, detail="Failed to parse the regenerated weeks. Please try again.")
+    except Exception as e:
+        print(f"Error regenerating plan weeks: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    version = plan_store.replace_weeks(plan_id, phases, expected_version=stored["version"])
+    if version is None:
+        raise HTTPException(status_code=409, detail="Plan was changed while regenerating. Please try again.")
+
+    stored = plan_store.get_plan(plan_id)
+    return JSONResponse(
+        content=stored_plan_response(stored, None),
+        headers={"ETag": plan_etag(plan_id, version, None), "Cache-Control": "private, no-cache"}
+    )
+
+@app.post("/api/jobs", status_code=202)
+def create_job(job: JobRequest, x_admin_token: Optional[str] = Header(None)):
+    """
+    Queue a plan or roadmap job and return immediately; ingest and
+    goal_clusters jobs need X-Admin-Token. Poll /api/jobs/{job_id}, follow
+    /api/jobs/{job_id}/events, or pass a webhook_url to receive the final state.
+    """
+    if job.kind in INTERNAL_JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"{job.kind} jobs are created by their own endpoint")
+    if job.kind not in PUBLIC_JOB_KINDS:
+        require_admin(x_admin_token)
+    try:
+        job_id = job_queue.enqueue(job.kind, job.payload, priority=job.priority, webhook_url=job.webhook_url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/jobs/{job_id}",
+        "events_url": f"/api/jobs/{job_id}/events"
+    }
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    """Job state, progress and, once finished, its result or error"""
+    job = job_queue.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events with the job state on every change, ending when the job finishes"""
+    if job_queue.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        revision = -1
+        idle = 0.0
+        while True:
+            job = job_queue.get_job(job_id)
+            if job is None:
+                return
+            if job["revision"] != revision:
+                revision = job["revision"]
+                idle = 0.0
+                yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+                if job["status"] in TERMINAL_STATES:
+                    return
+            elif idle >= 15:
+                # Keep proxies from closing an idle stream
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(0.5)
+            idle += 0.5
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.on_event("startup")
+async def startup():
+    """Start background chat history retention and job workers"""
+    if config.chat_retention_enabled:
+        retention_engine.start()
+    job_queue.start()
+    if config.defer_ingest and not rag_system.vector_db.count():
+        # Every API worker runs startup; the shared queue keeps a single ingest job
+        job_queue.enqueue("ingest", priority=10, unique=True)
+    if config.index_watch_enabled:
+        snapshot_watcher.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Flush write-behind chat storage so no messages are lost"""
+    retention_engine.stop()
+    job_queue.stop()
+    snapshot_watcher.stop()
+    prefetcher.close()
+    rag_system.llm.close()
+
+def require_admin(x_admin_token: Optional[str]):
+    """Fail closed: admin endpoints are off unless ADMIN_TOKEN is set, and need it to match."""
+    if not config.admin_token:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode('utf-8'), config.admin_token.encode('utf-8')):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/api/admin/reload-index")
+async def reload_index(x_admin_token: Optional[str] = Header(None)):
+    """
+    Load the vector index snapshot published in vector_db/ and swap it in.
+    Searches in flight finish on the previous generation.
+    """
+    require_admin(x_admin_token)
+    if not rag_system.vector_db.snapshot_exists():
+        raise HTTPException(status_code=404, detail="No index snapshot to load")
+    loop = asyncio.get_running_loop()
+    try:
+        # Loading reads and unpickles the snapshot; keep it off the event loop
+        return await loop.run_in_executor(None, rag_system.vector_db.reload)
+    except Exception as e:
+        print(f"Error reloading vector index: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error reloading index: {str(e)}")
+
+@app.get("/api/admin/export")
+def export_chat_history(
+    entity: str = "messages",
+    format: str = "ndjson",
+    compression: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Stream chat messages or sessions in [since, until) as NDJSON rows or
+    columnar batches, optionally gzip or zstd compressed.
+    """
+    require_admin(x_admin_token)
+    try:
+        export = ChatExport(
+            rag_system.llm.chat_storage,
+            entity=entity,
+            fmt=format,
+            compression=compression,
+            since=parse_export_time(since),
+            until=parse_export_time(until),
+            batch_size=config.export_batch_size
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        iter(export),
+        media_type=export.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{export.filename}"'}
+    )
+
+@app.get("/api/metrics/llm")
+async def llm_metrics():
+    """LLM gateway queue depth, rejections and call outcomes, plus per-route latency and tokens"""
+    return dict(rag_system.llm.gateway.stats(), routing=rag_system.llm.router.stats())
+
+@app.get("/api/metrics/chat-cache")
+async def chat_cache_metrics():
+    """Session cache hits, revalidations, stale reloads and evictions"""
+    storage = rag_system.llm.chat_storage
+    if not hasattr(storage, "stats"):
+        return {"enabled": False}
+    return dict(storage.stats(), enabled=True)
+
+@app.get("/api/metrics/prefetch")
+async def prefetch_metrics():
+    """Retrieval cache hits and speculative plans started, adopted and cancelled"""
+    return prefetcher.stats()
+
+@app.get("/api/metrics/goal-clusters")
+async def goal_cluster_metrics():
+    """Context pack hits, misses and stale lookups, and the published cluster model"""
+    return goal_clusters.stats()
+
+@app.get("/api/metrics/admission")
+async def admission_metrics():
+    """Slots in use, queue depth, 429s and queue-wait percentiles per priority class"""
+    return admission.stats()
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
@@ -0,0 +1,193 @@
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterator
+from .chat_storage import BaseChatStorage
+
+# Approximate per-message overhead of a cached tuple, on top of its text
+MESSAGE_OVERHEAD_BYTES = 100
+
+
+class CachedSession:
+    """Cached history of one session: messages as (role, content, timestamp, context_refs) tuples."""
+
+    __slots__ = ('version', 'messages', 'size', 'validated_at')
+
+    def __init__(self, version: int, messages: List[tuple], validated_at: float):
+        self.version = version
+        self.messages = messages
+        self.size = sum(len(message[1]) + MESSAGE_OVERHEAD_BYTES for message in messages)
+        self.validated_at = validated_at
+
+
+class CachedChatStorage(BaseChatStorage):
+    """
+    Per-process cache of recent sessions' history in front of a chat
+    storage backend.
+
+    Writes go through to the backend and are appended to the cached copy,
+    so the worker serving a conversation never has to read the history
+    back. Each entry remembers the session version it matches. An entry
+    validated within CHAT_CACHE_REVALIDATE_SECONDS is served without any
+    database read. An older entry is checked against the backend's version
+    (one primary-key lookup) and reloaded only if another worker changed
+    the session. Entries are evicted least recently used first, bounded
+    by CHAT_CACHE_MAX_SESSIONS and CHAT_CACHE_MAX_MB.
+    """
+
+    def __init__(self, backend: BaseChatStorage, config):
+        self.backend = backend
+        self.max_sessions = config.chat_cache_max_sessions
+        self.max_bytes = int(config.chat_cache_max_mb * 1024 * 1024)
+        self.revalidate_seconds = config.chat_cache_revalidate_seconds
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.metrics = {"hits": 0, "revalidated": 0, "stale": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def _pack(message: Dict[str, Any]) -> tuple:
+        refs = message.get('context_refs')
+        return (message['role'], message['content'], message['timestamp'], tuple(refs) if refs else None)
+
+    @staticmethod
+    def _unpack(messages: List[tuple]) -> List[Dict[str, Any]]:
+        return [
+            {'role': role, 'content': content, 'timestamp': timestamp,
+             'context_refs': list(refs) if refs else None}
+            for role, content, timestamp, refs in messages
+        ]
+
+    def _put(self, session_id: str, entry: CachedSession):
+        """Insert or replace an entry and evict down to the limits. Caller holds _lock."""
+        previous = self._entries.pop(session_id, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        self._entries[session_id] = entry
+        self._bytes += entry.size
+        self._evict()
+
+    def _evict(self):
+        # Never evict the entry just touched; it is about to be used
+        while len(self._entries) > 1 and (len(self._entries) > self.max_sessions or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.metrics["evictions"] += 1
+
+    def _drop(self, session_id: str):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def _load(self, session_id: str) -> List[Dict[str, Any]]:
+        # Version first: a write landing in between makes the entry look stale, never fresh
+        version = self.backend.get_session_version(session_id)
+        messages = self.backend.get_session_messages(session_id)
+        if version is not None:
+            with self._lock:
+                self._put(session_id, CachedSession(version, [self._pack(m) for m in messages], time.monotonic()))
+        return messages
+
+    def get_session_messages(self, session_id: str) -> List[Dict[str, Any]]:
+        """Get all messages for a session, from memory when the cached copy is current."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+                if now - entry.validated_at < self.revalidate_seconds:
+                    self.metrics["hits"] += 1
+                    return self._unpack(entry.messages)
+            else:
+                self.metrics["misses"] += 1
+
+        if entry is not None:
+            version = self.backend.get_session_version(session_id)
+            with self._lock:
+                if self._entries.get(session_id) is entry and version == entry.version:
+                    entry.validated_at = now
+                    self.metrics["revalidated"] += 1
+                    return self._unpack(entry.messages)
+                self.metrics["stale"] += 1
+        return self._load(session_id)
+
+    def add_message(self, session_id: str, role: str, content: str,
+                    context_refs: Optional[List[str]] = None) -> Optional[str]:
+        """Add a message through to the backend and to the cached history."""
+        # The backend's own timestamp keeps cached and reloaded history identical
+        timestamp = self.backend.add_message(session_id, role, content, context_refs=context_refs)
+        if not timestamp:
+            self._drop(session_id)
+            return timestamp
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                entry.messages.append((role, content, timestamp, tuple(context_refs) if context_refs else None))
+                entry.version += 1
+                size = len(content) + MESSAGE_OVERHEAD_BYTES
+                entry.size += size
+                self._bytes += size
+                self._entries.move_to_end(session_id)
+                self._evict()
+        return timestamp
+
+    def create_session(self, session_id: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """Create a new chat session; its empty history is cached right away."""
+        created = self.backend.create_session(session_id, metadata)
+        if created:
+            with self._lock:
+                self._put(session_id, CachedSession(0, [], time.monotonic()))
+        return created
+
+    def delete_session(self, session_id: str, expected_version: Optional[int] = None) -> bool:
+        """Delete a chat session and all its messages."""
+        self._drop(session_id)
+        return self.backend.delete_session(session_id, expected_version)
+
+    def compact_session(self, session_id: str, summary: str, keep_last: int,
+                        expected_version: Optional[int] = None) -> int:
+        """Compact through the backend; the next read reloads the shortened history."""
+        removed = self.backend.compact_session(session_id, summary, keep_last, expected_version)
+        self._drop(session_id)
+        return removed
+
+    def get_session_version(self, session_id: str) -> Optional[int]:
+        return self.backend.get_session_version(session_id)
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self.backend.get_session(session_id)
+
+    def list_sessions(self, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+        return self.backend.list_sessions(limit, offset)
+
+    def find_expired_sessions(self, now: datetime, default_ttl_seconds: int, limit: int = 100) -> List[str]:
+        return self.backend.find_expired_sessions(now, default_ttl_seconds, limit)
+
+    def find_sessions(self, updated_before: Optional[datetime] = None, min_messages: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        return self.backend.find_sessions(updated_before, min_messages, limit)
+
+    def iter_messages(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        # Exports read the backend directly; they would only churn the cache
+        return self.backend.iter_messages(since, until, batch_size)
+
+    def iter_sessions(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        return self.backend.iter_sessions(since, until, batch_size)
+
+    def maintenance(self, full: bool = False):
+        self.backend.maintenance(full)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        return self.backend.flush(timeout)
+
+    def close(self):
+        self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache hit counters and current size."""
+        with self._lock:
+            return dict(self.metrics, sessions=len(self._entries), bytes=self._bytes,
+                        max_sessions=self.max_sessions, max_bytes=self.max_bytes)
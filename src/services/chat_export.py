@@ -0,0 +1,128 @@
+import json
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+EXPORT_ENTITIES = ('messages', 'sessions')
+EXPORT_FORMATS = ('ndjson', 'columnar')
+EXPORT_COMPRESSIONS = ('gzip', 'zstd')
+
+MESSAGE_COLUMNS = ('message_id', 'session_id', 'role', 'content', 'timestamp', 'context_refs')
+SESSION_COLUMNS = ('session_id', 'created_at', 'last_updated', 'metadata')
+
+FILE_SUFFIXES = {'ndjson': '.ndjson', 'columnar': '.columns.ndjson', 'gzip': '.gz', 'zstd': '.zst'}
+MEDIA_TYPES = {None: 'application/x-ndjson', 'gzip': 'application/gzip', 'zstd': 'application/zstd'}
+
+# Compressed output is held back until it reaches this size, so small
+# batches do not become one tiny HTTP chunk each
+MIN_CHUNK_BYTES = 64 * 1024
+
+
+def parse_export_time(value: Optional[str]) -> Optional[datetime]:
+    """ISO 8601 time from a query parameter; naive times are taken as UTC."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _compressor(compression: Optional[str]):
+    if compression is None:
+        return None
+    if compression == 'gzip':
+        # wbits=31 writes a gzip header and trailer
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        import zstandard  # type: ignore
+    except ImportError:
+        raise ValueError("zstd compression requires the 'zstandard' package")
+    return zstandard.ZstdCompressor(level=3).compressobj()
+
+
+def encode_batch(batch: List[Dict[str, Any]], fmt: str, columns) -> bytes:
+    """One batch as NDJSON rows, or as a single line of column arrays."""
+    if fmt == 'columnar':
+        return (json.dumps({
+            'rows': len(batch),
+            'columns': {column: [row.get(column) for row in batch] for column in columns}
+        }, default=str) + '\n').encode('utf-8')
+    return ''.join(
+        json.dumps({column: row.get(column) for column in columns}, default=str) + '\n' for row in batch
+    ).encode('utf-8')
+
+
+class ChatExport:
+    """
+    Streaming export of chat sessions or messages for analytics.
+
+    Iterating yields the encoded (and optionally gzip or zstd compressed)
+    export in chunks. Rows come from the storage's iter_messages() or
+    iter_sessions() one keyset batch at a time, so memory is bounded by a
+    batch whatever the export size, and each batch is a short read that
+    never holds back chat writes. The range is [since, until); until
+    defaults to the moment the export was created, so rows written while
+    it runs are left for the next export.
+    """
+
+    def __init__(self, storage, entity: str = 'messages', fmt: str = 'ndjson',
+                 compression: Optional[str] = None, since: Optional[datetime] = None,
+                 until: Optional[datetime] = None, batch_size: int = 1000):
+        if entity not in EXPORT_ENTITIES:
+            raise ValueError(f"entity must be one of {', '.join(EXPORT_ENTITIES)}")
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+        if compression is not None and compression not in EXPORT_COMPRESSIONS:
+            raise ValueError(f"compression must be one of {', '.join(EXPORT_COMPRESSIONS)}")
+        if until is None:
+            # Stored timestamps have whole-second resolution: include the current second
+            until = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(seconds=1)
+        if since is not None and since >= until:
+            raise ValueError("since must be earlier than until")
+        self.storage = storage
+        self.entity = entity
+        self.fmt = fmt
+        self.compression = compression
+        self.since = since
+        self.until = until
+        self.batch_size = batch_size
+        # Created up front so a missing zstandard package fails before streaming starts
+        self._compressor = _compressor(compression)
+        self.rows = 0
+
+    @property
+    def filename(self) -> str:
+        stamp = self.until.strftime('%Y%m%dT%H%M%SZ')
+        return f"chat-{self.entity}-{stamp}{FILE_SUFFIXES[self.fmt]}{FILE_SUFFIXES.get(self.compression, '')}"
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.compression]
+
+    def _batches(self) -> Iterator[List[Dict[str, Any]]]:
+        if self.entity == 'sessions':
+            return self.storage.iter_sessions(self.since, self.until, self.batch_size)
+        return self.storage.iter_messages(self.since, self.until, self.batch_size)
+
+    def __iter__(self) -> Iterator[bytes]:
+        columns = SESSION_COLUMNS if self.entity == 'sessions' else MESSAGE_COLUMNS
+        compressor = self._compressor
+        pending = []
+        pending_size = 0
+        for batch in self._batches():
+            self.rows += len(batch)
+            data = encode_batch(batch, self.fmt, columns)
+            if compressor is None:
+                yield data
+                continue
+            data = compressor.compress(data)
+            if data:
+                pending.append(data)
+                pending_size += len(data)
+            if pending_size >= MIN_CHUNK_BYTES:
+                yield b''.join(pending)
+                pending, pending_size = [], 0
+        if compressor is not None:
+            pending.append(compressor.flush())
+            yield b''.join(pending)
@@ -0,0 +1,171 @@
+import os
+import gzip
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Callable, Optional, Iterator
+from .chat_storage import BaseChatStorage
+
+def summarize_messages(messages: List[Dict[str, Any]], max_chars: int = 2000) -> str:
+    """
+    Extractive summary of compacted turns: the opening of each message,
+    capped so a summary never grows past max_chars.
+    """
+    lines = [f"Summary of {len(messages)} earlier messages:"]
+    budget = max_chars - len(lines[0])
+    for msg in messages:
+        content = " ".join(msg['content'].split())
+        line = f"- {msg['role']}: {content[:160]}{'...' if len(content) > 160 else ''}"
+        if len(line) + 1 > budget:
+            lines.append("- ...")
+            break
+        lines.append(line)
+        budget -= len(line) + 1
+    return "\n".join(lines)
+
+
+def iter_archive(path: str) -> Iterator[Dict[str, Any]]:
+    """Read back every archived session from an archive segment."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class RetentionEngine:
+    """
+    Background retention for chat history.
+
+    Each cycle:
+      1. deletes sessions whose TTL elapsed (metadata['ttl_seconds'] or
+         CHAT_SESSION_TTL_DAYS),
+      2. archives sessions idle for CHAT_ARCHIVE_AFTER_DAYS to append-only
+         gzip JSONL segments and removes them from the database,
+      3. compacts long sessions, keeping the newest CHAT_COMPACT_KEEP_LAST
+         turns and one summary message for the rest,
+      4. runs an incremental vacuum, and a full VACUUM every
+         CHAT_VACUUM_INTERVAL_HOURS.
+    """
+
+    def __init__(self,
+                 storage: BaseChatStorage,
+                 config,
+                 summarizer: Optional[Callable[[List[Dict[str, Any]]], str]] = None):
+        self.storage = storage
+        self.config = config
+        self.summarizer = summarizer or summarize_messages
+        self.interval = config.chat_retention_interval_seconds
+        data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
+        self.archive_dir = config.chat_archive_dir or os.path.join(data_dir, 'archive')
+        self.batch_size = 100
+        self._last_full_vacuum = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Run retention cycles in a daemon thread."""
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="chat-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread after the current cycle."""
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                report = self.run_once()
+                if self.config.debug_mode:
+                    print(f"Chat retention cycle: {report}")
+            except Exception as e:
+                print(f"Error in chat retention cycle: {str(e)}")
+
+    def run_once(self) -> Dict[str, int]:
+        """
+        Run one retention cycle.
+
+        Returns:
+            Dict[str, int]: Counts of expired, archived and compacted sessions
+        """
+        now = datetime.now(timezone.utc)
+        report = {"expired": 0, "archived": 0, "compacted": 0, "messages_removed": 0}
+
+        ttl_seconds = int(self.config.chat_session_ttl_days * 86400)
+        for session_id in self.storage.find_expired_sessions(now, ttl_seconds, limit=self.batch_size):
+            if self.storage.delete_session(session_id):
+                report["expired"] += 1
+
+        if self.config.chat_archive_after_days > 0:
+            cutoff = now - timedelta(days=self.config.chat_archive_after_days)
+            cold = self.storage.find_sessions(updated_before=cutoff, limit=self.batch_size)
+            report["archived"] = self.archive_sessions(cold, now)
+
+        if self.config.chat_compact_after_messages > 0:
+            keep_last = self.config.chat_compact_keep_last
+            for session in self.storage.find_sessions(min_messages=self.config.chat_compact_after_messages,
+                                                      limit=self.batch_size):
+                # Read the version first: a message added after it makes the
+                # compaction a no-op, retried next cycle, instead of dropping
+                # a turn the summary never saw
+                version = self.storage.get_session_version(session['session_id'])
+                messages = self.storage.get_session_messages(session['session_id'])
+                old = messages[:-keep_last] if keep_last else messages
+                if version is None or len(old) < 2:
+                    continue
+                removed = self.storage.compact_session(session['session_id'], self.summarizer(old), keep_last,
+                                                       expected_version=version)
+                if removed:
+                    report["compacted"] += 1
+                    report["messages_removed"] += removed
+
+        full = time.monotonic() - self._last_full_vacuum >= self.config.chat_vacuum_interval_hours * 3600
+        self.storage.maintenance(full=full)
+        if full:
+            self._last_full_vacuum = time.monotonic()
+
+        return report
+
+    def archive_sessions(self, sessions: List[Dict[str, Any]], now: datetime) -> int:
+        """
+        Append sessions to this month's archive segment, then delete them.
+
+        Each call writes one gzip member, so segments stay valid if the
+        process dies mid-write and can be concatenated or read with zcat.
+        A session is only deleted if it is still at the version its
+        archived messages were read at; one that got a new message in
+        between stays live (its archive record is then a harmless extra).
+        """
+        if not sessions:
+            return 0
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"chat-{now.strftime('%Y-%m')}.jsonl.gz")
+
+        records = []
+        versions = {}
+        for session in sessions:
+            versions[session['session_id']] = self.storage.get_session_version(session['session_id'])
+            record = dict(session)
+            record.pop('message_count', None)
+            record['messages'] = self.storage.get_session_messages(session['session_id'])
+            record['archived_at'] = now.isoformat()
+            records.append(json.dumps(record, ensure_ascii=False))
+
+        with open(path, 'ab') as f:
+            f.write(gzip.compress(("\n".join(records) + "\n").encode('utf-8')))
+            f.flush()
+            os.fsync(f.fileno())
+
+        archived = 0
+        for session in sessions:
+            version = versions[session['session_id']]
+            if version is not None and self.storage.delete_session(session['session_id'], expected_version=version):
+                archived += 1
+        return archived
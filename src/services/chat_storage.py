@@ -1,24 +1,180 @@
 import os
 import sqlite3
 import json
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+import atexit
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Iterator
 
-class ChatStorage:
-    def __init__(self):
+
+def shard_for_session(session_id: str, num_shards: int) -> int:
+    """Stable shard number for a session, identical on every node."""
+    digest = hashlib.md5(session_id.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+
+def utc_timestamp_of(value: datetime) -> str:
+    """Format a datetime like SQLite's CURRENT_TIMESTAMP (UTC)."""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def utc_timestamp() -> str:
+    """Current UTC time in the same format as SQLite's CURRENT_TIMESTAMP."""
+    return utc_timestamp_of(datetime.now(timezone.utc))
+
+
+class BaseChatStorage(ABC):
+    """Interface shared by every chat history backend."""
+
+    @abstractmethod
+    def create_session(self, session_id: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """Create a new chat session."""
+
+    @abstractmethod
+    def add_message(self, session_id: str, role: str, content: str,
+                    context_refs: Optional[List[str]] = None) -> Optional[str]:
+        """
+        Add a message to a chat session.
+
+        context_refs holds the chunk_refs of retrieved knowledge base chunks
+        the turn was answered with, so their text is never stored per message.
+
+        Returns:
+            The timestamp the message was stored with, or None if it could
+            not be added
+        """
+
+    @abstractmethod
+    def get_session_messages(self, session_id: str) -> List[Dict[str, Any]]:
+        """Get all messages for a session."""
+
+    @abstractmethod
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Get session details."""
+
+    @abstractmethod
+    def get_session_version(self, session_id: str) -> Optional[int]:
+        """
+        Change counter of a session, or None if it does not exist.
+
+        Every added message bumps it by one and a compaction by one more,
+        whichever process made the change, so a cached copy of the history
+        is current exactly when its version matches.
+        """
+
+    @abstractmethod
+    def list_sessions(self, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+        """List recent chat sessions."""
+
+    @abstractmethod
+    def delete_session(self, session_id: str, expected_version: Optional[int] = None) -> bool:
+        """
+        Delete a chat session and all its messages.
+
+        With expected_version, nothing is deleted (and False returned)
+        unless the session is still at that version, so messages added
+        after the caller read it are never lost.
+        """
+
+    @abstractmethod
+    def find_expired_sessions(self, now: datetime, default_ttl_seconds: int, limit: int = 100) -> List[str]:
+        """
+        Sessions whose TTL has elapsed.
+
+        A session's own metadata['ttl_seconds'] overrides the default;
+        a default of 0 means sessions without their own TTL never expire.
+        """
+
+    @abstractmethod
+    def find_sessions(self, updated_before: Optional[datetime] = None, min_messages: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Sessions matching the retention filters, with a message_count field."""
+
+    @abstractmethod
+    def iter_messages(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Messages stored with since <= timestamp < until, in batches ordered
+        by (timestamp, message_id), each with its session_id and message_id.
+
+        Every batch is its own keyset query on a short-lived connection, so
+        memory stays at one batch and no read is held open between batches.
+        """
+
+    @abstractmethod
+    def iter_sessions(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Sessions last updated with since <= last_updated < until, in batches ordered by session_id."""
+
+    @abstractmethod
+    def compact_session(self, session_id: str, summary: str, keep_last: int,
+                        expected_version: Optional[int] = None) -> int:
+        """
+        Replace all but the newest keep_last messages with a single summary
+        message, keeping it in the position of the turns it replaces.
+
+        Pass the version read together with the summarized messages as
+        expected_version: if the session changed since, nothing is
+        compacted, so no message is ever removed without being summarized.
+
+        Returns:
+            int: Number of messages removed
+        """
+
+    def maintenance(self, full: bool = False):
+        """Reclaim free space. Backends without local files do nothing."""
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until buffered writes are durable."""
+        return True
+
+    def close(self):
+        """Release connections and flush buffered writes."""
+
+
+class SQLiteChatStorage(BaseChatStorage):
+    def __init__(self, config=None, db_path: Optional[str] = None):
         # Create data directory if it doesn't exist
         self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
         os.makedirs(self.data_dir, exist_ok=True)
-        
+
         # Set database path
-        self.db_path = os.path.join(self.data_dir, 'chat.db')
+        self.db_path = db_path or getattr(config, 'chat_db_path', None) or os.path.join(self.data_dir, 'chat.db')
         self._init_db()
-    
+
+        # Write-behind queue: add_message only appends here, a background
+        # writer commits everything queued in one transaction per interval.
+        self.write_behind = getattr(config, 'chat_write_behind', True)
+        self.flush_interval = getattr(config, 'chat_flush_interval_ms', 5) / 1000.0
+        self.max_batch = getattr(config, 'chat_flush_max_batch', 500)
+        self._pending = []    # queued, not yet picked up by the writer
+        self._inflight = []   # picked up by the writer, not yet committed
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._writer = None
+        if self.write_behind:
+            self._writer = threading.Thread(target=self._writer_loop, name="chat-storage-writer", daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
     def _init_db(self):
         """Initialize the SQLite database and create necessary tables."""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
-        
+
+        # Incremental auto_vacuum lets maintenance() return freed pages to
+        # the OS; it takes effect on new files or after the next full VACUUM.
+        cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+
+        # WAL lets readers run while the writer commits
+        cursor.execute('PRAGMA journal_mode=WAL')
+
         # Create chat_sessions table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS chat_sessions (
@@ -28,7 +184,7 @@ class ChatStorage:
                 metadata TEXT
             )
         ''')
-        
+
         # Create chat_messages table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS chat_messages (
@@ -40,93 +196,253 @@ class ChatStorage:
                 FOREIGN KEY (session_id) REFERENCES chat_sessions(session_id)
             )
         ''')
-        
+
+        # Older databases predate session versions and chunk references
+        session_columns = [row[1] for row in cursor.execute('PRAGMA table_info(chat_sessions)')]
+        if 'version' not in session_columns:
+            cursor.execute('ALTER TABLE chat_sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(chat_messages)')]
+        if 'context_refs' not in columns:
+            cursor.execute('ALTER TABLE chat_messages ADD COLUMN context_refs TEXT')
+
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages (session_id, timestamp)'
+        )
+        # Keyset order of iter_messages
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_chat_messages_time ON chat_messages (timestamp, message_id)'
+        )
+
         conn.commit()
         conn.close()
-    
+
+    def _writer_loop(self):
+        """Background writer: batch queued messages into one transaction."""
+        conn = self._connect()
+        conn.execute('PRAGMA synchronous=NORMAL')
+        while True:
+            with self._wakeup:
+                while not self._pending and not self._closed:
+                    self._wakeup.wait()
+                if not self._pending and self._closed:
+                    break
+
+            # Give other sessions a few milliseconds to join this batch
+            if not self._closed and self.flush_interval > 0:
+                threading.Event().wait(self.flush_interval)
+
+            self._flush_batch(conn)
+        conn.close()
+
+    def _flush_batch(self, conn: sqlite3.Connection):
+        with self._lock:
+            self._inflight = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+
+        with self._commit_lock:
+            # Read the batch only now: delete_session may have dropped rows from it
+            with self._lock:
+                batch = self._inflight
+            committed = self._commit_batch(conn, batch) if batch else True
+        if not committed:
+            threading.Event().wait(max(self.flush_interval, 0.1))
+
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: List[tuple]) -> bool:
+        """Commit one batch of queued messages. Caller holds _commit_lock."""
+        # Coalesce last_updated and version: one UPDATE per session, not per message
+        last_updated = {}
+        added = {}
+        for session_id, _, _, timestamp, _ in batch:
+            last_updated[session_id] = timestamp
+            added[session_id] = added.get(session_id, 0) + 1
+
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(
+                'INSERT INTO chat_messages (session_id, role, content, timestamp, context_refs) VALUES (?, ?, ?, ?, ?)',
+                batch
+            )
+            # Sessions named by the client may not exist yet
+            cursor.executemany(
+                'INSERT OR IGNORE INTO chat_sessions (session_id) VALUES (?)',
+                [(session_id,) for session_id in last_updated]
+            )
+            cursor.executemany(
+                'UPDATE chat_sessions SET last_updated = ?, version = version + ? WHERE session_id = ?',
+                [(timestamp, added[session_id], session_id) for session_id, timestamp in last_updated.items()]
+            )
+            conn.commit()
+            with self._lock:
+                self._inflight = []
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"Error flushing messages: {str(e)}")
+            with self._lock:
+                self._inflight = []
+                if self._closed:
+                    print(f"Dropping {len(batch)} unflushed messages on shutdown")
+                else:
+                    # Put the batch back in front so ordering is preserved
+                    self._pending[:0] = batch
+            return False
+
+    def _unflushed(self, session_id: str) -> List[Dict[str, Any]]:
+        """Messages for a session that are queued or in flight. Caller holds _lock."""
+        return [
+            {
+                'role': role,
+                'content': content,
+                'timestamp': timestamp,
+                'context_refs': json.loads(context_refs) if context_refs else None
+            }
+            for sid, role, content, timestamp, context_refs in self._inflight + self._pending
+            if sid == session_id
+        ]
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued message has been committed."""
+        if not self._writer:
+            return True
+        with self._wakeup:
+            self._wakeup.notify_all()
+            return self._wakeup.wait_for(lambda: not self._pending and not self._inflight, timeout)
+
+    def close(self):
+        """Flush queued messages and stop the background writer."""
+        if not self._writer:
+            return
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify_all()
+        self._writer.join()
+        self._writer = None
+
     def create_session(self, session_id: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
         """Create a new chat session."""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
-            
+
             cursor.execute(
                 'INSERT INTO chat_sessions (session_id, metadata) VALUES (?, ?)',
                 (session_id, json.dumps(metadata) if metadata else None)
             )
-            
+
             conn.commit()
             conn.close()
             return True
         except Exception as e:
             print(f"Error creating session: {str(e)}")
             return False
-    
-    def add_message(self, session_id: str, role: str, content: str) -> bool:
+
+    def add_message(self, session_id: str, role: str, content: str,
+                    context_refs: Optional[List[str]] = None) -> Optional[str]:
         """Add a message to a chat session."""
+        refs = json.dumps(context_refs) if context_refs else None
+        now = utc_timestamp()
+        if self._writer:
+            with self._wakeup:
+                if not self._closed:
+                    self._pending.append((session_id, role, content, now, refs))
+                    self._wakeup.notify()
+                    return now
+
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
-            
+
             # Add message
             cursor.execute(
-                'INSERT INTO chat_messages (session_id, role, content) VALUES (?, ?, ?)',
-                (session_id, role, content)
+                'INSERT INTO chat_messages (session_id, role, content, timestamp, context_refs) VALUES (?, ?, ?, ?, ?)',
+                (session_id, role, content, now, refs)
             )
-            
+
             # Update session last_updated timestamp
             cursor.execute(
-                'UPDATE chat_sessions SET last_updated = CURRENT_TIMESTAMP WHERE session_id = ?',
+                'INSERT OR IGNORE INTO chat_sessions (session_id) VALUES (?)',
                 (session_id,)
             )
-            
+            cursor.execute(
+                'UPDATE chat_sessions SET last_updated = ?, version = version + 1 WHERE session_id = ?',
+                (now, session_id)
+            )
+
             conn.commit()
             conn.close()
-            return True
+            return now
         except Exception as e:
             print(f"Error adding message: {str(e)}")
-            return False
-    
+            return None
+
     def get_session_messages(self, session_id: str) -> List[Dict[str, Any]]:
-        """Get all messages for a session."""
+        """Get all messages for a session, including ones not yet flushed."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'SELECT role, content, timestamp FROM chat_messages WHERE session_id = ? ORDER BY timestamp',
-                (session_id,)
-            )
-            
-            messages = [
-                {
-                    'role': row[0],
-                    'content': row[1],
-                    'timestamp': row[2]
-                }
-                for row in cursor.fetchall()
-            ]
-            
-            conn.close()
+            # Holding the commit lock means a batch is either fully visible
+            # in the database or still listed as in flight, never both.
+            with self._commit_lock:
+                conn = self._connect()
+                cursor = conn.cursor()
+
+                cursor.execute(
+                    'SELECT role, content, timestamp, context_refs FROM chat_messages WHERE session_id = ? ORDER BY timestamp, message_id',
+                    (session_id,)
+                )
+
+                messages = [
+                    {
+                        'role': row[0],
+                        'content': row[1],
+                        'timestamp': row[2],
+                        'context_refs': json.loads(row[3]) if row[3] else None
+                    }
+                    for row in cursor.fetchall()
+                ]
+
+                conn.close()
+                with self._lock:
+                    messages.extend(self._unflushed(session_id))
             return messages
         except Exception as e:
             print(f"Error getting messages: {str(e)}")
             return []
-    
+
+    def get_session_version(self, session_id: str) -> Optional[int]:
+        """Change counter of a session, counting messages not yet flushed."""
+        try:
+            with self._commit_lock:
+                conn = self._connect()
+                row = conn.execute(
+                    'SELECT version FROM chat_sessions WHERE session_id = ?',
+                    (session_id,)
+                ).fetchone()
+                conn.close()
+                with self._lock:
+                    unflushed = len(self._unflushed(session_id))
+            if row is None and not unflushed:
+                return None
+            return (row[0] if row else 0) + unflushed
+        except Exception as e:
+            print(f"Error getting session version: {str(e)}")
+            return None
+
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Get session details."""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
-            
+
             cursor.execute(
                 'SELECT session_id, created_at, last_updated, metadata FROM chat_sessions WHERE session_id = ?',
                 (session_id,)
             )
-            
+
             row = cursor.fetchone()
             conn.close()
-            
+
             if row:
                 return {
                     'session_id': row[0],
@@ -138,23 +454,23 @@ class ChatStorage:
         except Exception as e:
             print(f"Error getting session: {str(e)}")
             return None
-    
+
     def list_sessions(self, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
         """List recent chat sessions."""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
-            
+
             cursor.execute(
                 '''
-                SELECT session_id, created_at, last_updated, metadata 
-                FROM chat_sessions 
-                ORDER BY last_updated DESC 
+                SELECT session_id, created_at, last_updated, metadata
+                FROM chat_sessions
+                ORDER BY last_updated DESC
                 LIMIT ? OFFSET ?
                 ''',
                 (limit, offset)
             )
-            
+
             sessions = [
                 {
                     'session_id': row[0],
@@ -164,28 +480,447 @@ class ChatStorage:
                 }
                 for row in cursor.fetchall()
             ]
-            
+
             conn.close()
             return sessions
         except Exception as e:
             print(f"Error listing sessions: {str(e)}")
             return []
-    
-    def delete_session(self, session_id: str) -> bool:
-        """Delete a chat session and all its messages."""
+
+    def delete_session(self, session_id: str, expected_version: Optional[int] = None) -> bool:
+        """Delete a chat session and all its messages, if still at expected_version when given."""
         try:
-            conn = sqlite3.connect(self.db_path)
+            # The writer commits only under _commit_lock, so while it is held
+            # the session's queued and in-flight rows can be checked and dropped
+            with self._commit_lock:
+                conn = self._connect()
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+
+                if expected_version is not None:
+                    row = cursor.execute(
+                        'SELECT version FROM chat_sessions WHERE session_id = ?', (session_id,)
+                    ).fetchone()
+                    with self._lock:
+                        unflushed = len(self._unflushed(session_id))
+                    if row is None or row[0] + unflushed != expected_version:
+                        conn.rollback()
+                        conn.close()
+                        return False
+
+                # Delete messages first (due to foreign key constraint)
+                cursor.execute('DELETE FROM chat_messages WHERE session_id = ?', (session_id,))
+
+                # Delete session
+                cursor.execute('DELETE FROM chat_sessions WHERE session_id = ?', (session_id,))
+
+                conn.commit()
+                conn.close()
+                # Queued messages must not resurrect the session after deletion
+                with self._wakeup:
+                    self._pending = [row for row in self._pending if row[0] != session_id]
+                    self._inflight = [row for row in self._inflight if row[0] != session_id]
+                    self._wakeup.notify_all()
+                return True
+        except Exception as e:
+            print(f"Error deleting session: {str(e)}")
+            return False
+
+
+    def find_expired_sessions(self, now: datetime, default_ttl_seconds: int, limit: int = 100) -> List[str]:
+        """Sessions whose TTL has elapsed."""
+        try:
+            conn = self._connect()
             cursor = conn.cursor()
-            
-            # Delete messages first (due to foreign key constraint)
-            cursor.execute('DELETE FROM chat_messages WHERE session_id = ?', (session_id,))
-            
-            # Delete session
-            cursor.execute('DELETE FROM chat_sessions WHERE session_id = ?', (session_id,))
-            
-            conn.commit()
+
+            cursor.execute(
+                '''
+                SELECT session_id FROM chat_sessions
+                WHERE COALESCE(json_extract(metadata, '$.ttl_seconds'), ?) > 0
+                  AND CAST(strftime('%s', last_updated) AS INTEGER) + COALESCE(json_extract(metadata, '$.ttl_seconds'), ?)
+                      < CAST(strftime('%s', ?) AS INTEGER)
+                LIMIT ?
+                ''',
+                (default_ttl_seconds, default_ttl_seconds, utc_timestamp_of(now), limit)
+            )
+
+            session_ids = [row[0] for row in cursor.fetchall()]
             conn.close()
-            return True
+            return session_ids
         except Exception as e:
-            print(f"Error deleting session: {str(e)}")
-            return False 
\ No newline at end of file
+            print(f"Error finding expired sessions: {str(e)}")
+            return []
+
+    def find_sessions(self, updated_before: Optional[datetime] = None, min_messages: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Sessions matching the retention filters, with a message_count field."""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+
+            cursor.execute(
+                '''
+                SELECT s.session_id, s.created_at, s.last_updated, s.metadata, COUNT(m.message_id)
+                FROM chat_sessions s
+                LEFT JOIN chat_messages m ON m.session_id = s.session_id
+                WHERE (? IS NULL OR s.last_updated < ?)
+                GROUP BY s.session_id
+                HAVING COUNT(m.message_id) >= ?
+                ORDER BY s.last_updated
+                LIMIT ?
+                ''',
+                (
+                    utc_timestamp_of(updated_before) if updated_before else None,
+                    utc_timestamp_of(updated_before) if updated_before else None,
+                    min_messages,
+                    limit
+                )
+            )
+
+            sessions = [
+                {
+                    'session_id': row[0],
+                    'created_at': row[1],
+                    'last_updated': row[2],
+                    'metadata': json.loads(row[3]) if row[3] else None,
+                    'message_count': row[4]
+                }
+                for row in cursor.fetchall()
+            ]
+
+            conn.close()
+            return sessions
+        except Exception as e:
+            print(f"Error finding sessions: {str(e)}")
+            return []
+
+    def iter_messages(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Messages in [since, until), in (timestamp, message_id) order, one keyset query per batch."""
+        # Messages accepted before the export started belong in it
+        self.flush()
+        bounds, params = [], []
+        if since:
+            bounds.append('timestamp >= ?')
+            params.append(utc_timestamp_of(since))
+        if until:
+            bounds.append('timestamp < ?')
+            params.append(utc_timestamp_of(until))
+        cursor_key = None
+        while True:
+            conditions = list(bounds)
+            args = list(params)
+            if cursor_key:
+                conditions.append('(timestamp, message_id) > (?, ?)')
+                args.extend(cursor_key)
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    'SELECT message_id, session_id, role, content, timestamp, context_refs FROM chat_messages'
+                    + (' WHERE ' + ' AND '.join(conditions) if conditions else '')
+                    + ' ORDER BY timestamp, message_id LIMIT ?',
+                    args + [batch_size]
+                ).fetchall()
+            finally:
+                conn.close()
+            if not rows:
+                return
+            yield [
+                {
+                    'message_id': row[0],
+                    'session_id': row[1],
+                    'role': row[2],
+                    'content': row[3],
+                    'timestamp': row[4],
+                    'context_refs': json.loads(row[5]) if row[5] else None
+                }
+                for row in rows
+            ]
+            if len(rows) < batch_size:
+                return
+            cursor_key = (rows[-1][4], rows[-1][0])
+
+    def iter_sessions(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Sessions last updated in [since, until), in session_id order, one keyset query per batch."""
+        bounds, params = [], []
+        if since:
+            bounds.append('last_updated >= ?')
+            params.append(utc_timestamp_of(since))
+        if until:
+            bounds.append('last_updated < ?')
+            params.append(utc_timestamp_of(until))
+        last_id = None
+        while True:
+            conditions = list(bounds)
+            args = list(params)
+            if last_id is not None:
+                conditions.append('session_id > ?')
+                args.append(last_id)
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    'SELECT session_id, created_at, last_updated, metadata FROM chat_sessions'
+                    + (' WHERE ' + ' AND '.join(conditions) if conditions else '')
+                    + ' ORDER BY session_id LIMIT ?',
+                    args + [batch_size]
+                ).fetchall()
+            finally:
+                conn.close()
+            if not rows:
+                return
+            yield [
+                {
+                    'session_id': row[0],
+                    'created_at': row[1],
+                    'last_updated': row[2],
+                    'metadata': json.loads(row[3]) if row[3] else None
+                }
+                for row in rows
+            ]
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def compact_session(self, session_id: str, summary: str, keep_last: int,
+                        expected_version: Optional[int] = None) -> int:
+        """Replace all but the newest keep_last messages with a summary message."""
+        try:
+            self.flush()
+            with self._commit_lock:
+                conn = self._connect()
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+
+                if expected_version is not None:
+                    row = cursor.execute(
+                        'SELECT version FROM chat_sessions WHERE session_id = ?', (session_id,)
+                    ).fetchone()
+                    with self._lock:
+                        unflushed = len(self._unflushed(session_id))
+                    if row is None or row[0] + unflushed != expected_version:
+                        conn.rollback()
+                        conn.close()
+                        return 0
+
+                cursor.execute(
+                    'SELECT message_id FROM chat_messages WHERE session_id = ? ORDER BY timestamp, message_id',
+                    (session_id,)
+                )
+                message_ids = [row[0] for row in cursor.fetchall()]
+                old_ids = message_ids[:-keep_last] if keep_last else message_ids
+                if len(old_ids) < 2:
+                    conn.rollback()
+                    conn.close()
+                    return 0
+
+                # The newest compacted row becomes the summary so it keeps
+                # its place ahead of the retained turns.
+                cursor.execute(
+                    "UPDATE chat_messages SET role = 'summary', content = ?, context_refs = NULL WHERE message_id = ?",
+                    (summary, old_ids[-1])
+                )
+                cursor.executemany(
+                    'DELETE FROM chat_messages WHERE message_id = ?',
+                    [(message_id,) for message_id in old_ids[:-1]]
+                )
+                cursor.execute('UPDATE chat_sessions SET version = version + 1 WHERE session_id = ?', (session_id,))
+
+                conn.commit()
+                conn.close()
+                return len(old_ids) - 1
+        except Exception as e:
+            print(f"Error compacting session: {str(e)}")
+            return 0
+
+    def maintenance(self, full: bool = False):
+        """Return free pages to the OS; a full VACUUM also rebuilds the file."""
+        try:
+            self.flush()
+            conn = self._connect()
+            if full:
+                conn.execute('VACUUM')
+            else:
+                conn.execute('PRAGMA incremental_vacuum')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.close()
+        except Exception as e:
+            print(f"Error running database maintenance: {str(e)}")
+
+
+# Backwards-compatible name for the default backend
+ChatStorage = SQLiteChatStorage
+
+
+class InMemoryChatStorage(BaseChatStorage):
+    """Process-local backend, intended for tests and throwaway runs."""
+
+    def __init__(self, config=None):
+        self._sessions = {}
+        self._messages = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def create_session(self, session_id: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """Create a new chat session."""
+        with self._lock:
+            if session_id in self._sessions:
+                print(f"Error creating session: {session_id} already exists")
+                return False
+            now = utc_timestamp()
+            self._sessions[session_id] = {
+                'session_id': session_id,
+                'created_at': now,
+                'last_updated': now,
+                'metadata': metadata
+            }
+            self._messages[session_id] = []
+            self._versions[session_id] = 0
+            return True
+
+    def add_message(self, session_id: str, role: str, content: str,
+                    context_refs: Optional[List[str]] = None) -> Optional[str]:
+        """Add a message to a chat session."""
+        with self._lock:
+            now = utc_timestamp()
+            self._messages.setdefault(session_id, []).append({
+                'role': role,
+                'content': content,
+                'timestamp': now,
+                'context_refs': list(context_refs) if context_refs else None
+            })
+            session = self._sessions.setdefault(session_id, {
+                'session_id': session_id,
+                'created_at': now,
+                'last_updated': now,
+                'metadata': None
+            })
+            session['last_updated'] = now
+            self._versions[session_id] = self._versions.get(session_id, 0) + 1
+            return now
+
+    def get_session_messages(self, session_id: str) -> List[Dict[str, Any]]:
+        """Get all messages for a session."""
+        with self._lock:
+            return [dict(msg) for msg in self._messages.get(session_id, [])]
+
+    def get_session_version(self, session_id: str) -> Optional[int]:
+        """Change counter of a session."""
+        with self._lock:
+            return self._versions.get(session_id)
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Get session details."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return dict(session) if session else None
+
+    def list_sessions(self, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+        """List recent chat sessions."""
+        with self._lock:
+            sessions = sorted(self._sessions.values(), key=lambda s: s['last_updated'], reverse=True)
+            return [dict(s) for s in sessions[offset:offset + limit]]
+
+    def delete_session(self, session_id: str, expected_version: Optional[int] = None) -> bool:
+        """Delete a chat session and all its messages, if still at expected_version when given."""
+        with self._lock:
+            if expected_version is not None and self._versions.get(session_id) != expected_version:
+                return False
+            self._sessions.pop(session_id, None)
+            self._messages.pop(session_id, None)
+            self._versions.pop(session_id, None)
+            return True
+
+
+    def find_expired_sessions(self, now: datetime, default_ttl_seconds: int, limit: int = 100) -> List[str]:
+        """Sessions whose TTL has elapsed."""
+        cutoff = now.astimezone(timezone.utc).replace(tzinfo=None)
+        expired = []
+        with self._lock:
+            for session in self._sessions.values():
+                ttl = (session['metadata'] or {}).get('ttl_seconds', default_ttl_seconds)
+                last_updated = datetime.strptime(session['last_updated'], '%Y-%m-%d %H:%M:%S')
+                if ttl and (cutoff - last_updated).total_seconds() > ttl:
+                    expired.append(session['session_id'])
+        return expired[:limit]
+
+    def find_sessions(self, updated_before: Optional[datetime] = None, min_messages: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Sessions matching the retention filters, with a message_count field."""
+        cutoff = utc_timestamp_of(updated_before) if updated_before else None
+        with self._lock:
+            sessions = [
+                dict(session, message_count=len(self._messages.get(session['session_id'], [])))
+                for session in self._sessions.values()
+                if cutoff is None or session['last_updated'] < cutoff
+            ]
+        sessions = [s for s in sessions if s['message_count'] >= min_messages]
+        sessions.sort(key=lambda s: s['last_updated'])
+        return sessions[:limit]
+
+    def iter_messages(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Messages in [since, until) in timestamp order; message_id is the position in its session."""
+        low = utc_timestamp_of(since) if since else None
+        high = utc_timestamp_of(until) if until else None
+        with self._lock:
+            messages = [
+                dict(message, session_id=session_id, message_id=position)
+                for session_id, session_messages in self._messages.items()
+                for position, message in enumerate(session_messages)
+                if (low is None or message['timestamp'] >= low) and (high is None or message['timestamp'] < high)
+            ]
+        messages.sort(key=lambda m: m['timestamp'])
+        for start in range(0, len(messages), batch_size):
+            yield messages[start:start + batch_size]
+
+    def iter_sessions(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Sessions last updated in [since, until), in session_id order."""
+        low = utc_timestamp_of(since) if since else None
+        high = utc_timestamp_of(until) if until else None
+        with self._lock:
+            sessions = sorted(
+                (dict(session) for session in self._sessions.values()
+                 if (low is None or session['last_updated'] >= low) and (high is None or session['last_updated'] < high)),
+                key=lambda s: s['session_id']
+            )
+        for start in range(0, len(sessions), batch_size):
+            yield sessions[start:start + batch_size]
+
+    def compact_session(self, session_id: str, summary: str, keep_last: int,
+                        expected_version: Optional[int] = None) -> int:
+        """Replace all but the newest keep_last messages with a summary message."""
+        with self._lock:
+            if expected_version is not None and self._versions.get(session_id) != expected_version:
+                return 0
+            messages = self._messages.get(session_id, [])
+            split = len(messages) - keep_last
+            if split < 2:
+                return 0
+            old = messages[:split]
+            self._messages[session_id] = [
+                {'role': 'summary', 'content': summary, 'timestamp': old[-1]['timestamp'], 'context_refs': None}
+            ] + messages[split:]
+            self._versions[session_id] = self._versions.get(session_id, 0) + 1
+            return len(old) - 1
+
+
+def create_chat_storage(config=None) -> BaseChatStorage:
+    """
+    Build the chat storage backend selected by CHAT_STORAGE_BACKEND,
+    behind the session cache when CHAT_CACHE_ENABLED is set.
+    """
+    backend = (getattr(config, 'chat_storage_backend', None) or 'sqlite').lower()
+    if backend == 'sqlite':
+        storage = SQLiteChatStorage(config)
+    elif backend == 'memory':
+        # Already in memory; a cache in front would only copy it
+        return InMemoryChatStorage(config)
+    elif backend == 'postgres':
+        from .pg_chat_storage import PostgresChatStorage
+        storage = PostgresChatStorage(config)
+    else:
+        raise ValueError(f"Unknown chat storage backend: {backend}")
+    if getattr(config, 'chat_cache_enabled', False):
+        from .chat_cache import CachedChatStorage
+        return CachedChatStorage(storage, config)
+    return storage
@@ -9,6 +9,141 @@ class Config:
         self.chunk_size = int(os.getenv('CHUNK_SIZE', 1000))
         self.chunk_overlap = int(os.getenv('CHUNK_OVERLAP', 200))
         self.debug_mode = os.getenv('DEBUG_MODE', 'False').lower() == 'true'
+        # Chat storage backend: sqlite, postgres or memory
+        self.chat_storage_backend = os.getenv('CHAT_STORAGE_BACKEND', 'sqlite')
+        self.chat_db_path = os.getenv('CHAT_DB_PATH')
+        # Comma-separated DSNs; sessions are hash-partitioned across them
+        self.chat_database_urls = [url.strip() for url in os.getenv('CHAT_DATABASE_URLS', '').split(',') if url.strip()]
+        self.chat_db_pool_min = int(os.getenv('CHAT_DB_POOL_MIN', 1))
+        self.chat_db_pool_max = int(os.getenv('CHAT_DB_POOL_MAX', 10))
+        # Chat storage write-behind batching
+        self.chat_write_behind = os.getenv('CHAT_WRITE_BEHIND', 'True').lower() == 'true'
+        self.chat_flush_interval_ms = int(os.getenv('CHAT_FLUSH_INTERVAL_MS', 5))
+        self.chat_flush_max_batch = int(os.getenv('CHAT_FLUSH_MAX_BATCH', 500))
+        # Per-process cache of recent sessions' history; entries older than the revalidate
+        # window are checked against the stored session version before use
+        self.chat_cache_enabled = os.getenv('CHAT_CACHE_ENABLED', 'True').lower() == 'true'
+        self.chat_cache_max_sessions = int(os.getenv('CHAT_CACHE_MAX_SESSIONS', 1000))
+        self.chat_cache_max_mb = float(os.getenv('CHAT_CACHE_MAX_MB', 64))
+        self.chat_cache_revalidate_seconds = float(os.getenv('CHAT_CACHE_REVALIDATE_SECONDS', 30))
+        # Chat history retention, compaction and archival
+        # Off by default: it deletes, archives and rewrites stored history
+        self.chat_retention_enabled = os.getenv('CHAT_RETENTION_ENABLED', 'False').lower() == 'true'
+        self.chat_retention_interval_seconds = int(os.getenv('CHAT_RETENTION_INTERVAL_SECONDS', 3600))
+        self.chat_session_ttl_days = float(os.getenv('CHAT_SESSION_TTL_DAYS', 0))
+        self.chat_archive_after_days = float(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', 30))
+        # Defaults to archive/ in the repository's data directory, next to chat.db
+        self.chat_archive_dir = os.getenv('CHAT_ARCHIVE_DIR')
+        self.chat_compact_after_messages = int(os.getenv('CHAT_COMPACT_AFTER_MESSAGES', 50))
+        self.chat_compact_keep_last = int(os.getenv('CHAT_COMPACT_KEEP_LAST', 20))
+        self.chat_vacuum_interval_hours = float(os.getenv('CHAT_VACUUM_INTERVAL_HOURS', 24))
+        # LLM gateway: rate limiting, concurrency, retries, circuit breaking, hedging
+        self.llm_rate_limit_per_sec = float(os.getenv('LLM_RATE_LIMIT_PER_SEC', 5))
+        self.llm_rate_limit_burst = float(os.getenv('LLM_RATE_LIMIT_BURST', 10))
+        self.llm_max_concurrency = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+        self.llm_max_queue = int(os.getenv('LLM_MAX_QUEUE', 64))
+        self.llm_queue_timeout_seconds = float(os.getenv('LLM_QUEUE_TIMEOUT_SECONDS', 30))
+        self.llm_max_retries = int(os.getenv('LLM_MAX_RETRIES', 3))
+        self.llm_retry_base_delay = float(os.getenv('LLM_RETRY_BASE_DELAY', 0.5))
+        self.llm_retry_max_delay = float(os.getenv('LLM_RETRY_MAX_DELAY', 8))
+        self.llm_circuit_failure_threshold = int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', 5))
+        self.llm_circuit_reset_seconds = float(os.getenv('LLM_CIRCUIT_RESET_SECONDS', 30))
+        self.llm_hedging_enabled = os.getenv('LLM_HEDGING_ENABLED', 'True').lower() == 'true'
+        self.llm_hedge_min_delay_ms = int(os.getenv('LLM_HEDGE_MIN_DELAY_MS', 3000))
+        # LLM slots only chat calls may use, so plan and roadmap surges cannot take them all
+        self.llm_reserved_chat_slots = int(os.getenv('LLM_RESERVED_CHAT_SLOTS', 2))
+        # LLM model routing: tier, output-token cap and temperature per task
+        self.llm_routing_enabled = os.getenv('LLM_ROUTING_ENABLED', 'True').lower() == 'true'
+        self.llm_model_fast = os.getenv('LLM_MODEL_FAST', 'models/gemini-2.0-flash-lite')
+        self.llm_model_standard = os.getenv('LLM_MODEL_STANDARD', 'models/gemini-2.0-flash-exp')
+        self.llm_fast_tasks = [t.strip() for t in os.getenv('LLM_FAST_TASKS', 'chat,plan').split(',') if t.strip()]
+        self.llm_fast_max_input_tokens = int(os.getenv('LLM_FAST_MAX_INPUT_TOKENS', 1500))
+        self.llm_fast_max_plan_weeks = int(os.getenv('LLM_FAST_MAX_PLAN_WEEKS', 4))
+        self.llm_max_output_tokens = int(os.getenv('LLM_MAX_OUTPUT_TOKENS', 8192))
+        self.llm_max_output_tokens_chat = int(os.getenv('LLM_MAX_OUTPUT_TOKENS_CHAT', 1024))
+        self.llm_max_output_tokens_roadmap = int(os.getenv('LLM_MAX_OUTPUT_TOKENS_ROADMAP', 2048))
+        self.llm_plan_output_tokens_base = int(os.getenv('LLM_PLAN_OUTPUT_TOKENS_BASE', 512))
+        self.llm_plan_output_tokens_per_week = int(os.getenv('LLM_PLAN_OUTPUT_TOKENS_PER_WEEK', 200))
+        self.llm_temperature_chat = float(os.getenv('LLM_TEMPERATURE_CHAT', 0.7))
+        self.llm_temperature_plan = float(os.getenv('LLM_TEMPERATURE_PLAN', 0.4))
+        self.llm_temperature_roadmap = float(os.getenv('LLM_TEMPERATURE_ROADMAP', 0.7))
+        # Local daily schedule engine
+        self.schedule_focus_length = int(os.getenv('SCHEDULE_FOCUS_LENGTH', 50))
+        # Long plans: outline first, then weeks in parallel blocks
+        self.plan_fanout_min_weeks = int(os.getenv('PLAN_FANOUT_MIN_WEEKS', 8))
+        self.plan_fanout_weeks_per_call = int(os.getenv('PLAN_FANOUT_WEEKS_PER_CALL', 4))
+        self.plan_fanout_concurrency = int(os.getenv('PLAN_FANOUT_CONCURRENCY', 4))
+        # Generated plan repository
+        self.plan_db_path = os.getenv('PLAN_DB_PATH')
+        # Background job queue
+        self.job_db_path = os.getenv('JOB_DB_PATH')
+        self.job_workers = int(os.getenv('JOB_WORKERS', 2))
+        self.job_max_attempts = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+        self.job_retry_base_delay = float(os.getenv('JOB_RETRY_BASE_DELAY', 5))
+        self.job_poll_interval_seconds = float(os.getenv('JOB_POLL_INTERVAL_SECONDS', 1))
+        self.job_webhook_timeout_seconds = float(os.getenv('JOB_WEBHOOK_TIMEOUT_SECONDS', 10))
+        # A running job whose worker has not renewed its lease for this long is requeued
+        self.job_lease_seconds = float(os.getenv('JOB_LEASE_SECONDS', 60))
+        # Cohort plan generation: plans generated at once across all batch requests
+        self.batch_plan_concurrency = int(os.getenv('BATCH_PLAN_CONCURRENCY', 4))
+        self.batch_max_submissions = int(os.getenv('BATCH_MAX_SUBMISSIONS', 500))
+        # Per-tenant knowledge base namespaces and document uploads
+        self.tenant_kb_dir = os.getenv('TENANT_KB_DIR', os.path.join('data', 'tenants'))
+        self.tenant_cache_max_namespaces = int(os.getenv('TENANT_CACHE_MAX_NAMESPACES', 64))
+        self.tenant_cache_max_mb = float(os.getenv('TENANT_CACHE_MAX_MB', 256))
+        self.upload_dir = os.getenv('UPLOAD_DIR', os.path.join('data', 'uploads'))
+        self.upload_max_mb = float(os.getenv('UPLOAD_MAX_MB', 25))
+        # Near-duplicate chunk elimination at ingest (MinHash + LSH)
+        self.dedup_enabled = os.getenv('DEDUP_ENABLED', 'True').lower() == 'true'
+        self.dedup_threshold = float(os.getenv('DEDUP_THRESHOLD', 0.85))
+        self.dedup_num_perm = int(os.getenv('DEDUP_NUM_PERM', 128))
+        self.dedup_shingle_size = int(os.getenv('DEDUP_SHINGLE_SIZE', 5))
+        # Extractive compression of retrieved context before prompt assembly
+        self.context_compression_enabled = os.getenv('CONTEXT_COMPRESSION_ENABLED', 'True').lower() == 'true'
+        self.context_token_budget = int(os.getenv('CONTEXT_TOKEN_BUDGET', 400))
+        self.context_min_sentence_chars = int(os.getenv('CONTEXT_MIN_SENTENCE_CHARS', 25))
+        # Vector index snapshots: generations kept on disk, and polling of MANIFEST.json for hot reloads
+        self.index_keep_generations = int(os.getenv('INDEX_KEEP_GENERATIONS', 2))
+        self.index_watch_enabled = os.getenv('INDEX_WATCH_ENABLED', 'False').lower() == 'true'
+        self.index_watch_interval_seconds = float(os.getenv('INDEX_WATCH_INTERVAL_SECONDS', 5))
+        # Shared secret for /api/admin endpoints; unset disables them
+        self.admin_token = os.getenv('ADMIN_TOKEN')
+        # Sharded vector index: remote shard servers (host:port, comma-separated) or local shard processes
+        self.vector_shard_addresses = [a.strip() for a in os.getenv('VECTOR_SHARD_ADDRESSES', '').split(',') if a.strip()]
+        self.vector_local_shards = int(os.getenv('VECTOR_LOCAL_SHARDS', 0))
+        self.vector_shard_authkey = os.getenv('VECTOR_SHARD_AUTHKEY')
+        self.vector_shard_timeout_seconds = float(os.getenv('VECTOR_SHARD_TIMEOUT_SECONDS', 2))
+        self.vector_shard_dir = os.getenv('VECTOR_SHARD_DIR', os.path.join('data', 'shards'))
+        # HTTP admission control: slots shared by all managed requests, plus per priority
+        # class slots, queue bound and longest queue wait before shedding with 429
+        self.admission_enabled = os.getenv('ADMISSION_ENABLED', 'True').lower() == 'true'
+        self.admission_max_concurrency = int(os.getenv('ADMISSION_MAX_CONCURRENCY', 32))
+        self.admission_interactive_max_queue = int(os.getenv('ADMISSION_INTERACTIVE_MAX_QUEUE', 200))
+        self.admission_interactive_max_wait_seconds = float(os.getenv('ADMISSION_INTERACTIVE_MAX_WAIT_SECONDS', 2))
+        self.admission_standard_max_concurrency = int(os.getenv('ADMISSION_STANDARD_MAX_CONCURRENCY', 8))
+        self.admission_standard_max_queue = int(os.getenv('ADMISSION_STANDARD_MAX_QUEUE', 50))
+        self.admission_standard_max_wait_seconds = float(os.getenv('ADMISSION_STANDARD_MAX_WAIT_SECONDS', 10))
+        self.admission_batch_max_concurrency = int(os.getenv('ADMISSION_BATCH_MAX_CONCURRENCY', 4))
+        self.admission_batch_max_queue = int(os.getenv('ADMISSION_BATCH_MAX_QUEUE', 20))
+        self.admission_batch_max_wait_seconds = float(os.getenv('ADMISSION_BATCH_MAX_WAIT_SECONDS', 30))
+        # Onboarding form prefetch: cached retrieval/context per draft goal, and speculative
+        # plan generation adopted on submit when the profile matches
+        self.prefetch_ttl_seconds = float(os.getenv('PREFETCH_TTL_SECONDS', 300))
+        self.prefetch_max_entries = int(os.getenv('PREFETCH_MAX_ENTRIES', 1000))
+        self.prefetch_speculation_enabled = os.getenv('PREFETCH_SPECULATION_ENABLED', 'True').lower() == 'true'
+        self.prefetch_speculation_concurrency = int(os.getenv('PREFETCH_SPECULATION_CONCURRENCY', 2))
+        # Goal clusters: context packs precomputed per recurring goal theme by the goal_clusters job
+        self.goal_clusters_enabled = os.getenv('GOAL_CLUSTERS_ENABLED', 'True').lower() == 'true'
+        self.goal_cluster_path = os.getenv('GOAL_CLUSTER_PATH', os.path.join('data', 'goal_clusters.pkl'))
+        self.goal_cluster_count = int(os.getenv('GOAL_CLUSTER_COUNT', 300))
+        self.goal_cluster_min_similarity = float(os.getenv('GOAL_CLUSTER_MIN_SIMILARITY', 0.6))
+        self.goal_cluster_max_goals = int(os.getenv('GOAL_CLUSTER_MAX_GOALS', 20000))
+        self.goal_cluster_max_sessions = int(os.getenv('GOAL_CLUSTER_MAX_SESSIONS', 2000))
+        self.goal_cluster_queries_per_pack = int(os.getenv('GOAL_CLUSTER_QUERIES_PER_PACK', 8))
+        # Rows per keyset batch read by /api/admin/export
+        self.export_batch_size = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+        # Build the vector DB from Study_Materials in a background job instead of at import
+        self.defer_ingest = os.getenv('DEFER_INGEST', 'True').lower() == 'true'
         
     def __str__(self):
         return f"Configuration:\nGoogle API Key: {'Set' if self.google_api_key else 'Not Set'}\nChunk Size: {self.chunk_size}\nChunk Overlap: {self.chunk_overlap}\nDebug Mode: {self.debug_mode}"
\ No newline at end of file
@@ -0,0 +1,113 @@
+import math
+import re
+import numpy as np
+from typing import List, Dict, Any
+from .vector_db import VectorDatabase
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n\s*\n|\s*[•▪●]\s*')
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English prose)."""
+    return math.ceil(len(text) / 4)
+
+
+class ContextCompressor:
+    """
+    Extractive compression of retrieved chunks before prompt assembly.
+
+    Chunks are split into sentences, each sentence is scored against the
+    query in the knowledge base's own TF-IDF space, and the best sentences
+    are kept until CONTEXT_TOKEN_BUDGET is spent. Kept sentences are put
+    back in reading order and grouped per source, so every passage still
+    says which book it came from.
+    """
+
+    def __init__(self, vector_db: VectorDatabase, config):
+        self.vector_db = vector_db
+        self.config = config
+        self.enabled = config.context_compression_enabled
+        self.token_budget = config.context_token_budget
+        self.min_sentence_chars = config.context_min_sentence_chars
+
+    def _sentences(self, documents: List[str]) -> List[tuple]:
+        """(chunk rank, position, sentence) for every usable sentence, first occurrence only."""
+        seen = set()
+        sentences = []
+        for rank, document in enumerate(documents):
+            for position, raw in enumerate(SENTENCE_BOUNDARY.split(document)):
+                sentence = " ".join(raw.split())
+                key = sentence.lower()
+                # Overlapping chunks repeat sentences; keep the first copy
+                if len(sentence) < self.min_sentence_chars or key in seen:
+                    continue
+                seen.add(key)
+                sentences.append((rank, position, sentence))
+        return sentences
+
+    def compress(self, query: str, retrieval: Dict[str, Any], token_budget: int = None) -> Dict[str, Any]:
+        """
+        Compress a retrieval result to the sentences most relevant to query.
+
+        Args:
+            query (str): The text the context should support
+            retrieval (Dict[str, Any]): Result of a vector search (documents, metadatas, ids)
+            token_budget (int, optional): Overrides CONTEXT_TOKEN_BUDGET
+
+        Returns:
+            Dict[str, Any]: Same shape as the input, with one passage per source in
+                'documents', plus a 'compression' entry with token counts
+        """
+        documents = retrieval.get('documents', [])
+        if not self.enabled or not documents:
+            return retrieval
+        budget = token_budget or self.token_budget
+        metadatas = retrieval.get('metadatas') or [{} for _ in documents]
+        ids = retrieval.get('ids') or [None for _ in documents]
+        refs = retrieval.get('refs') or [None for _ in documents]
+        input_tokens = sum(estimate_tokens(document) for document in documents)
+
+        sentences = self._sentences(documents)
+        if not sentences:
+            return retrieval
+        try:
+            matrix = self.vector_db.vectorizer.transform([query] + [s[2] for s in sentences])
+            # Rows are L2-normalized, so the dot product is the cosine similarity
+            scores = (matrix[1:] @ matrix[0].T).toarray().ravel()
+        except Exception as e:
+            print(f"Error scoring sentences for compression: {str(e)}")
+            scores = np.zeros(len(sentences))
+
+        # Best score first; ties (including no overlap at all) go to the better-ranked chunk
+        order = sorted(range(len(sentences)), key=lambda i: (-scores[i], sentences[i][0], sentences[i][1]))
+        selected = []
+        used = 0
+        for i in order:
+            cost = estimate_tokens(sentences[i][2])
+            if used + cost > budget:
+                continue
+            selected.append(i)
+            used += cost
+
+        passages = {}
+        for i in sorted(selected, key=lambda i: (sentences[i][0], sentences[i][1])):
+            rank = sentences[i][0]
+            source = metadatas[rank].get('source', 'unknown')
+            passage = passages.setdefault(source, {'sentences': [], 'ranks': []})
+            passage['sentences'].append(sentences[i][2])
+            if rank not in passage['ranks']:
+                passage['ranks'].append(rank)
+
+        compressed_documents = [f"[{source}] " + " ".join(p['sentences']) for source, p in passages.items()]
+        return {
+            'documents': compressed_documents,
+            'metadatas': [dict(metadatas[p['ranks'][0]], chunks=len(p['ranks'])) for p in passages.values()],
+            'distances': [],
+            'ids': [ids[rank] for p in passages.values() for rank in p['ranks']],
+            'refs': [refs[rank] for p in passages.values() for rank in p['ranks']],
+            'compression': {
+                'input_tokens': input_tokens,
+                'output_tokens': sum(estimate_tokens(document) for document in compressed_documents),
+                'sentences_kept': len(selected),
+                'sentences_total': len(sentences)
+            }
+        }
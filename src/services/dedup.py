@@ -0,0 +1,200 @@
+import os
+import re
+import zlib
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+
+# Mersenne prime above 2**32 for the universal hash family
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+def _optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """Bands x rows whose LSH S-curve crosses 50% closest to the threshold."""
+    best = (1, num_perm)
+    best_error = float('inf')
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class MinHashDeduplicator:
+    """
+    Near-duplicate detection for text chunks with MinHash + LSH banding.
+
+    Chunks are shingled into overlapping word n-grams; two chunks whose
+    estimated Jaccard similarity reaches `threshold` are duplicates. LSH
+    buckets keep each lookup close to constant time, so a deduplicator
+    can be fed a whole ingest run chunk by chunk. Text without any word
+    has no shingles and no signature, and never matches anything.
+    """
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        self.bands, self.rows = _optimal_bands(threshold, num_perm)
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = []
+        self._items = []
+
+    def _shingles(self, text: str) -> np.ndarray:
+        words = re.findall(r'\w+', text.lower())
+        if not words:
+            return np.array([], dtype=np.uint64)
+        if len(words) <= self.shingle_size:
+            grams = {" ".join(words)}
+        else:
+            grams = {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+        return np.array([zlib.crc32(gram.encode('utf-8')) for gram in grams], dtype=np.uint64)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """MinHash signature: per permutation, the minimum hash over the text's shingles; None without shingles."""
+        shingles = self._shingles(text)
+        if not len(shingles):
+            return None
+        hashed = (np.outer(shingles, self._a) + self._b) % MERSENNE_PRIME & MAX_HASH
+        return hashed.min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def find_duplicate(self, text: str) -> Tuple[Optional[Any], Optional[np.ndarray], float]:
+        """
+        Look up the closest already-added item for text.
+
+        Returns:
+            Tuple[Optional[Any], Optional[np.ndarray], float]: (item or None, signature, estimated similarity)
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return None, None, 0.0
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self._buckets[band].get(key, ()))
+        best, best_similarity = None, 0.0
+        for position in candidates:
+            similarity = float(np.mean(self._signatures[position] == signature))
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = self._items[position], similarity
+        return best, signature, best_similarity
+
+    def add(self, item: Any, signature: Optional[np.ndarray]):
+        """Index an item under its signature; an item without one is kept but never matched."""
+        position = len(self._items)
+        self._items.append(item)
+        self._signatures.append(signature)
+        if signature is None:
+            return
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(key, []).append(position)
+
+    def save(self, path: str, key: str):
+        """
+        Write the signatures of every added item, in order, tagged with key
+        (e.g. the index generation they belong to), so load() can restore
+        them without re-signing the texts.
+        """
+        present = np.array([signature is not None for signature in self._signatures], dtype=bool)
+        signatures = np.zeros((len(self._signatures), self.num_perm), dtype=np.uint64)
+        for row, signature in enumerate(self._signatures):
+            if signature is not None:
+                signatures[row] = signature
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, key=np.array(key), params=np.array([self.num_perm, self.shingle_size, self.seed]),
+                     signatures=signatures, present=present)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load(self, path: str, key: str, items: List[Any]) -> bool:
+        """
+        Add items with the signatures saved for them under key.
+
+        Returns:
+            bool: False, with nothing added, when there is no saved file for
+                this key, these settings and this many items
+        """
+        try:
+            with np.load(path) as saved:
+                if (str(saved['key']) != key
+                        or saved['params'].tolist() != [self.num_perm, self.shingle_size, self.seed]
+                        or len(saved['present']) != len(items)):
+                    return False
+                signatures, present = saved['signatures'], saved['present']
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"Error loading dedup signatures: {str(e)}")
+            return False
+        for item, signature, has_signature in zip(items, signatures, present):
+            self.add(item, signature if has_signature else None)
+        return True
+
+
+def new_report() -> Dict[str, Any]:
+    return {"input": 0, "kept": 0, "empty": 0, "duplicates": 0, "merged_sources": 0}
+
+
+def dedupe_chunks(chunks: List[str],
+                  metadata: List[Dict[str, Any]],
+                  deduplicator: MinHashDeduplicator,
+                  report: Optional[Dict[str, Any]] = None) -> Tuple[List[str], List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Drop near-duplicate chunks before they reach the index.
+
+    The first copy of a chunk is kept; when a duplicate comes from a
+    different source, that source is merged into the kept chunk's
+    metadata["also_in"] so provenance is not lost. The deduplicator keeps
+    a reference to each kept metadata dict, so duplicates found in later
+    calls of the same run are merged into chunks that are already indexed.
+
+    Args:
+        chunks (List[str]): Chunk texts
+        metadata (List[Dict[str, Any]]): Metadata for each chunk
+        deduplicator (MinHashDeduplicator): Index of chunks kept so far
+        report (Dict[str, Any], optional): Running counts to update across calls
+
+    Returns:
+        Tuple[List[str], List[Dict[str, Any]], Dict[str, Any]]: Kept chunks, their metadata, and the report
+    """
+    report = report if report is not None else new_report()
+    kept_chunks, kept_metadata = [], []
+    for chunk, meta in zip(chunks, metadata):
+        report["input"] += 1
+        if not chunk.strip():
+            report["empty"] += 1
+            continue
+        original, signature, _ = deduplicator.find_duplicate(chunk)
+        if original is not None:
+            report["duplicates"] += 1
+            source = meta.get("source")
+            if source and source != original.get("source") and source not in original.get("also_in", []):
+                original.setdefault("also_in", []).append(source)
+                report["merged_sources"] += 1
+            continue
+        deduplicator.add(meta, signature)
+        kept_chunks.append(chunk)
+        kept_metadata.append(meta)
+        report["kept"] += 1
+    return kept_chunks, kept_metadata, report
+
+
+def create_deduplicator(config) -> Optional[MinHashDeduplicator]:
+    """Deduplicator configured from DEDUP_* settings, or None when dedup is disabled."""
+    if not config.dedup_enabled:
+        return None
+    return MinHashDeduplicator(
+        threshold=config.dedup_threshold,
+        num_perm=config.dedup_num_perm,
+        shingle_size=config.dedup_shingle_size
+    )
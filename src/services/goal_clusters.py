@@ -0,0 +1,246 @@
+import os
+import re
+import time
+import pickle
+import threading
+import numpy as np
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from sklearn.cluster import KMeans
+from .vector_db import chunk_ref
+
+# Prompt lines the plan and roadmap endpoints store the user's goal in
+GOAL_LINE = re.compile(r"^(?:- )?Goal: (.+)$", re.MULTILINE)
+# Chunks per context pack; matches the plan and roadmap endpoints' n_results
+CONTEXT_PACK_RESULTS = 5
+
+
+def collect_goals(plan_store, chat_storage, max_goals: int, max_sessions: int) -> Counter:
+    """
+    Historical goals with how often each was asked for, from stored plans
+    and from the plan and roadmap prompts kept in chat history.
+    """
+    goals = Counter()
+    for goal, count in plan_store.goal_counts(limit=max_goals):
+        goals[goal.strip().lower()] += count
+    for session in chat_storage.find_sessions(min_messages=1, limit=max_sessions):
+        for message in chat_storage.get_session_messages(session['session_id']):
+            if message['role'] != 'user':
+                continue
+            match = GOAL_LINE.search(message['content'])
+            if match:
+                goals[match.group(1).strip().lower()] += 1
+    goals.pop('', None)
+    return Counter(dict(goals.most_common(max_goals)))
+
+
+class ClusterModel:
+    """Centroids and context packs built against one index generation; never modified."""
+
+    def __init__(self, generation: str, centroids: np.ndarray, packs: List[Dict[str, Any]], built_at: float):
+        self.generation = generation
+        # One L2-normalized row per cluster, in the index vectorizer's space
+        self.centroids = centroids
+        self.packs = packs
+        self.built_at = built_at
+
+
+class GoalClusters:
+    """
+    Precomputed retrieval for recurring goal themes.
+
+    rebuild() (the goal_clusters job) clusters historical goals with
+    k-means over the index's own TF-IDF space, so goals that would
+    retrieve alike land together. Each cluster gets a context pack: chunks
+    voted for by the retrievals of its most frequent goals, compressed
+    against the cluster's most common goal. lookup() maps a goal to its
+    nearest centroid with one matrix-vector product and returns the pack
+    when the cosine similarity reaches GOAL_CLUSTER_MIN_SIMILARITY.
+    Packs are ignored once the index is rebuilt, until the next rebuild.
+    The job may run in another process: lookups check the saved file at
+    most every INDEX_WATCH_INTERVAL_SECONDS and load it when it changed.
+    """
+
+    def __init__(self, config, vector_db, compressor):
+        self.config = config
+        self.vector_db = vector_db
+        self.compressor = compressor
+        self.path = config.goal_cluster_path
+        self.min_similarity = config.goal_cluster_min_similarity
+        self.check_interval = config.index_watch_interval_seconds
+        self._model = None
+        # (mtime_ns, size) of the file the model was loaded from or saved to
+        self._stamp = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.metrics = {"hits": 0, "misses": 0, "stale": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.metrics[name] += 1
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.vector_db.vectorizer.transform(texts).toarray().astype('float32')
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _build_pack(self, cluster: int, members: List[Tuple[str, int]]) -> Dict[str, Any]:
+        """Context pack for one cluster from the retrievals of its most frequent goals."""
+        queries = [goal for goal, _ in members[:self.config.goal_cluster_queries_per_pack]]
+        results = self.vector_db.search_batch(queries, n_results=CONTEXT_PACK_RESULTS)
+        votes, chunks = Counter(), {}
+        for (goal, weight), result in zip(members, results):
+            for rank, (doc, meta, dist, idx) in enumerate(zip(result['documents'], result['metadatas'],
+                                                              result['distances'], result['ids'])):
+                votes[idx] += weight / (rank + 1.0)
+                if idx not in chunks or dist < chunks[idx][2]:
+                    chunks[idx] = (doc, meta, dist)
+        top = [idx for idx, _ in votes.most_common(CONTEXT_PACK_RESULTS)]
+        retrieval = {
+            'documents': [chunks[idx][0] for idx in top],
+            'metadatas': [chunks[idx][1] for idx in top],
+            'distances': [chunks[idx][2] for idx in top],
+            'ids': top,
+            'refs': [chunk_ref(chunks[idx][0]) for idx in top]
+        }
+        label = members[0][0]
+        return {
+            "cluster": cluster,
+            "label": label,
+            "requests": sum(weight for _, weight in members),
+            "goals": [goal for goal, _ in members[:10]],
+            "retrieval": retrieval,
+            "context": self.compressor.compress(label, retrieval)['documents']
+        }
+
+    def build(self, goals: Counter, progress=None) -> Optional[ClusterModel]:
+        """
+        Cluster goals (weighted by request count) and build their context packs.
+
+        Args:
+            goals (Counter): Goal text -> number of requests
+            progress (callable, optional): progress(fraction, message) callback
+
+        Returns:
+            ClusterModel: The new model, or None when there is nothing to cluster
+        """
+        if not goals or not self.vector_db.count():
+            return None
+        generation = self.vector_db.generation_info().get("generation")
+        texts = list(goals)
+        weights = np.array([goals[text] for text in texts], dtype='float64')
+        vectors = self._embed(texts)
+        # Goals with no word in the index vocabulary retrieve nothing useful
+        known = np.linalg.norm(vectors, axis=1) > 0
+        texts = [text for text, keep in zip(texts, known) if keep]
+        vectors, weights = vectors[known], weights[known]
+        if not texts:
+            return None
+
+        k = max(1, min(self.config.goal_cluster_count, len(texts)))
+        kmeans = KMeans(n_clusters=k, n_init=3, random_state=0)
+        labels = kmeans.fit_predict(vectors, sample_weight=weights)
+        centroids = kmeans.cluster_centers_.astype('float32')
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        members = [[] for _ in range(k)]
+        for text, label, weight in zip(texts, labels, weights):
+            members[label].append((text, int(weight)))
+        packs = []
+        for cluster in range(k):
+            if progress and cluster % 20 == 0:
+                progress(0.2 + 0.7 * cluster / k, f"Building context pack {cluster + 1}/{k}")
+            members[cluster].sort(key=lambda member: -member[1])
+            packs.append(self._build_pack(cluster, members[cluster]) if members[cluster] else None)
+        return ClusterModel(generation, centroids, packs, time.time())
+
+    def save(self, model: ClusterModel):
+        """Write the model next to its previous version and swap it in atomically."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(model, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def load(self) -> bool:
+        """Load the saved model, if any; True when one was loaded."""
+        stamp = self._file_stamp()
+        if stamp is None:
+            return False
+        # Recorded even if loading fails, so a broken file is not retried on every check
+        self._stamp = stamp
+        try:
+            with open(self.path, 'rb') as f:
+                self._model = pickle.load(f)
+            return True
+        except Exception as e:
+            print(f"Error loading goal clusters: {str(e)}")
+            return False
+
+    def _refresh(self):
+        """Load the saved model again if another process has replaced it since."""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        stamp = self._file_stamp()
+        if stamp is not None and stamp != self._stamp:
+            self.load()
+
+    def rebuild(self, plan_store, chat_storage, progress=None) -> Dict[str, Any]:
+        """Collect historical goals, cluster them, save and publish the packs."""
+        if progress:
+            progress(0.05, "Collecting historical goals")
+        goals = collect_goals(plan_store, chat_storage, self.config.goal_cluster_max_goals,
+                              self.config.goal_cluster_max_sessions)
+        model = self.build(goals, progress=progress)
+        if model is None:
+            return {"goals": len(goals), "clusters": 0}
+        self.save(model)
+        self._model = model
+        self._stamp = self._file_stamp()
+        return {"goals": len(goals), "clusters": len(model.packs), "generation": model.generation}
+
+    def lookup(self, goal: str) -> Optional[Tuple[Dict[str, Any], List[str]]]:
+        """
+        Precomputed (retrieval, context) for the goal's cluster, or None when
+        the goal is not close enough to any cluster or the packs are stale.
+        """
+        self._refresh()
+        model = self._model
+        if model is None:
+            return None
+        if model.generation != self.vector_db.generation_info().get("generation"):
+            self._count("stale")
+            return None
+        vector = self._embed([goal])[0]
+        similarities = model.centroids @ vector
+        cluster = int(np.argmax(similarities))
+        pack = model.packs[cluster]
+        if pack is None or similarities[cluster] < self.min_similarity:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return pack["retrieval"], pack["context"]
+
+    def stats(self) -> Dict[str, Any]:
+        """Lookup counters and the published model's size and age."""
+        model = self._model
+        with self._lock:
+            stats = dict(self.metrics)
+        stats.update({
+            "clusters": len(model.packs) if model else 0,
+            "generation": model.generation if model else None,
+            "built_at": model.built_at if model else None,
+            "min_similarity": self.min_similarity
+        })
+        return stats
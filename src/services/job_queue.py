@@ -0,0 +1,401 @@
+import os
+import sqlite3
+import json
+import socket
+import ipaddress
+import threading
+import time
+import uuid
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from .llm_gateway import LLMProviderError
+
+# handler(payload, progress) -> result; progress(fraction, message) records progress
+JobHandler = Callable[[Dict[str, Any], Callable[[float, str], None]], Dict[str, Any]]
+
+TERMINAL_STATES = ("succeeded", "failed")
+
+# Handler errors that another attempt cannot fix: bad input or a provider refusal
+PERMANENT_ERRORS = (ValueError, LLMProviderError)
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts else None
+
+
+def _public_addresses(host: str, port: int) -> bool:
+    """True when every address the host resolves to is publicly routable."""
+    try:
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except socket.gaierror:
+        return False
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%', 1)[0])
+        if getattr(address, 'ipv4_mapped', None):
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            return False
+    return bool(infos)
+
+
+def validate_webhook_url(url: str) -> str:
+    """
+    Reject webhook URLs that are not http(s) or that point into the private network.
+
+    The host is resolved and every address must be public, so a webhook
+    cannot be used to reach loopback, link-local (cloud metadata) or
+    private services from the server.
+
+    Raises:
+        ValueError: If the URL is not allowed
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError("webhook_url must be an http or https URL")
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    except ValueError:
+        raise ValueError("webhook_url has an invalid port")
+    if not _public_addresses(parsed.hostname, port):
+        raise ValueError("webhook_url must resolve to a public address")
+    return url
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Webhook deliveries do not follow redirects, which could lead past validate_webhook_url."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class JobQueue:
+    """
+    Persistent background job queue backed by SQLite.
+
+    Jobs are rows in `jobs` (queued -> running -> succeeded/failed) and are
+    claimed by a pool of worker threads in priority order. Failed jobs are
+    re-queued with exponential backoff (or the error's retry_after) until
+    max_attempts is reached; ValueErrors and provider refusals fail at once.
+    Every state or progress change bumps `revision`, which the SSE endpoint
+    uses to detect updates.
+
+    A claimed job carries a lease (owner and expiry) that a heartbeat
+    thread renews while it runs. Several processes can share the database:
+    a running job is only requeued once its lease has expired, i.e. its
+    worker has stopped, never because another process (re)started.
+    """
+
+    def __init__(self, config, db_path: Optional[str] = None):
+        self.config = config
+        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.db_path = db_path or config.job_db_path or os.path.join(self.data_dir, 'jobs.db')
+        self.handlers = {}
+        self.finishers = {}
+        # Lease owner for the jobs this instance claims
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self):
+        """Create the jobs table and the claim index."""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                priority INTEGER NOT NULL DEFAULT 0,
+                payload TEXT,
+                result TEXT,
+                error TEXT,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 1,
+                webhook_url TEXT,
+                revision INTEGER NOT NULL DEFAULT 0,
+                run_after REAL NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                lease_owner TEXT,
+                lease_expires REAL
+            )
+        ''')
+
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(jobs)')]
+        if 'lease_owner' not in columns:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN lease_owner TEXT')
+        if 'lease_expires' not in columns:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN lease_expires REAL')
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_jobs_claim
+            ON jobs (status, priority DESC, run_after, created_at)
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def register(self, kind: str, handler: JobHandler,
+                 on_finish: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Register the function that runs jobs of this kind, and optionally one
+        called with the payload once a job has succeeded or finally failed
+        (e.g. to remove files the payload points at).
+        """
+        self.handlers[kind] = handler
+        if on_finish is not None:
+            self.finishers[kind] = on_finish
+
+    def enqueue(self,
+                kind: str,
+                payload: Optional[Dict[str, Any]] = None,
+                priority: int = 0,
+                max_attempts: Optional[int] = None,
+                webhook_url: Optional[str] = None,
+                unique: bool = False) -> str:
+        """
+        Add a job to the queue.
+
+        Args:
+            kind (str): Registered job kind
+            payload (Dict[str, Any], optional): JSON-serializable handler input
+            priority (int): Higher runs first
+            max_attempts (int, optional): Attempts before the job fails, defaults to JOB_MAX_ATTEMPTS
+            webhook_url (str, optional): Public http(s) URL that receives the final job state as a JSON POST
+            unique (bool): Return the job_id of a queued or running job of this kind
+                instead of adding another, e.g. when every API worker asks on startup
+
+        Returns:
+            str: The new job_id, or the existing one for a unique kind
+
+        Raises:
+            ValueError: If the kind is unknown or the webhook URL is not allowed
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if webhook_url:
+            validate_webhook_url(webhook_url)
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            if unique:
+                existing = cursor.execute(
+                    "SELECT job_id FROM jobs WHERE kind = ? AND status IN ('queued', 'running') LIMIT 1",
+                    (kind,)
+                ).fetchone()
+                if existing:
+                    conn.commit()
+                    return existing[0]
+            cursor.execute(
+                '''
+                INSERT INTO jobs (job_id, kind, priority, payload, max_attempts, webhook_url, run_after, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                (job_id, kind, priority, json.dumps(payload or {}),
+                 max_attempts or self.config.job_max_attempts, webhook_url, now, now)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self._wakeup.set()
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Current state of a job, or None if it does not exist."""
+        conn = self._connect()
+        row = conn.execute(
+            '''
+            SELECT job_id, kind, status, priority, result, error, progress, message,
+                   attempts, max_attempts, revision, created_at, started_at, finished_at
+            FROM jobs WHERE job_id = ?
+            ''',
+            (job_id,)
+        ).fetchone()
+        conn.close()
+        if not row:
+            return None
+        return {
+            'job_id': row[0],
+            'kind': row[1],
+            'status': row[2],
+            'priority': row[3],
+            'result': json.loads(row[4]) if row[4] else None,
+            'error': row[5],
+            'progress': row[6],
+            'message': row[7],
+            'attempts': row[8],
+            'max_attempts': row[9],
+            'revision': row[10],
+            'created_at': _iso(row[11]),
+            'started_at': _iso(row[12]),
+            'finished_at': _iso(row[13])
+        }
+
+    def start(self):
+        """Start the worker threads and the lease heartbeat."""
+        if self._workers:
+            return
+        self._stop.clear()
+        for i in range(self.config.job_workers):
+            worker = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        heartbeat = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        self._workers.append(heartbeat)
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the workers; jobs still running are requeued once their leases expire."""
+        self._stop.set()
+        self._wakeup.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def _heartbeat(self):
+        """Renew the leases of this instance's running jobs until stopped."""
+        interval = self.config.job_lease_seconds / 3
+        while not self._stop.wait(interval):
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "UPDATE jobs SET lease_expires = ? WHERE status = 'running' AND lease_owner = ?",
+                    (time.time() + self.config.job_lease_seconds, self.owner)
+                )
+                conn.commit()
+                conn.close()
+            except Exception as e:
+                print(f"Error renewing job leases: {str(e)}")
+
+    def _claim(self) -> Optional[tuple]:
+        """Requeue jobs with expired leases, then atomically lease the next runnable job."""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            # Rows without a lease were left running by a version without leases
+            cursor.execute(
+                '''
+                UPDATE jobs SET status = 'queued', lease_owner = NULL, lease_expires = NULL,
+                                message = 'Requeued after its worker stopped', revision = revision + 1
+                WHERE status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)
+                ''',
+                (now,)
+            )
+            cursor.execute(
+                '''
+                SELECT job_id, kind, payload, attempts, max_attempts, webhook_url FROM jobs
+                WHERE status = 'queued' AND run_after <= ?
+                ORDER BY priority DESC, created_at
+                LIMIT 1
+                ''',
+                (now,)
+            )
+            row = cursor.fetchone()
+            if row:
+                cursor.execute(
+                    '''
+                    UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?,
+                                    lease_owner = ?, lease_expires = ?, revision = revision + 1
+                    WHERE job_id = ?
+                    ''',
+                    (now, self.owner, now + self.config.job_lease_seconds, row[0])
+                )
+            conn.commit()
+            return row
+        finally:
+            conn.close()
+
+    def _update(self, job_id: str, **fields) -> bool:
+        """Update a job this instance still holds the lease on; False if the lease was lost."""
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._connect()
+        cursor = conn.execute(
+            f"UPDATE jobs SET {assignments}, revision = revision + 1 "
+            f"WHERE job_id = ? AND status = 'running' AND lease_owner = ?",
+            (*fields.values(), job_id, self.owner)
+        )
+        conn.commit()
+        conn.close()
+        return cursor.rowcount > 0
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"Error claiming job: {str(e)}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.config.job_poll_interval_seconds)
+                self._wakeup.clear()
+                continue
+            self._run(*job)
+
+    def _run(self, job_id: str, kind: str, payload: str, attempts: int, max_attempts: int, webhook_url: Optional[str]):
+        attempt = attempts + 1
+
+        def progress(fraction: float, message: str = None):
+            self._update(job_id, progress=max(0.0, min(1.0, fraction)), message=message)
+
+        try:
+            result = self.handlers[kind](json.loads(payload or '{}'), progress)
+        except Exception as e:
+            print(f"Error running {kind} job {job_id} (attempt {attempt}/{max_attempts}): {str(e)}")
+            if attempt < max_attempts and not isinstance(e, PERMANENT_ERRORS):
+                backoff = self.config.job_retry_base_delay * (2 ** (attempt - 1))
+                delay = max(backoff, getattr(e, 'retry_after', 0) or 0)
+                self._update(job_id, status='queued', error=str(e), run_after=time.time() + delay,
+                             message=f"Retrying in {delay:.0f}s", lease_owner=None, lease_expires=None)
+                return
+            finished = self._update(job_id, status='failed', error=str(e), finished_at=time.time(),
+                                    lease_owner=None, lease_expires=None)
+        else:
+            finished = self._update(job_id, status='succeeded', result=json.dumps(result), progress=1.0,
+                                    error=None, finished_at=time.time(), lease_owner=None, lease_expires=None)
+
+        if not finished:
+            print(f"Job {job_id} lost its lease while running; its result was discarded")
+            return
+        if kind in self.finishers:
+            try:
+                self.finishers[kind](json.loads(payload or '{}'))
+            except Exception as e:
+                print(f"Error finishing {kind} job {job_id}: {str(e)}")
+        if webhook_url:
+            self._notify(webhook_url, self.get_job(job_id))
+
+    def _notify(self, url: str, job: Dict[str, Any]):
+        """POST the final job state to its webhook; failures are logged, not retried."""
+        try:
+            # Checked again at delivery: the host may resolve differently than at enqueue
+            validate_webhook_url(url)
+            request = urllib.request.Request(
+                url,
+                data=json.dumps(job).encode('utf-8'),
+                headers={'Content-Type': 'application/json'},
+                method='POST'
+            )
+            opener = urllib.request.build_opener(_NoRedirect)
+            with opener.open(request, timeout=self.config.job_webhook_timeout_seconds):
+                pass
+        except Exception as e:
+            print(f"Error delivering webhook for job {job['job_id']}: {str(e)}")
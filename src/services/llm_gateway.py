@@ -0,0 +1,344 @@
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Optional
+
+class LLMGatewayError(Exception):
+    """Raised when the gateway cannot serve an LLM call right now."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GatewayOverloadedError(LLMGatewayError):
+    """The wait queue is full or the call waited too long for a slot."""
+
+
+class CircuitOpenError(LLMGatewayError):
+    """The provider is failing and calls are being short-circuited."""
+
+
+class LLMUnavailableError(LLMGatewayError):
+    """Retryable provider errors persisted through every retry."""
+
+
+class LLMProviderError(Exception):
+    """The provider answered a call with an error that retrying will not fix."""
+
+
+# Exception class names and message fragments that mark transient
+# provider failures (quota, overload, timeouts, dropped connections).
+RETRYABLE_ERROR_NAMES = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'DeadlineExceeded',
+    'InternalServerError', 'Aborted', 'TimeoutError', 'ConnectionError', 'RemoteDisconnected'
+}
+# Errors that must never be retried whatever their message says; a
+# StreamInterrupted has already sent part of the answer to the client
+NON_RETRYABLE_ERROR_NAMES = {'StreamInterrupted', 'LLMProviderError'}
+RETRYABLE_ERROR_MARKERS = ('timeout', 'timed out', 'temporarily', 'unavailable')
+# HTTP status codes count only where they read as a status: leading the
+# message ("503 Service Unavailable") or after "status"/"code"/"HTTP",
+# so numbers such as "after 500 chunks" are not mistaken for one
+RETRYABLE_STATUS_PATTERN = re.compile(r"(?:^\s*|\b(?:status|code|http)\b[\s:=/'\"]*)(?:429|500|502|503|504)\b")
+
+
+def is_retryable(error: Exception) -> bool:
+    name = type(error).__name__
+    if name in NON_RETRYABLE_ERROR_NAMES:
+        return False
+    if name in RETRYABLE_ERROR_NAMES:
+        return True
+    message = str(error).lower()
+    if RETRYABLE_STATUS_PATTERN.search(message):
+        return True
+    return any(marker in message for marker in RETRYABLE_ERROR_MARKERS)
+
+
+class TokenBucket:
+    """Token bucket limiting call starts to `rate` per second with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for a token."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_for = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait_for > deadline:
+                return False
+            time.sleep(wait_for)
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets one probe through after a cool-down."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def check(self) -> Optional[float]:
+        """Like allow(), but without taking the half-open probe."""
+        with self.lock:
+            if self.opened_at is None:
+                return None
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                return remaining
+            return 1.0 if self.probing else None
+
+    def allow(self) -> Optional[float]:
+        """
+        None if a call may proceed, otherwise seconds until the next probe.
+        In half-open state the caller that gets None is the probe and must
+        report its outcome with record_success() or record_failure().
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return None
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                return remaining
+            if self.probing:
+                return 1.0
+            self.probing = True
+            return None
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class LLMGateway:
+    """
+    Single choke point for provider calls.
+
+    invoke() applies, in order: the circuit breaker, a bounded wait queue
+    for one of `llm_max_concurrency` slots (`llm_reserved_chat_slots` of
+    them only for chat calls), the token-bucket rate limit,
+    then the call itself with hedging and jittered exponential-backoff
+    retries on transient errors. Rejections raise LLMGatewayError
+    subclasses carrying a retry_after hint for the HTTP layer. A
+    half-open breaker's probe is only taken once the call holds a slot
+    and a rate token, so a probe is never lost to a queue rejection.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.bucket = TokenBucket(config.llm_rate_limit_per_sec, config.llm_rate_limit_burst)
+        self.breaker = CircuitBreaker(config.llm_circuit_failure_threshold, config.llm_circuit_reset_seconds)
+        self.slots = threading.BoundedSemaphore(config.llm_max_concurrency)
+        # Calls other than chat first take one of these, leaving the reserved slots to chat
+        self.bulk_slots = threading.BoundedSemaphore(
+            max(1, config.llm_max_concurrency - config.llm_reserved_chat_slots))
+        self.max_queue = config.llm_max_queue
+        self.queue_timeout = config.llm_queue_timeout_seconds
+        self.executor = ThreadPoolExecutor(max_workers=config.llm_max_concurrency * 2,
+                                           thread_name_prefix="llm-gateway")
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.metrics = {
+            "queue_depth": 0,
+            "in_flight": 0,
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "rejected_overloaded": 0,
+            "rejected_circuit_open": 0,
+            "rejected_rate_limited": 0,
+            "hedges_launched": 0,
+            "hedges_won": 0,
+            "queue_wait_seconds_total": 0.0
+        }
+
+    def _count(self, name: str, amount=1):
+        with self.lock:
+            self.metrics[name] += amount
+
+    def _hedge_delay(self, kind: str) -> Optional[float]:
+        """p95 latency of recent calls of this kind, floored by the configured minimum."""
+        if not self.config.llm_hedging_enabled:
+            return None
+        with self.lock:
+            samples = sorted(self.latencies.get(kind, ()))
+        if len(samples) < 20:
+            return None
+        p95 = samples[int(len(samples) * 0.95) - 1]
+        return max(p95, self.config.llm_hedge_min_delay_ms / 1000.0)
+
+    def _record_latency(self, kind: str, seconds: float):
+        with self.lock:
+            self.latencies.setdefault(kind, deque(maxlen=200)).append(seconds)
+
+    def _call_hedged(self, fn: Callable[[], Any], kind: str) -> Any:
+        delay = self._hedge_delay(kind)
+        if delay is None:
+            return fn()
+
+        primary = self.executor.submit(fn)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        # Slow tail: race a second copy if quota allows
+        if not self.bucket.try_acquire():
+            return primary.result()
+        self._count("hedges_launched")
+        hedge = self.executor.submit(fn)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedges_won")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def invoke(self, fn: Callable[[], Any], kind: str = "chat", hedge: bool = True) -> Any:
+        """
+        Run a provider call under the gateway's limits.
+
+        Args:
+            fn (Callable): Zero-argument function performing the call
+            kind (str): Call category, used for per-kind hedging latency
+            hedge (bool): Allow a hedged second copy; off for streamed calls,
+                whose output is already on its way to the client
+
+        Returns:
+            Any: Whatever fn returns
+        """
+        retry_in = self.breaker.check()
+        if retry_in is not None:
+            self._count("rejected_circuit_open")
+            raise CircuitOpenError("LLM provider is failing, try again shortly", retry_after=retry_in)
+
+        with self.lock:
+            if self.metrics["queue_depth"] >= self.max_queue:
+                self.metrics["rejected_overloaded"] += 1
+                raise GatewayOverloadedError("Too many LLM requests queued", retry_after=self.queue_timeout / 2)
+            self.metrics["queue_depth"] += 1
+
+        queued_at = time.monotonic()
+        bulk = kind.split(":", 1)[0] != "chat"
+        acquired = False
+        try:
+            if not bulk or self.bulk_slots.acquire(timeout=self.queue_timeout):
+                remaining = max(self.queue_timeout - (time.monotonic() - queued_at), 0)
+                acquired = self.slots.acquire(timeout=remaining)
+                if not acquired and bulk:
+                    self.bulk_slots.release()
+        finally:
+            self._count("queue_depth", -1)
+        waited = time.monotonic() - queued_at
+        self._count("queue_wait_seconds_total", waited)
+        if not acquired:
+            self._count("rejected_overloaded")
+            raise GatewayOverloadedError("Timed out waiting for an LLM slot", retry_after=self.queue_timeout / 2)
+
+        self._count("in_flight")
+        try:
+            attempt = 0
+            while True:
+                remaining = max(self.queue_timeout - (time.monotonic() - queued_at), 0)
+                if not self.bucket.acquire(timeout=remaining):
+                    self._count("rejected_rate_limited")
+                    raise GatewayOverloadedError("LLM rate limit reached", retry_after=1.0 / self.bucket.rate)
+                if attempt == 0:
+                    # Retries already passed allow() after their failure
+                    retry_in = self.breaker.allow()
+                    if retry_in is not None:
+                        self._count("rejected_circuit_open")
+                        raise CircuitOpenError("LLM provider is failing, try again shortly", retry_after=retry_in)
+
+                self._count("calls")
+                started = time.monotonic()
+                try:
+                    result = self._call_hedged(fn, kind) if hedge else fn()
+                except Exception as e:
+                    if not is_retryable(e):
+                        # The provider answered; a bad request is not an outage
+                        self.breaker.record_success()
+                        raise
+                    self.breaker.record_failure()
+                    self._count("failures")
+                    if attempt >= self.config.llm_max_retries or self.breaker.allow() is not None:
+                        raise LLMUnavailableError(f"LLM provider error: {str(e)}",
+                                                  retry_after=self.config.llm_retry_max_delay) from e
+                    # Full jitter keeps retries from synchronising across workers
+                    backoff = min(self.config.llm_retry_max_delay, self.config.llm_retry_base_delay * (2 ** attempt))
+                    time.sleep(random.uniform(0, backoff))
+                    attempt += 1
+                    self._count("retries")
+                    continue
+
+                self._record_latency(kind, time.monotonic() - started)
+                self.breaker.record_success()
+                self._count("successes")
+                return result
+        finally:
+            self._count("in_flight", -1)
+            self.slots.release()
+            if bulk:
+                self.bulk_slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of queue depth, rejections and call outcomes."""
+        with self.lock:
+            stats = dict(self.metrics)
+        stats["circuit_state"] = self.breaker.state
+        stats["max_concurrency"] = self.config.llm_max_concurrency
+        stats["reserved_chat_slots"] = self.config.llm_reserved_chat_slots
+        stats["max_queue"] = self.max_queue
+        return stats
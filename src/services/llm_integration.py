@@ -1,23 +1,35 @@
 import os
-from typing import List, Dict, Any
+import time
+import threading
+from typing import List, Dict, Any, Optional, Callable
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import HumanMessage, SystemMessage
 from .config import Config
-from .chat_storage import ChatStorage
+from .chat_storage import create_chat_storage
+from .llm_gateway import LLMGateway, LLMGatewayError, LLMProviderError
+from .model_router import ModelRouter, RouteDecision, DEFAULT_TEMPERATURE, DEFAULT_MAX_OUTPUT_TOKENS
 import uuid
 
+
+class StreamInterrupted(Exception):
+    """A streamed response stopped after part of it reached the client; never retried."""
+
+    def __init__(self, message: str, partial: str = ""):
+        super().__init__(message)
+        self.partial = partial
+
+
 class LLMIntegration:
     def __init__(self, config: Config):
         self.config = config
-        self.llm = ChatGoogleGenerativeAI(
-            model="models/gemini-2.0-flash-exp",
-            google_api_key=config.google_api_key,
-            temperature=0.7,
-            max_output_tokens=2048,
-            convert_system_message_to_human=True
-        )
-        self.chat_storage = ChatStorage()
+        # Standard tier with the pre-routing settings; routed calls may use other clients
+        self.llm = self._create_client(config.llm_model_standard, DEFAULT_TEMPERATURE, DEFAULT_MAX_OUTPUT_TOKENS)
+        self.chat_storage = create_chat_storage(config)
+        self.gateway = LLMGateway(config)
+        self.router = ModelRouter(config)
+        self._clients = {}
+        self._clients_lock = threading.Lock()
         
         # Define system prompts for different tasks
         self.system_prompts = {
@@ -137,19 +149,119 @@ Based on the user's context, create a plan to execute steps from [P1] to [P#].
 - Add blank lines between sections for readability."""
         }
     
+    def _create_client(self, model: str, temperature: float, max_output_tokens: int):
+        return ChatGoogleGenerativeAI(
+            model=model,
+            google_api_key=self.config.google_api_key,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            convert_system_message_to_human=True
+        )
+
+    def _client(self, decision: RouteDecision):
+        """Chat model for a route, created once per (model, temperature, output cap)."""
+        if decision.client_key == (self.config.llm_model_standard, DEFAULT_TEMPERATURE, DEFAULT_MAX_OUTPUT_TOKENS):
+            return self.llm
+        with self._clients_lock:
+            client = self._clients.get(decision.client_key)
+            if client is None:
+                client = self._create_client(decision.model, decision.temperature, decision.max_output_tokens)
+                self._clients[decision.client_key] = client
+            return client
+
+    @staticmethod
+    def _usage(response) -> Dict[str, Any]:
+        """Provider-reported token counts, when the response carries them."""
+        usage = getattr(response, 'usage_metadata', None) or \
+            (getattr(response, 'response_metadata', None) or {}).get('usage_metadata') or {}
+        return {
+            "input_tokens": usage.get("input_tokens") or usage.get("prompt_token_count"),
+            "output_tokens": usage.get("output_tokens") or usage.get("candidates_token_count")
+        }
+
+    def _invoke(self, messages: list, kind: str, weeks: Optional[int] = None):
+        """Route a call, run it through the gateway and record latency and token usage."""
+        decision = self.router.route(kind, "\n".join(str(message.content) for message in messages), weeks)
+        client = self._client(decision)
+        started = time.monotonic()
+        # Per-tier kinds keep the gateway's hedging latencies for fast and standard models apart
+        try:
+            response = self.gateway.invoke(lambda: client.invoke(messages), kind=f"{kind}:{decision.tier}")
+        except LLMGatewayError:
+            raise
+        except Exception as e:
+            raise LLMProviderError(f"LLM provider error: {str(e)}") from e
+        self.router.record(decision, time.monotonic() - started, response.content, self._usage(response))
+        return response
+
+    def _stream(self, messages: list, kind: str, on_token: Callable[[str], None],
+                cancelled: Optional[threading.Event] = None) -> str:
+        """Like _invoke, but pass each text chunk to on_token as the provider produces it."""
+        decision = self.router.route(kind, "\n".join(str(message.content) for message in messages))
+        client = self._client(decision)
+        parts = []
+
+        def call():
+            try:
+                for chunk in client.stream(messages):
+                    if cancelled is not None and cancelled.is_set():
+                        raise StreamInterrupted("Stream cancelled by the client", "".join(parts))
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        on_token(chunk.content)
+            except StreamInterrupted:
+                raise
+            except Exception as e:
+                # Tokens already sent cannot be taken back, so only a stream
+                # that failed before its first token may be retried
+                if parts:
+                    raise StreamInterrupted(f"Stream failed after {len(parts)} chunks", "".join(parts)) from e
+                raise
+            return "".join(parts)
+
+        started = time.monotonic()
+        # Never hedged: two copies would interleave their tokens
+        try:
+            text = self.gateway.invoke(call, kind=f"{kind}:{decision.tier}", hedge=False)
+        except (LLMGatewayError, StreamInterrupted):
+            raise
+        except Exception as e:
+            raise LLMProviderError(f"LLM provider error: {str(e)}") from e
+        self.router.record(decision, time.monotonic() - started, text)
+        return text
+
     def generate_response(self, 
                          query: str, 
                          context: List[str] = None, 
                          task_type: str = "chat",
-                         session_id: str = None) -> Dict[str, Any]:
+                         session_id: str = None,
+                         instructions: str = None,
+                         context_refs: List[str] = None,
+                         history: List[Dict[str, Any]] = None,
+                         task: str = None,
+                         weeks: int = None,
+                         stored_query: str = None) -> Dict[str, Any]:
         """
         Generate a response using the LLM.
         
+        Only the raw user turn (plus the refs of the chunks it was answered
+        with) is stored and replayed; retrieval context and instructions are
+        sent for this turn only, so history grows with the real conversation.
+        
         Args:
-            query (str): The user's query
+            query (str): The user's message as they typed it, or the full prompt
+                of a generated request
             context (List[str], optional): Relevant context for the response
             task_type (str): Type of task (chat, plan, or roadmap)
             session_id (str, optional): Chat session ID for maintaining conversation history
+            instructions (str, optional): Extra per-request instructions appended to the system prompt
+            context_refs (List[str], optional): chunk_refs of the knowledge base chunks behind the context
+            history (List[Dict[str, Any]], optional): Client-held history, used only when
+                the session has no stored history
+            task (str, optional): Routing task (chat, plan, roadmap), defaults to task_type
+            weeks (int, optional): Weeks a plan response covers, for output budgeting
+            stored_query (str, optional): What the user asked for, stored as the user
+                turn when query is a prompt built from it (e.g. a plan request's goal)
             
         Returns:
             Dict[str, Any]: Generated response with session info
@@ -161,37 +273,18 @@ Based on the user's context, create a plan to execute steps from [P1] to [P#].
                 self.chat_storage.create_session(session_id)
             
             # Store user message
-            self.chat_storage.add_message(session_id, "user", query)
+            self.chat_storage.add_message(session_id, "user", stored_query or query, context_refs=context_refs)
             
             # Get chat history
             chat_history = self.chat_storage.get_session_messages(session_id)
+            previous_turns = chat_history[:-1]  # Exclude the current message
+            if not previous_turns and history:
+                previous_turns = history
             
-            # Get appropriate system prompt
-            system_prompt = self.system_prompts.get(task_type, self.system_prompts["chat"])
-            
-            # Prepare messages
-            messages = [
-                SystemMessage(content=system_prompt)
-            ]
-            
-            # Add context if provided
-            if context:
-                context_str = "\n".join(context)
-                messages.append(HumanMessage(content=f"Use this information to inform your response, but don't reference it directly:\n{context_str}"))
-            
-            # Add conversation history
-            if chat_history:
-                conversation_history = "\n".join([
-                    f"{msg['role']}: {msg['content']}"
-                    for msg in chat_history[:-1]  # Exclude the current message
-                ])
-                messages.append(HumanMessage(content=f"Previous conversation:\n{conversation_history}"))
-            
-            # Add current query
-            messages.append(HumanMessage(content=query))
+            messages = self._build_messages(query, context, task_type, instructions, previous_turns)
             
             # Generate response
-            response = self.llm.invoke(messages)
+            response = self._invoke(messages, task or task_type, weeks)
             
             # Store assistant response
             self.chat_storage.add_message(session_id, "assistant", response.content)
@@ -203,13 +296,103 @@ Based on the user's context, create a plan to execute steps from [P1] to [P#].
             }
             
         except Exception as e:
+            # Overload, outages and provider errors propagate as typed
+            # errors, never as response text a caller could parse as a reply
             if self.config.debug_mode:
                 print(f"Error generating response: {str(e)}")
-            return {
-                "response": f"Error: {str(e)}",
-                "session_id": session_id,
-                "history": []
-            }
+            raise
+
+    def stream_response(self,
+                        query: str,
+                        on_token: Callable[[str], None],
+                        session_id: str,
+                        context: List[str] = None,
+                        instructions: str = None,
+                        context_refs: List[str] = None,
+                        cancelled: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """
+        Generate a chat turn like generate_response, streaming the reply.
+        
+        History comes only from chat storage, so the caller sends just the
+        new message. The full reply is stored once the stream ends; a
+        stream cut short by the client stores what was sent.
+        
+        Args:
+            query (str): The user's message as they typed it
+            on_token (Callable): Called from this thread with each text chunk
+            session_id (str): Chat session ID; the session is created if missing
+            context (List[str], optional): Relevant context for the response
+            instructions (str, optional): Extra per-request instructions appended to the system prompt
+            context_refs (List[str], optional): chunk_refs of the knowledge base chunks behind the context
+            cancelled (threading.Event, optional): Set to stop generating, e.g. on disconnect
+            
+        Returns:
+            Dict[str, Any]: The full response text and session ID
+        """
+        if self.chat_storage.get_session(session_id) is None:
+            self.chat_storage.create_session(session_id)
+        self.chat_storage.add_message(session_id, "user", query, context_refs=context_refs)
+        previous_turns = self.chat_storage.get_session_messages(session_id)[:-1]
+        messages = self._build_messages(query, context, "chat", instructions, previous_turns)
+        try:
+            text = self._stream(messages, "chat", on_token, cancelled)
+        except StreamInterrupted as e:
+            if e.partial:
+                self.chat_storage.add_message(session_id, "assistant", e.partial)
+            raise
+        self.chat_storage.add_message(session_id, "assistant", text)
+        return {"response": text, "session_id": session_id}
+    
+    def _build_messages(self,
+                        query: str,
+                        context: List[str] = None,
+                        task_type: str = "chat",
+                        instructions: str = None,
+                        previous_turns: List[Dict[str, Any]] = None) -> list:
+        """Assemble system prompt, context, history and the current query."""
+        # Get appropriate system prompt
+        system_prompt = self.system_prompts.get(task_type, self.system_prompts["chat"])
+        if instructions:
+            system_prompt = f"{system_prompt}\n\n{instructions}"
+        
+        # Prepare messages
+        messages = [
+            SystemMessage(content=system_prompt)
+        ]
+        
+        # Add context if provided
+        if context:
+            context_str = "\n".join(context)
+            messages.append(HumanMessage(content=f"Use this information to inform your response, but don't reference it directly:\n{context_str}"))
+        
+        # Add conversation history
+        if previous_turns:
+            conversation_history = "\n".join([
+                f"{msg['role']}: {msg['content']}"
+                for msg in previous_turns
+            ])
+            messages.append(HumanMessage(content=f"Previous conversation:\n{conversation_history}"))
+        
+        # Add current query
+        messages.append(HumanMessage(content=query))
+        return messages
+    
+    def complete(self, query: str, context: List[str] = None, kind: str = "chat", weeks: int = None) -> str:
+        """
+        One-off generation without a chat session, for internal sub-requests
+        such as the per-week calls of a fanned-out plan.
+        
+        Args:
+            query (str): The full prompt
+            context (List[str], optional): Relevant context for the response
+            kind (str): Call kind, used for routing and gateway metrics
+            weeks (int, optional): Weeks the response covers, for output budgeting
+            
+        Returns:
+            str: The generated text
+        """
+        messages = self._build_messages(query, context)
+        return self._invoke(messages, kind, weeks).content
     
     def generate_plan(self, user_profile: Dict[str, Any], session_id: str = None) -> Dict[str, Any]:
         """
@@ -226,7 +409,9 @@ Based on the user's context, create a plan to execute steps from [P1] to [P#].
         profile_str = "\n".join([f"{k}: {v}" for k, v in user_profile.items()])
         query = f"Create a detailed productivity plan for the following user profile:\n{profile_str}"
         
-        return self.generate_response(query, task_type="plan", session_id=session_id)
+        goal = user_profile.get('goal') or user_profile.get('primaryGoal') or ''
+        return self.generate_response(query, task_type="plan", session_id=session_id,
+                                      stored_query=f"Create a plan\nGoal: {goal}")
     
     def generate_roadmap(self, goal: str, timeframe: str, session_id: str = None) -> Dict[str, Any]:
         """
@@ -242,7 +427,8 @@ Based on the user's context, create a plan to execute steps from [P1] to [P#].
         """
         query = f"Create a detailed roadmap for achieving the following goal within {timeframe}:\n{goal}"
         
-        return self.generate_response(query, task_type="roadmap", session_id=session_id)
+        return self.generate_response(query, task_type="roadmap", session_id=session_id,
+                                      stored_query=f"Create a roadmap\nGoal: {goal}")
     
     def get_chat_history(self, session_id: str) -> List[Dict[str, Any]]:
         """Get chat history for a session."""
@@ -254,4 +440,8 @@ Based on the user's context, create a plan to execute steps from [P1] to [P#].
     
     def delete_chat_session(self, session_id: str) -> bool:
         """Delete a chat session."""
-        return self.chat_storage.delete_session(session_id) 
\ No newline at end of file
+        return self.chat_storage.delete_session(session_id)
+    
+    def close(self):
+        """Flush pending chat writes before shutdown."""
+        self.chat_storage.close()
@@ -0,0 +1,141 @@
+import math
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+# Settings every call used before routing; still used when routing is disabled
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_MAX_OUTPUT_TOKENS = 2048
+# Outline milestones are one line each, far shorter than a full week of tasks
+OUTLINE_TOKENS_PER_WEEK = 40
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English prose)."""
+    return math.ceil(len(text) / 4)
+
+
+class RouteDecision:
+    """Model tier and generation settings chosen for one LLM call."""
+
+    def __init__(self, task: str, tier: str, model: str, max_output_tokens: int, temperature: float,
+                 input_tokens: int, weeks: Optional[int] = None):
+        self.task = task
+        self.tier = tier
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+        self.temperature = temperature
+        self.input_tokens = input_tokens
+        self.weeks = weeks
+
+    @property
+    def client_key(self) -> tuple:
+        return (self.model, self.temperature, self.max_output_tokens)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "task": self.task,
+            "tier": self.tier,
+            "model": self.model,
+            "max_output_tokens": self.max_output_tokens,
+            "temperature": self.temperature,
+            "input_tokens": self.input_tokens,
+            "weeks": self.weeks
+        }
+
+
+class ModelRouter:
+    """
+    Routing policy for LLM calls.
+
+    Each call is routed by task (chat, plan, roadmap; sub-kinds such as
+    plan_week map to their task), estimated input size and, for plans,
+    the number of weeks to write. Small turns of tasks listed in
+    LLM_FAST_TASKS go to the fast tier; everything else to the standard
+    tier. The output cap is sized to the task: plans get a base budget
+    plus a per-week allowance, up to LLM_MAX_OUTPUT_TOKENS. With
+    LLM_ROUTING_ENABLED=false every call uses the standard tier with the
+    settings from before routing existed.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.enabled = config.llm_routing_enabled
+        self.models = {"fast": config.llm_model_fast, "standard": config.llm_model_standard}
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    @staticmethod
+    def task_for(kind: str) -> str:
+        """Task a call kind belongs to: plan_week and plan_outline are plan calls."""
+        return kind.split("_", 1)[0]
+
+    def _output_cap(self, kind: str, task: str, weeks: Optional[int]) -> int:
+        config = self.config
+        if task == "plan":
+            weeks = weeks or 4
+            per_week = OUTLINE_TOKENS_PER_WEEK if kind == "plan_outline" else config.llm_plan_output_tokens_per_week
+            cap = config.llm_plan_output_tokens_base + per_week * weeks
+        elif task == "roadmap":
+            cap = config.llm_max_output_tokens_roadmap
+        else:
+            cap = config.llm_max_output_tokens_chat
+        # Round up so plan lengths share a handful of cached clients
+        cap = int(math.ceil(cap / 256.0) * 256)
+        return min(cap, config.llm_max_output_tokens)
+
+    def route(self, kind: str, input_text: str, weeks: Optional[int] = None) -> RouteDecision:
+        """
+        Choose the model tier, output cap and temperature for a call.
+
+        Args:
+            kind (str): Call kind, e.g. chat, plan, plan_week, roadmap
+            input_text (str): Everything sent to the model, for the size estimate
+            weeks (int, optional): Weeks the response has to cover, for plan calls
+
+        Returns:
+            RouteDecision: The settings to call the model with
+        """
+        task = self.task_for(kind)
+        input_tokens = estimate_tokens(input_text)
+        if not self.enabled:
+            return RouteDecision(task, "standard", self.models["standard"], DEFAULT_MAX_OUTPUT_TOKENS,
+                                 DEFAULT_TEMPERATURE, input_tokens, weeks)
+
+        small = (input_tokens <= self.config.llm_fast_max_input_tokens
+                 and (weeks is None or weeks <= self.config.llm_fast_max_plan_weeks))
+        tier = "fast" if task in self.config.llm_fast_tasks and small else "standard"
+        temperature = {
+            "plan": self.config.llm_temperature_plan,
+            "roadmap": self.config.llm_temperature_roadmap
+        }.get(task, self.config.llm_temperature_chat)
+        return RouteDecision(task, tier, self.models[tier], self._output_cap(kind, task, weeks),
+                             temperature, input_tokens, weeks)
+
+    def record(self, decision: RouteDecision, latency: float, output_text: str, usage: Optional[Dict[str, Any]] = None):
+        """Log a routed call and add it to the per task/tier totals."""
+        usage = usage or {}
+        input_tokens = usage.get("input_tokens") or decision.input_tokens
+        output_tokens = usage.get("output_tokens") or estimate_tokens(output_text or "")
+        logging.info(
+            f"LLM route task={decision.task} tier={decision.tier} model={decision.model} "
+            f"max_output_tokens={decision.max_output_tokens} temperature={decision.temperature} "
+            f"weeks={decision.weeks} latency={latency:.3f}s input_tokens={input_tokens} output_tokens={output_tokens}"
+        )
+        if self.config.debug_mode:
+            print(f"LLM route {decision.task}/{decision.tier}: {latency:.2f}s, {input_tokens} in, {output_tokens} out")
+        with self.lock:
+            entry = self.metrics.setdefault(f"{decision.task}:{decision.tier}", {
+                "calls": 0, "latency_seconds_total": 0.0, "input_tokens": 0, "output_tokens": 0
+            })
+            entry["calls"] += 1
+            entry["latency_seconds_total"] += latency
+            entry["input_tokens"] += input_tokens
+            entry["output_tokens"] += output_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        """Per task:tier call counts, mean latency and token totals."""
+        with self.lock:
+            routes = {key: dict(entry) for key, entry in self.metrics.items()}
+        for entry in routes.values():
+            entry["latency_seconds_mean"] = round(entry["latency_seconds_total"] / entry["calls"], 3)
+        return {"enabled": self.enabled, "models": self.models, "routes": routes}
@@ -0,0 +1,414 @@
+import json
+import asyncio
+import heapq
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterator
+from .chat_storage import BaseChatStorage, shard_for_session, utc_timestamp_of
+
+class PostgresChatStorage(BaseChatStorage):
+    """
+    Chat storage on one or more PostgreSQL-compatible servers.
+
+    Every DSN in CHAT_DATABASE_URLS is a shard with its own asyncpg pool;
+    sessions are routed by a stable hash of session_id so every API node
+    agrees on where a conversation lives. The pools run on a private event
+    loop thread, which keeps the synchronous interface usable from the
+    request handlers.
+    """
+
+    def __init__(self, config, dsns: Optional[List[str]] = None):
+        try:
+            import asyncpg
+        except ImportError:
+            raise ImportError("The postgres chat storage backend requires the 'asyncpg' package")
+        self._asyncpg = asyncpg
+
+        self.dsns = dsns or getattr(config, 'chat_database_urls', [])
+        if not self.dsns:
+            raise ValueError("CHAT_DATABASE_URLS must list at least one database for the postgres backend")
+        self.pool_min = getattr(config, 'chat_db_pool_min', 1)
+        self.pool_max = getattr(config, 'chat_db_pool_max', 10)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="chat-storage-pg", daemon=True)
+        self._thread.start()
+        self._pools = self._run(self._open_pools())
+
+    def _run(self, coro):
+        """Run a coroutine on the storage loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _open_pools(self):
+        pools = []
+        for dsn in self.dsns:
+            pool = await self._asyncpg.create_pool(dsn, min_size=self.pool_min, max_size=self.pool_max)
+            async with pool.acquire() as conn:
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS chat_sessions (
+                        session_id TEXT PRIMARY KEY,
+                        created_at TIMESTAMPTZ DEFAULT now(),
+                        last_updated TIMESTAMPTZ DEFAULT now(),
+                        metadata TEXT
+                    )
+                ''')
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS chat_messages (
+                        message_id BIGSERIAL PRIMARY KEY,
+                        session_id TEXT REFERENCES chat_sessions(session_id) ON DELETE CASCADE,
+                        role TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        timestamp TIMESTAMPTZ DEFAULT now()
+                    )
+                ''')
+                await conn.execute(
+                    'ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS context_refs TEXT'
+                )
+                await conn.execute(
+                    'ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0'
+                )
+                await conn.execute(
+                    'CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages (session_id, message_id)'
+                )
+                await conn.execute(
+                    'CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON chat_sessions (last_updated DESC)'
+                )
+                # Keyset order of iter_messages
+                await conn.execute(
+                    'CREATE INDEX IF NOT EXISTS idx_chat_messages_time ON chat_messages (timestamp, message_id)'
+                )
+            pools.append(pool)
+        return pools
+
+    def _pool(self, session_id: str):
+        return self._pools[shard_for_session(session_id, len(self._pools))]
+
+    @staticmethod
+    def _session_row(row) -> Dict[str, Any]:
+        return {
+            'session_id': row['session_id'],
+            'created_at': utc_timestamp_of(row['created_at']) if row['created_at'] else None,
+            'last_updated': utc_timestamp_of(row['last_updated']) if row['last_updated'] else None,
+            'metadata': json.loads(row['metadata']) if row['metadata'] else None
+        }
+
+    async def _create_session(self, session_id, metadata):
+        async with self._pool(session_id).acquire() as conn:
+            await conn.execute(
+                'INSERT INTO chat_sessions (session_id, metadata) VALUES ($1, $2)',
+                session_id, json.dumps(metadata) if metadata else None
+            )
+
+    async def _add_message(self, session_id, role, content, context_refs):
+        async with self._pool(session_id).acquire() as conn:
+            async with conn.transaction():
+                # Sessions created implicitly keep the foreign key satisfied
+                await conn.execute(
+                    '''
+                    INSERT INTO chat_sessions (session_id, version) VALUES ($1, 1)
+                    ON CONFLICT (session_id) DO UPDATE
+                    SET last_updated = now(), version = chat_sessions.version + 1
+                    ''',
+                    session_id
+                )
+                return await conn.fetchval(
+                    'INSERT INTO chat_messages (session_id, role, content, context_refs) VALUES ($1, $2, $3, $4)'
+                    ' RETURNING timestamp',
+                    session_id, role, content, json.dumps(context_refs) if context_refs else None
+                )
+
+    async def _get_session_messages(self, session_id):
+        async with self._pool(session_id).acquire() as conn:
+            rows = await conn.fetch(
+                'SELECT role, content, timestamp, context_refs FROM chat_messages WHERE session_id = $1 ORDER BY message_id',
+                session_id
+            )
+        return [
+            {
+                'role': row['role'],
+                'content': row['content'],
+                'timestamp': utc_timestamp_of(row['timestamp']),
+                'context_refs': json.loads(row['context_refs']) if row['context_refs'] else None
+            }
+            for row in rows
+        ]
+
+    async def _get_session_version(self, session_id):
+        async with self._pool(session_id).acquire() as conn:
+            return await conn.fetchval('SELECT version FROM chat_sessions WHERE session_id = $1', session_id)
+
+    async def _get_session(self, session_id):
+        async with self._pool(session_id).acquire() as conn:
+            row = await conn.fetchrow(
+                'SELECT session_id, created_at, last_updated, metadata FROM chat_sessions WHERE session_id = $1',
+                session_id
+            )
+        return self._session_row(row) if row else None
+
+    async def _list_shard(self, pool, count):
+        async with pool.acquire() as conn:
+            return await conn.fetch(
+                '''
+                SELECT session_id, created_at, last_updated, metadata
+                FROM chat_sessions
+                ORDER BY last_updated DESC
+                LIMIT $1
+                ''',
+                count
+            )
+
+    async def _list_sessions(self, limit, offset):
+        # Each shard returns its newest limit + offset sessions; the global
+        # page is cut from the merged stream.
+        shard_rows = await asyncio.gather(*[
+            self._list_shard(pool, limit + offset) for pool in self._pools
+        ])
+        merged = heapq.merge(*shard_rows, key=lambda row: row['last_updated'], reverse=True)
+        return [self._session_row(row) for row in list(merged)[offset:offset + limit]]
+
+    async def _delete_session(self, session_id, expected_version=None):
+        async with self._pool(session_id).acquire() as conn:
+            async with conn.transaction():
+                if expected_version is not None:
+                    # The row lock makes concurrent add_message calls wait for the delete
+                    version = await conn.fetchval(
+                        'SELECT version FROM chat_sessions WHERE session_id = $1 FOR UPDATE', session_id
+                    )
+                    if version != expected_version:
+                        return False
+                await conn.execute('DELETE FROM chat_messages WHERE session_id = $1', session_id)
+                await conn.execute('DELETE FROM chat_sessions WHERE session_id = $1', session_id)
+                return True
+
+    async def _find_expired_sessions(self, now, default_ttl_seconds, limit):
+        rows = []
+        for pool in self._pools:
+            async with pool.acquire() as conn:
+                rows.extend(await conn.fetch(
+                    '''
+                    SELECT session_id FROM chat_sessions
+                    WHERE COALESCE((metadata::jsonb ->> 'ttl_seconds')::int, $2) > 0
+                      AND last_updated + make_interval(secs => COALESCE((metadata::jsonb ->> 'ttl_seconds')::int, $2)) < $1
+                    LIMIT $3
+                    ''',
+                    now, default_ttl_seconds, limit
+                ))
+        return [row['session_id'] for row in rows][:limit]
+
+    async def _find_sessions(self, updated_before, min_messages, limit):
+        sessions = []
+        for pool in self._pools:
+            async with pool.acquire() as conn:
+                rows = await conn.fetch(
+                    '''
+                    SELECT s.session_id, s.created_at, s.last_updated, s.metadata, COUNT(m.message_id) AS message_count
+                    FROM chat_sessions s
+                    LEFT JOIN chat_messages m ON m.session_id = s.session_id
+                    WHERE ($1::timestamptz IS NULL OR s.last_updated < $1)
+                    GROUP BY s.session_id
+                    HAVING COUNT(m.message_id) >= $2
+                    ORDER BY s.last_updated
+                    LIMIT $3
+                    ''',
+                    updated_before, min_messages, limit
+                )
+            sessions.extend(dict(self._session_row(row), message_count=row['message_count']) for row in rows)
+        sessions.sort(key=lambda s: s['last_updated'])
+        return sessions[:limit]
+
+    async def _message_batch(self, pool, since, until, cursor_key, batch_size):
+        conditions, args = [], []
+        for condition, value in (('timestamp >= ${}', since), ('timestamp < ${}', until)):
+            if value is not None:
+                args.append(value)
+                conditions.append(condition.format(len(args)))
+        if cursor_key is not None:
+            args.extend(cursor_key)
+            conditions.append(f'(timestamp, message_id) > (${len(args) - 1}, ${len(args)})')
+        args.append(batch_size)
+        async with pool.acquire() as conn:
+            return await conn.fetch(
+                'SELECT message_id, session_id, role, content, timestamp, context_refs FROM chat_messages'
+                + (' WHERE ' + ' AND '.join(conditions) if conditions else '')
+                + f' ORDER BY timestamp, message_id LIMIT ${len(args)}',
+                *args
+            )
+
+    async def _session_batch(self, pool, since, until, last_id, batch_size):
+        conditions, args = [], []
+        for condition, value in (('last_updated >= ${}', since), ('last_updated < ${}', until), ('session_id > ${}', last_id)):
+            if value is not None:
+                args.append(value)
+                conditions.append(condition.format(len(args)))
+        args.append(batch_size)
+        async with pool.acquire() as conn:
+            return await conn.fetch(
+                'SELECT session_id, created_at, last_updated, metadata FROM chat_sessions'
+                + (' WHERE ' + ' AND '.join(conditions) if conditions else '')
+                + f' ORDER BY session_id LIMIT ${len(args)}',
+                *args
+            )
+
+    async def _compact_session(self, session_id, summary, keep_last, expected_version=None):
+        async with self._pool(session_id).acquire() as conn:
+            async with conn.transaction():
+                if expected_version is not None:
+                    version = await conn.fetchval(
+                        'SELECT version FROM chat_sessions WHERE session_id = $1 FOR UPDATE', session_id
+                    )
+                    if version != expected_version:
+                        return 0
+                rows = await conn.fetch(
+                    'SELECT message_id FROM chat_messages WHERE session_id = $1 ORDER BY message_id',
+                    session_id
+                )
+                message_ids = [row['message_id'] for row in rows]
+                old_ids = message_ids[:-keep_last] if keep_last else message_ids
+                if len(old_ids) < 2:
+                    return 0
+                await conn.execute(
+                    "UPDATE chat_messages SET role = 'summary', content = $1, context_refs = NULL WHERE message_id = $2",
+                    summary, old_ids[-1]
+                )
+                await conn.execute(
+                    'DELETE FROM chat_messages WHERE message_id = ANY($1::bigint[])',
+                    old_ids[:-1]
+                )
+                await conn.execute('UPDATE chat_sessions SET version = version + 1 WHERE session_id = $1', session_id)
+                return len(old_ids) - 1
+
+    def find_expired_sessions(self, now: datetime, default_ttl_seconds: int, limit: int = 100) -> List[str]:
+        """Sessions whose TTL has elapsed, across all shards."""
+        try:
+            return self._run(self._find_expired_sessions(now, default_ttl_seconds, limit))
+        except Exception as e:
+            print(f"Error finding expired sessions: {str(e)}")
+            return []
+
+    def find_sessions(self, updated_before: Optional[datetime] = None, min_messages: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Sessions matching the retention filters, across all shards."""
+        try:
+            return self._run(self._find_sessions(updated_before, min_messages, limit))
+        except Exception as e:
+            print(f"Error finding sessions: {str(e)}")
+            return []
+
+    def compact_session(self, session_id: str, summary: str, keep_last: int,
+                        expected_version: Optional[int] = None) -> int:
+        """Replace all but the newest keep_last messages with a summary message."""
+        try:
+            return self._run(self._compact_session(session_id, summary, keep_last, expected_version))
+        except Exception as e:
+            print(f"Error compacting session: {str(e)}")
+            return 0
+
+    def iter_messages(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Messages in [since, until), shard by shard, each in (timestamp, message_id) order."""
+        for pool in self._pools:
+            cursor_key = None
+            while True:
+                rows = self._run(self._message_batch(pool, since, until, cursor_key, batch_size))
+                if not rows:
+                    break
+                yield [
+                    {
+                        'message_id': row['message_id'],
+                        'session_id': row['session_id'],
+                        'role': row['role'],
+                        'content': row['content'],
+                        'timestamp': utc_timestamp_of(row['timestamp']),
+                        'context_refs': json.loads(row['context_refs']) if row['context_refs'] else None
+                    }
+                    for row in rows
+                ]
+                if len(rows) < batch_size:
+                    break
+                cursor_key = (rows[-1]['timestamp'], rows[-1]['message_id'])
+
+    def iter_sessions(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Sessions last updated in [since, until), shard by shard, each in session_id order."""
+        for pool in self._pools:
+            last_id = None
+            while True:
+                rows = self._run(self._session_batch(pool, since, until, last_id, batch_size))
+                if not rows:
+                    break
+                yield [self._session_row(row) for row in rows]
+                if len(rows) < batch_size:
+                    break
+                last_id = rows[-1]['session_id']
+
+    def create_session(self, session_id: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """Create a new chat session."""
+        try:
+            self._run(self._create_session(session_id, metadata))
+            return True
+        except Exception as e:
+            print(f"Error creating session: {str(e)}")
+            return False
+
+    def add_message(self, session_id: str, role: str, content: str,
+                    context_refs: Optional[List[str]] = None) -> Optional[str]:
+        """Add a message to a chat session."""
+        try:
+            return utc_timestamp_of(self._run(self._add_message(session_id, role, content, context_refs)))
+        except Exception as e:
+            print(f"Error adding message: {str(e)}")
+            return None
+
+    def get_session_messages(self, session_id: str) -> List[Dict[str, Any]]:
+        """Get all messages for a session."""
+        try:
+            return self._run(self._get_session_messages(session_id))
+        except Exception as e:
+            print(f"Error getting messages: {str(e)}")
+            return []
+
+    def get_session_version(self, session_id: str) -> Optional[int]:
+        """Change counter of a session."""
+        try:
+            return self._run(self._get_session_version(session_id))
+        except Exception as e:
+            print(f"Error getting session version: {str(e)}")
+            return None
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Get session details."""
+        try:
+            return self._run(self._get_session(session_id))
+        except Exception as e:
+            print(f"Error getting session: {str(e)}")
+            return None
+
+    def list_sessions(self, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+        """List recent chat sessions across all shards."""
+        try:
+            return self._run(self._list_sessions(limit, offset))
+        except Exception as e:
+            print(f"Error listing sessions: {str(e)}")
+            return []
+
+    def delete_session(self, session_id: str, expected_version: Optional[int] = None) -> bool:
+        """Delete a chat session and all its messages, if still at expected_version when given."""
+        try:
+            return self._run(self._delete_session(session_id, expected_version))
+        except Exception as e:
+            print(f"Error deleting session: {str(e)}")
+            return False
+
+    def close(self):
+        """Close every shard pool and stop the event loop thread."""
+        if not self._thread:
+            return
+        async def _close_all():
+            await asyncio.gather(*[pool.close() for pool in self._pools])
+
+        try:
+            self._run(_close_all())
+        except Exception as e:
+            print(f"Error closing chat storage pools: {str(e)}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
@@ -0,0 +1,175 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any
+from .llm_integration import LLMIntegration
+from .scheduler import parse_week
+
+def parse_plan_response(response_content: str) -> dict:
+    """Strip optional markdown fences and parse the LLM's JSON plan"""
+    cleaned = response_content.strip()
+    if cleaned.startswith('```json'):
+        cleaned = cleaned.replace('```json', '').replace('```', '').strip()
+    elif cleaned.startswith('```'):
+        cleaned = cleaned.replace('```', '').replace('```', '').strip()
+    return json.loads(cleaned)
+
+
+def profile_summary(profile) -> str:
+    """One line per profile field the weekly prompts need."""
+    return (
+        f"- Goal: {profile.goal}\n"
+        f"- Learning Duration (weeks): {profile.learning_duration}\n"
+        f"- Available time: {profile.focus_periods} focus blocks per day\n"
+        f"- Work Style: {profile.work_style}\n"
+        f"- Habits: {profile.habits}\n"
+        f"- Rest Days: {profile.rest_days}\n"
+    )
+
+
+class PlanGenerator:
+    """
+    Fan-out generation for long plans.
+
+    One call produces a compact outline (header note plus a one-line
+    milestone per week); the weeks are then expanded into tasks in blocks
+    of `plan_fanout_weeks_per_call`, with up to `plan_fanout_concurrency`
+    blocks in flight. The result has the same shape as a single-shot plan,
+    so latency tracks the slowest block rather than the whole plan.
+    """
+
+    def __init__(self, llm: LLMIntegration, config):
+        self.llm = llm
+        self.config = config
+        self.weeks_per_call = config.plan_fanout_weeks_per_call
+        self.executor = ThreadPoolExecutor(max_workers=config.plan_fanout_concurrency,
+                                           thread_name_prefix="plan-fanout")
+
+    def should_fan_out(self, profile) -> bool:
+        return profile.learning_duration >= self.config.plan_fanout_min_weeks
+
+    def _outline_prompt(self, profile) -> str:
+        weeks = profile.learning_duration
+        return (
+            f"Outline a {weeks}-week plan for the following goal as a JSON object with the following structure:\n"
+            f'{{"header_note": string, "goal": string, "milestones": [string, ...]}}\n'
+            f"- header_note: A motivating summary, overall strategy, tips, tricks, mindset advice, and any high-level information from the productivity literature provided.\n"
+            f"- goal: The main goal.\n"
+            f"- milestones: Exactly {weeks} entries, one short milestone per week, in order.\n"
+            f"- Present the outline ONLY as a valid JSON object, no markdown, no explanation, no extra text.\n"
+            f"{profile_summary(profile)}"
+        )
+
+    def _weeks_prompt(self, profile, outline: Dict[str, Any], weeks: List[int]) -> str:
+        milestones = "\n".join(
+            f"  Week {i + 1}: {milestone}" for i, milestone in enumerate(outline["milestones"])
+        )
+        return (
+            f"Expand weeks {weeks[0]}-{weeks[-1]} of this plan into actionable tasks as a JSON object with the following structure:\n"
+            f'{{"weekly_phases": [{{"week": number, "milestone": string, "tasks": [string, ...]}}]}}\n'
+            f"- Return exactly one entry for each of weeks {', '.join(str(w) for w in weeks)}, keeping the milestone from the outline.\n"
+            f"- Tasks must fit the available focus time; keep each task to one short sentence.\n"
+            f"- Present the result ONLY as a valid JSON object, no markdown, no explanation, no extra text.\n"
+            f"{profile_summary(profile)}"
+            f"Plan outline:\n{milestones}\n"
+        )
+
+    def _revision_prompt(self, profile, plan: Dict[str, Any], weeks: List[int], feedback: str = None) -> str:
+        phases = {parse_week(phase.get("week")): phase for phase in plan["weekly_phases"]}
+        phases.pop(None, None)
+        # Milestones give the model the arc of the plan; full tasks only for
+        # the weeks on either side of the slice, so transitions stay smooth.
+        neighbours = {weeks[0] - 1, weeks[-1] + 1}
+        lines = []
+        for week in sorted(phases):
+            phase = phases[week]
+            marker = " (regenerate)" if week in weeks else ""
+            lines.append(f"  Week {week}{marker}: {phase.get('milestone', '')}")
+            if week in neighbours:
+                tasks = "; ".join(t if isinstance(t, str) else t.get("title", "") for t in phase.get("tasks", []))
+                lines.append(f"    Tasks: {tasks}")
+        outline = "\n".join(lines)
+        feedback_line = f"- User feedback for these weeks: {feedback}\n" if feedback else ""
+        return (
+            f"Rewrite weeks {weeks[0]}-{weeks[-1]} of this plan as a JSON object with the following structure:\n"
+            f'{{"weekly_phases": [{{"week": number, "milestone": string, "tasks": [string, ...]}}]}}\n'
+            f"- Return exactly one entry for each of weeks {', '.join(str(w) for w in weeks)}.\n"
+            f"- Keep continuity with the surrounding weeks; do not repeat their tasks.\n"
+            f"- Tasks must fit the available focus time; keep each task to one short sentence.\n"
+            f"- Present the result ONLY as a valid JSON object, no markdown, no explanation, no extra text.\n"
+            f"{feedback_line}"
+            f"{profile_summary(profile)}"
+            f"Plan strategy: {plan.get('header_note', '')}\n"
+            f"Plan outline:\n{outline}\n"
+        )
+
+    def _generate_weeks(self, profile, outline: Dict[str, Any], weeks: List[int]) -> List[Dict[str, Any]]:
+        return self._request_weeks(self._weeks_prompt(profile, outline, weeks), weeks)
+
+    def _request_weeks(self, prompt: str, weeks: List[int], context: List[str] = None) -> List[Dict[str, Any]]:
+        for attempt in range(2):
+            phases = parse_plan_response(self.llm.complete(prompt, context=context, kind="plan_week", weeks=len(weeks))).get("weekly_phases", [])
+            by_week = {parse_week(phase.get("week")): phase for phase in phases if isinstance(phase, dict)}
+            if all(week in by_week for week in weeks):
+                return [dict(by_week[week], week=week) for week in weeks]
+        raise ValueError(f"Invalid plan structure: weeks {weeks[0]}-{weeks[-1]} are incomplete")
+
+    def generate(self, profile, context: List[str] = None) -> Dict[str, Any]:
+        """
+        Generate a plan with weekly_phases via outline + parallel week blocks.
+
+        Args:
+            profile: UserProfile of the request
+            context (List[str], optional): Retrieved literature, used for the outline only
+
+        Returns:
+            Dict[str, Any]: {"header_note", "goal", "weekly_phases"}
+        """
+        weeks = profile.learning_duration
+        outline = parse_plan_response(
+            self.llm.complete(self._outline_prompt(profile), context=context, kind="plan_outline", weeks=weeks)
+        )
+        milestones = list(outline.get("milestones", []))[:weeks]
+        if len(milestones) < weeks:
+            raise ValueError("Invalid plan structure: outline has fewer milestones than weeks")
+        outline["milestones"] = milestones
+
+        blocks = [
+            list(range(start, min(start + self.weeks_per_call, weeks + 1)))
+            for start in range(1, weeks + 1, self.weeks_per_call)
+        ]
+        futures = [self.executor.submit(self._generate_weeks, profile, outline, block) for block in blocks]
+
+        weekly_phases = []
+        try:
+            for future in futures:
+                weekly_phases.extend(future.result())
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+        return {
+            "header_note": outline.get("header_note", ""),
+            "goal": outline.get("goal", profile.goal),
+            "weekly_phases": weekly_phases
+        }
+
+    def regenerate(self, profile, plan: Dict[str, Any], weeks: List[int],
+                   context: List[str] = None, feedback: str = None) -> List[Dict[str, Any]]:
+        """
+        Re-plan a slice of a stored plan.
+
+        Only the slice, the plan's milestones and its neighbouring weeks are
+        sent, so an edit costs one small call instead of a full plan.
+
+        Args:
+            profile: UserProfile the plan was generated for
+            plan (Dict[str, Any]): Stored plan with header_note and weekly_phases
+            weeks (List[int]): Consecutive week numbers to regenerate
+            context (List[str], optional): Literature chunks the plan was built from
+            feedback (str, optional): What the user wants changed
+
+        Returns:
+            List[Dict[str, Any]]: Replacement weekly_phases entries, in week order
+        """
+        return self._request_weeks(self._revision_prompt(profile, plan, weeks, feedback), weeks, context=context)
@@ -0,0 +1,314 @@
+import os
+import sqlite3
+import json
+import uuid
+from typing import List, Dict, Any, Optional
+from .scheduler import parse_week
+
+
+def week_numbers(weekly_phases: List[Dict[str, Any]]) -> List[int]:
+    """
+    Week number of each phase (its position when it has none).
+
+    Raises:
+        ValueError: A week is not a positive number or appears twice
+    """
+    weeks = []
+    for i, phase in enumerate(weekly_phases):
+        week = parse_week(phase.get('week', i + 1)) if isinstance(phase, dict) else None
+        if week is None or week < 1:
+            raise ValueError(f"Invalid plan structure: phase {i + 1} has no valid week number")
+        if week in weeks:
+            raise ValueError(f"Invalid plan structure: week {week} appears more than once")
+        weeks.append(week)
+    return weeks
+
+class PlanStore:
+    """
+    SQLite repository for generated plans.
+
+    Plans are normalized into a `plans` row (goal, header note, profile)
+    and one `plan_weeks` row per week, so a single week can be read or
+    replaced without touching the rest. `version` increases on every
+    change and backs the API's ETags.
+    """
+
+    def __init__(self, config=None, db_path: Optional[str] = None):
+        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.db_path = db_path or getattr(config, 'plan_db_path', None) or os.path.join(self.data_dir, 'plans.db')
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def _init_db(self):
+        """Create the plan tables and lookup indexes."""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS plans (
+                plan_id TEXT PRIMARY KEY,
+                user_id TEXT,
+                session_id TEXT,
+                goal TEXT NOT NULL,
+                header_note TEXT,
+                profile TEXT,
+                context_refs TEXT,
+                version INTEGER NOT NULL DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS plan_weeks (
+                plan_id TEXT NOT NULL,
+                week INTEGER NOT NULL,
+                milestone TEXT,
+                tasks TEXT NOT NULL,
+                PRIMARY KEY (plan_id, week),
+                FOREIGN KEY (plan_id) REFERENCES plans(plan_id)
+            )
+        ''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_plans_user ON plans (user_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_plans_session ON plans (session_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_plans_goal ON plans (goal, created_at)')
+
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def _week_rows(plan_id: str, weekly_phases: List[Dict[str, Any]]) -> List[tuple]:
+        return [
+            (
+                plan_id,
+                week,
+                phase.get('milestone'),
+                json.dumps(phase.get('tasks', []))
+            )
+            for week, phase in zip(week_numbers(weekly_phases), weekly_phases)
+        ]
+
+    def save_plan(self,
+                  plan: Dict[str, Any],
+                  profile: Optional[Dict[str, Any]] = None,
+                  user_id: Optional[str] = None,
+                  session_id: Optional[str] = None,
+                  context_refs: Optional[List[str]] = None) -> str:
+        """
+        Store a generated plan.
+
+        Args:
+            plan (Dict[str, Any]): Plan with header_note, goal and weekly_phases
+            profile (Dict[str, Any], optional): Profile the plan was generated for
+            user_id (str, optional): Owner of the plan
+            session_id (str, optional): Chat session the plan belongs to
+            context_refs (List[str], optional): chunk_refs of the knowledge base chunks used for the plan
+
+        Returns:
+            str: The new plan_id
+
+        Raises:
+            ValueError: The plan's week numbers are invalid or repeated
+        """
+        plan_id = str(uuid.uuid4())
+        # Checked before the insert so a bad plan fails loudly instead of as an IntegrityError
+        week_rows = self._week_rows(plan_id, plan.get('weekly_phases', []))
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            '''
+            INSERT INTO plans (plan_id, user_id, session_id, goal, header_note, profile, context_refs)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''',
+            (
+                plan_id,
+                user_id,
+                session_id,
+                plan.get('goal') or (profile or {}).get('goal', ''),
+                plan.get('header_note'),
+                json.dumps(profile) if profile else None,
+                json.dumps(context_refs) if context_refs else None
+            )
+        )
+        cursor.executemany(
+            'INSERT INTO plan_weeks (plan_id, week, milestone, tasks) VALUES (?, ?, ?, ?)',
+            week_rows
+        )
+
+        conn.commit()
+        conn.close()
+        return plan_id
+
+    def get_version(self, plan_id: str) -> Optional[int]:
+        """Current version of a plan, or None if it does not exist."""
+        conn = self._connect()
+        row = conn.execute('SELECT version FROM plans WHERE plan_id = ?', (plan_id,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def get_plan(self, plan_id: str, weeks: Optional[range] = None) -> Optional[Dict[str, Any]]:
+        """
+        Load a plan, optionally only a range of its weeks.
+
+        Returns:
+            Optional[Dict[str, Any]]: The plan, or None if it does not exist
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            '''
+            SELECT plan_id, user_id, session_id, goal, header_note, profile, context_refs,
+                   version, created_at, updated_at
+            FROM plans WHERE plan_id = ?
+            ''',
+            (plan_id,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            conn.close()
+            return None
+
+        if weeks is None:
+            cursor.execute(
+                'SELECT week, milestone, tasks FROM plan_weeks WHERE plan_id = ? ORDER BY week',
+                (plan_id,)
+            )
+        else:
+            cursor.execute(
+                'SELECT week, milestone, tasks FROM plan_weeks WHERE plan_id = ? AND week BETWEEN ? AND ? ORDER BY week',
+                (plan_id, weeks.start, weeks.stop - 1)
+            )
+        weekly_phases = [
+            {'week': week, 'milestone': milestone, 'tasks': json.loads(tasks)}
+            for week, milestone, tasks in cursor.fetchall()
+        ]
+        conn.close()
+
+        return {
+            'plan_id': row[0],
+            'user_id': row[1],
+            'session_id': row[2],
+            'goal': row[3],
+            'header_note': row[4],
+            'profile': json.loads(row[5]) if row[5] else None,
+            'context_refs': json.loads(row[6]) if row[6] else None,
+            'version': row[7],
+            'created_at': row[8],
+            'updated_at': row[9],
+            'weekly_phases': weekly_phases
+        }
+
+    def replace_weeks(self,
+                      plan_id: str,
+                      weekly_phases: List[Dict[str, Any]],
+                      expected_version: Optional[int] = None) -> Optional[int]:
+        """
+        Overwrite some weeks of a plan and bump its version.
+
+        Args:
+            plan_id (str): Plan to update
+            weekly_phases (List[Dict[str, Any]]): Replacement weeks, matched by week number
+            expected_version (int, optional): Only update if the plan is still at this version
+
+        Returns:
+            Optional[int]: The new version, or None if the plan is missing or was changed concurrently
+
+        Raises:
+            ValueError: The replacement week numbers are invalid or repeated
+        """
+        week_rows = self._week_rows(plan_id, weekly_phases)
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        # BEGIN IMMEDIATE takes the write lock before the version check
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT version FROM plans WHERE plan_id = ?', (plan_id,))
+        row = cursor.fetchone()
+        if not row or (expected_version is not None and row[0] != expected_version):
+            conn.rollback()
+            conn.close()
+            return None
+
+        cursor.executemany(
+            'INSERT OR REPLACE INTO plan_weeks (plan_id, week, milestone, tasks) VALUES (?, ?, ?, ?)',
+            week_rows
+        )
+        cursor.execute(
+            'UPDATE plans SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE plan_id = ?',
+            (plan_id,)
+        )
+
+        conn.commit()
+        conn.close()
+        return row[0] + 1
+
+    def list_plans(self,
+                   user_id: Optional[str] = None,
+                   session_id: Optional[str] = None,
+                   goal: Optional[str] = None,
+                   limit: int = 20) -> List[Dict[str, Any]]:
+        """List plan summaries, newest first, filtered by owner, session or goal."""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            '''
+            SELECT p.plan_id, p.user_id, p.session_id, p.goal, p.version, p.created_at, p.updated_at,
+                   (SELECT COUNT(*) FROM plan_weeks w WHERE w.plan_id = p.plan_id)
+            FROM plans p
+            WHERE (? IS NULL OR p.user_id = ?)
+              AND (? IS NULL OR p.session_id = ?)
+              AND (? IS NULL OR p.goal = ?)
+            ORDER BY p.created_at DESC
+            LIMIT ?
+            ''',
+            (user_id, user_id, session_id, session_id, goal, goal, limit)
+        )
+
+        plans = [
+            {
+                'plan_id': row[0],
+                'user_id': row[1],
+                'session_id': row[2],
+                'goal': row[3],
+                'version': row[4],
+                'created_at': row[5],
+                'updated_at': row[6],
+                'weeks': row[7]
+            }
+            for row in cursor.fetchall()
+        ]
+
+        conn.close()
+        return plans
+
+    def goal_counts(self, limit: int = 10000) -> List[tuple]:
+        """(goal, number of plans) pairs, most planned goals first."""
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT goal, COUNT(*) FROM plans GROUP BY goal ORDER BY COUNT(*) DESC LIMIT ?',
+            (limit,)
+        )
+        counts = cursor.fetchall()
+        conn.close()
+        return counts
+
+    def delete_plan(self, plan_id: str) -> bool:
+        """Delete a plan and its weeks."""
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM plan_weeks WHERE plan_id = ?', (plan_id,))
+        cursor.execute('DELETE FROM plans WHERE plan_id = ?', (plan_id,))
+        deleted = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return deleted
@@ -0,0 +1,200 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .goal_clusters import CONTEXT_PACK_RESULTS
+
+
+class Speculation:
+    """A plan generation started ahead of submit for one draft of the onboarding form."""
+
+    def __init__(self, fingerprint: str, future: Future, started_at: float):
+        self.fingerprint = fingerprint
+        self.future = future
+        self.started_at = started_at
+
+
+class PlanPrefetcher:
+    """
+    Work done for the onboarding form before it is submitted.
+
+    retrieve() runs retrieval and context compression for a goal and keeps
+    the result for PREFETCH_TTL_SECONDS, keyed by tenant, goal, metadata
+    filter and index generation, so a prefetch for the draft goal lets the
+    submit skip both. Untenanted, unfiltered goals with no cache entry
+    are served from their goal cluster's context pack when there is one.
+    speculate() also starts the plan generation for a
+    draft's profile, but only while the LLM gateway has idle capacity for
+    plan calls. A submit whose profile matches adopts the generation, even
+    mid-flight; a different profile or a newer draft cancels it (a call
+    already running finishes and is discarded).
+    """
+
+    def __init__(self, config, knowledge_base, compressor, gateway, goal_clusters=None):
+        self.config = config
+        self.knowledge_base = knowledge_base
+        self.compressor = compressor
+        self.gateway = gateway
+        self.goal_clusters = goal_clusters
+        self.ttl = config.prefetch_ttl_seconds
+        self.max_entries = config.prefetch_max_entries
+        self._retrievals = OrderedDict()
+        self._speculations = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=config.prefetch_speculation_concurrency,
+                                            thread_name_prefix="plan-speculation")
+        self.metrics = {
+            "retrieval_hits": 0,
+            "retrieval_misses": 0,
+            "speculations_started": 0,
+            "speculations_skipped_busy": 0,
+            "speculations_adopted": 0,
+            "speculations_cancelled": 0,
+            "speculations_failed": 0
+        }
+
+    @staticmethod
+    def fingerprint(*parts: Any) -> str:
+        """Stable key for a profile and its retrieval options."""
+        return json.dumps(parts, sort_keys=True, default=str)
+
+    def _retrieval_key(self, tenant_id: Optional[str], goal: str, where: Optional[Dict[str, Any]]) -> str:
+        generation = self.knowledge_base.shared.generation_info().get("generation")
+        return self.fingerprint(tenant_id, goal.strip().lower(), where, generation)
+
+    def retrieve(self, tenant_id: Optional[str], goal: str, n_results: int = 5,
+                 where: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Retrieval results and compressed context for a goal, from the cache when warm.
+
+        Args:
+            tenant_id (str, optional): Tenant namespace to include
+            goal (str): The goal text
+            n_results (int): Number of chunks to retrieve
+            where (Dict[str, Any], optional): Metadata filter
+
+        Returns:
+            tuple: (retrieval results, compressed context documents)
+        """
+        key = self._retrieval_key(tenant_id, goal, where)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._retrievals.get(key)
+            if entry is not None and entry[0] > now and entry[1] == n_results:
+                self._retrievals.move_to_end(key)
+                self.metrics["retrieval_hits"] += 1
+                return entry[2], entry[3]
+            self.metrics["retrieval_misses"] += 1
+
+        if self.goal_clusters is not None and tenant_id is None and where is None \
+                and n_results == CONTEXT_PACK_RESULTS:
+            packed = self.goal_clusters.lookup(goal)
+            if packed is not None:
+                return packed
+
+        retrieval = self.knowledge_base.search(tenant_id, goal, n_results=n_results, where=where)
+        context = self.compressor.compress(goal, retrieval)['documents']
+        with self._lock:
+            self._retrievals[key] = (now + self.ttl, n_results, retrieval, context)
+            self._retrievals.move_to_end(key)
+            while len(self._retrievals) > self.max_entries:
+                self._retrievals.popitem(last=False)
+        return retrieval, context
+
+    def _gateway_idle(self) -> bool:
+        stats = self.gateway.stats()
+        plan_slots = max(1, self.config.llm_max_concurrency - self.config.llm_reserved_chat_slots)
+        return stats["queue_depth"] == 0 and stats["in_flight"] < plan_slots
+
+    def _expire(self, now: float):
+        """Drop speculations nobody submitted within the TTL. Caller holds _lock."""
+        for draft_id, speculation in list(self._speculations.items()):
+            if now - speculation.started_at > self.ttl:
+                speculation.future.cancel()
+                del self._speculations[draft_id]
+                self.metrics["speculations_cancelled"] += 1
+
+    def speculate(self, draft_id: str, fingerprint: str, generate: Callable[[], Any],
+                  admit: Optional[Callable[[], Optional[Callable[[], None]]]] = None) -> bool:
+        """
+        Start generating a draft's plan in the background.
+
+        Args:
+            draft_id (str): The form session the draft belongs to
+            fingerprint (str): Key of the profile the plan is generated for
+            generate (Callable): Zero-argument function producing the plan
+            admit (Callable, optional): Takes an admission slot for a new generation
+                and returns the function giving it back, or None when there is no
+                free slot; the slot is held until the generation ends or is cancelled
+
+        Returns:
+            bool: True if a generation for this profile is running or done
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            current = self._speculations.get(draft_id)
+            if current is not None:
+                if current.fingerprint == fingerprint and not current.future.cancelled():
+                    return True
+                # The draft changed: its earlier plan will never be adopted
+                current.future.cancel()
+                del self._speculations[draft_id]
+                self.metrics["speculations_cancelled"] += 1
+            if len(self._speculations) >= self.max_entries or not self._gateway_idle():
+                self.metrics["speculations_skipped_busy"] += 1
+                return False
+            release = admit() if admit is not None else None
+            if admit is not None and release is None:
+                self.metrics["speculations_skipped_busy"] += 1
+                return False
+            future = self._executor.submit(generate)
+            if release is not None:
+                # Runs when the generation finishes or is cancelled before starting
+                future.add_done_callback(lambda _: release())
+            self._speculations[draft_id] = Speculation(fingerprint, future, now)
+            self.metrics["speculations_started"] += 1
+            return True
+
+    def claim(self, draft_id: Optional[str], fingerprint: str, timeout: Optional[float] = None) -> Optional[Any]:
+        """
+        Result of the draft's speculative generation if it was for this
+        profile; None (after cancelling any mismatch) when the caller has to
+        generate the plan itself.
+        """
+        if not draft_id:
+            return None
+        with self._lock:
+            speculation = self._speculations.pop(draft_id, None)
+        if speculation is None:
+            return None
+        if speculation.fingerprint != fingerprint or speculation.future.cancelled():
+            speculation.future.cancel()
+            with self._lock:
+                self.metrics["speculations_cancelled"] += 1
+            return None
+        try:
+            result = speculation.future.result(timeout=timeout)
+        except Exception as e:
+            print(f"Error in speculative plan generation: {str(e)}")
+            with self._lock:
+                self.metrics["speculations_failed"] += 1
+            return None
+        with self._lock:
+            self.metrics["speculations_adopted"] += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache and speculation counters."""
+        with self._lock:
+            return dict(self.metrics, cached_retrievals=len(self._retrievals),
+                        pending_speculations=len(self._speculations))
+
+    def close(self):
+        with self._lock:
+            for speculation in self._speculations.values():
+                speculation.future.cancel()
+            self._speculations.clear()
+        self._executor.shutdown(wait=False)
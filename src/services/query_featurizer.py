@@ -0,0 +1,139 @@
+import re
+import math
+import threading
+import numpy as np
+from typing import List, Optional, Tuple
+
+
+class QueryFeaturizer:
+    """
+    Query embedding for a fitted TfidfVectorizer without sklearn's per-call overhead.
+
+    sklearn's transform() runs its generic analyzer, builds a CSR matrix
+    and validates it for every query; for one short query that overhead
+    is nearly all of the cost. This reimplements the same steps for the
+    word-analyzer settings the index uses: lowercasing, the token pattern,
+    stop-word removal, n-grams, counting against vocabulary_, scaling by
+    idf_ and row normalization. Weights are computed in float64 in the
+    same order sklearn uses, so the float32 vectors are bit-identical to
+    transform(...).toarray().astype('float32'). Vectorizers configured
+    any other way are rejected by supports() and keep using transform().
+    """
+
+    def __init__(self, vectorizer):
+        self.lowercase = vectorizer.lowercase
+        self._findall = re.compile(vectorizer.token_pattern).findall
+        self.stop_words = vectorizer.get_stop_words() or frozenset()
+        self.min_n, self.max_n = vectorizer.ngram_range
+        self.norm = vectorizer.norm
+        self.vocabulary = dict(vectorizer.vocabulary_)
+        self.dimension = len(self.vocabulary)
+        self.idf = [float(value) for value in vectorizer.idf_] if vectorizer.use_idf else [1.0] * self.dimension
+        # First words of vocabulary bigrams: pairs starting with any other word are never looked up
+        self._bigram_heads = frozenset(term.split(' ', 1)[0] for term in self.vocabulary if term.count(' ') == 1)
+        self._local = threading.local()
+
+    @staticmethod
+    def supports(vectorizer) -> bool:
+        """True when the vectorizer is fitted and configured in a way featurize() reproduces exactly."""
+        return (
+            hasattr(vectorizer, 'vocabulary_')
+            and (not vectorizer.use_idf or hasattr(vectorizer, 'idf_'))
+            and vectorizer.input == 'content'
+            and vectorizer.analyzer == 'word'
+            and vectorizer.preprocessor is None
+            and vectorizer.tokenizer is None
+            and vectorizer.strip_accents is None
+            and vectorizer.token_pattern is not None
+            and re.compile(vectorizer.token_pattern).groups == 0
+            and vectorizer.ngram_range[0] >= 1
+            and not vectorizer.binary
+            and not vectorizer.sublinear_tf
+            and vectorizer.norm in ('l2', None)
+        )
+
+    def _ngram_columns(self, tokens: List[str]) -> List[int]:
+        """Vocabulary columns of every n-gram, in sklearn's n-gram order (repeats kept)."""
+        vocabulary = self.vocabulary
+        columns = []
+        if self.min_n == 1:
+            for token in tokens:
+                column = vocabulary.get(token)
+                if column is not None:
+                    columns.append(column)
+        for n in range(max(self.min_n, 2), min(self.max_n, len(tokens)) + 1):
+            if n == 2:
+                heads = self._bigram_heads
+                for first, second in zip(tokens, tokens[1:]):
+                    if first in heads:
+                        column = vocabulary.get(first + ' ' + second)
+                        if column is not None:
+                            columns.append(column)
+                continue
+            for start in range(len(tokens) - n + 1):
+                column = vocabulary.get(' '.join(tokens[start:start + n]))
+                if column is not None:
+                    columns.append(column)
+        return columns
+
+    def featurize(self, text: str) -> Tuple[List[int], List[float]]:
+        """Sparse TF-IDF row of a query: (sorted column ids, float64 weights)."""
+        if self.lowercase:
+            text = text.lower()
+        stop_words = self.stop_words
+        tokens = [token for token in self._findall(text) if token not in stop_words]
+        counts = {}
+        for column in self._ngram_columns(tokens):
+            counts[column] = counts.get(column, 0) + 1
+        columns = sorted(counts)
+        idf = self.idf
+        weights = [counts[column] * idf[column] for column in columns]
+        if self.norm == 'l2':
+            # Same accumulation order as sklearn's CSR row normalization
+            total = 0.0
+            for weight in weights:
+                total += weight * weight
+            if total != 0.0:
+                total = math.sqrt(total)
+                weights = [weight / total for weight in weights]
+        return columns, weights
+
+    def embed(self, text: str) -> np.ndarray:
+        """
+        Dense (1, dimension) float32 vector of one query.
+
+        The array is a per-thread buffer that the same thread's next embed()
+        call overwrites; copy it to keep it.
+        """
+        local = self._local
+        buffer = getattr(local, 'buffer', None)
+        if buffer is None:
+            buffer = local.buffer = np.zeros((1, self.dimension), dtype='float32')
+            local.columns = []
+        columns, weights = self.featurize(text)
+        # Element writes beat fancy indexing for the handful of columns a query sets;
+        # only the previous query's columns need clearing
+        row = buffer[0]
+        for column in local.columns:
+            row[column] = 0.0
+        for column, weight in zip(columns, weights):
+            row[column] = weight
+        local.columns = columns
+        return buffer
+
+    def transform(self, texts: List[str]) -> np.ndarray:
+        """Dense (len(texts), dimension) float32 matrix of many queries, freshly allocated."""
+        matrix = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            columns, weights = self.featurize(text)
+            matrix[row, columns] = weights
+        return matrix
+
+
+def featurizer_for(vectorizer) -> Optional[QueryFeaturizer]:
+    """A QueryFeaturizer for the vectorizer, or None when it must go through transform()."""
+    try:
+        return QueryFeaturizer(vectorizer) if QueryFeaturizer.supports(vectorizer) else None
+    except Exception as e:
+        print(f"Error building query featurizer: {str(e)}")
+        return None
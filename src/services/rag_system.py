@@ -2,18 +2,27 @@ from typing import List, Dict, Any
 import os
 import json
 from dotenv import load_dotenv
-from .vector_db import VectorDatabase
+from .vector_db import create_vector_database
 from .llm_integration import LLMIntegration
+from .llm_gateway import LLMGatewayError, LLMProviderError
 from .config import Config
 import logging
 from .document_processor import DocumentProcessor
+from .dedup import create_deduplicator, dedupe_chunks, new_report
+from .context_compression import ContextCompressor
 import uuid
 
+# Added to the system prompt of interactive chat turns
+CHAT_FORMATTING_INSTRUCTIONS = """
+Please format your response using Markdown. Use headings (## or ###), bullet points (* or -), and ensure there is a blank line between different sections or paragraphs for readability. Structure your answer clearly.
+"""
+
 class RAGSystem:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, load_materials: bool = True):
         self.config = config
-        self.vector_db = VectorDatabase(config)
+        self.vector_db = create_vector_database(config)
         self.llm = LLMIntegration(config)
+        self.compressor = ContextCompressor(self.vector_db, config)
         
         # Try to load existing vector database
         try:
@@ -21,29 +30,46 @@ class RAGSystem:
             print("Loaded existing vector database")
         except Exception as e:
             print(f"No existing vector database found or error loading: {e}")
-            self._load_study_materials()
+            if load_materials:
+                self._load_study_materials()
     
-    def _load_study_materials(self):
+    def _load_study_materials(self, progress=None):
         study_dir = os.path.join(os.getcwd(), 'Study_Materials')
         if not os.path.exists(study_dir):
             print(f"Study_Materials folder not found at {study_dir}")
             return
         # Only load if vector DB is empty
-        if self.vector_db.documents:
+        if self.vector_db.count():
             print("Vector DB already has documents, skipping Study_Materials loading.")
             return
         processor = DocumentProcessor(self.config)
-        for fname in os.listdir(study_dir):
-            if fname.lower().endswith('.pdf'):
-                fpath = os.path.join(study_dir, fname)
-                try:
-                    print(f"Processing {fname}...")
-                    chunks = processor.process_document(fpath)
-                    metadata = [{"source": fname} for _ in chunks]
-                    self.vector_db.add_documents(chunks, metadata)
-                    print(f"Added {len(chunks)} chunks from {fname} to vector DB.")
-                except Exception as e:
-                    print(f"Error processing {fname}: {e}")
+        # One deduplicator for the whole run catches copies across books too
+        deduplicator = create_deduplicator(self.config)
+        report = new_report()
+        all_chunks, all_metadata = [], []
+        pdfs = [fname for fname in os.listdir(study_dir) if fname.lower().endswith('.pdf')]
+        for i, fname in enumerate(pdfs):
+            if progress:
+                progress(i / len(pdfs), f"Processing {fname}")
+            fpath = os.path.join(study_dir, fname)
+            try:
+                print(f"Processing {fname}...")
+                chunks = processor.process_document(fpath)
+                metadata = [{"source": fname} for _ in chunks]
+                if deduplicator:
+                    chunks, metadata, report = dedupe_chunks(chunks, metadata, deduplicator, report)
+                all_chunks.extend(chunks)
+                all_metadata.extend(metadata)
+                print(f"Collected {len(chunks)} chunks from {fname}.")
+            except Exception as e:
+                print(f"Error processing {fname}: {e}")
+        if deduplicator:
+            print(f"Chunk dedup report: {report}")
+        if not all_chunks:
+            return report
+        # One add for the whole corpus: the vocabulary is fit once over every book
+        self.vector_db.add_documents(all_chunks, all_metadata)
+        print(f"Added {len(all_chunks)} chunks from {len(pdfs)} files to vector DB.")
         
         # Save the vector database after loading documents
         try:
@@ -51,6 +77,7 @@ class RAGSystem:
             print("Saved vector database")
         except Exception as e:
             print(f"Error saving vector database: {e}")
+        return report
 
     def _generate_plan_prompt(self, user_profile: dict, context_text: str) -> str:
         """Generate a prompt for plan creation"""
@@ -61,22 +88,17 @@ class RAGSystem:
             f"- header_note: A motivating summary, overall strategy, tips, tricks, user state, mindset advice, and any high-level information from the RAG documents.\n"
             f"- goal: The main goal.\n"
             f"- milestones: An array of milestones, each with a title and a list of actionable tasks.\n"
-            f"- The plan should be for the specific goal only (not a full daily schedule).\n"
+            f"- The plan should be for the specific goal only (not a daily schedule; time blocks are assigned separately).\n"
             f"- Present the plan ONLY as a valid JSON object, no markdown, no explanation, no extra text.\n"
             f"- Make the plan motivating and easy to follow.\n"
             f"- Use the RAG context to provide personalized tips, mindset shifts, and strategies in the header_note.\n"
             f"- Goal: {user_profile['goal']}\n"
-            f"- Wake Up Time: {user_profile['wake_time']}\n"
-            f"- Sleep Time: {user_profile['sleep_time']}\n"
             f"- Focus Periods Per Day: {user_profile['focus_periods']}\n"
-            f"- Break Duration: {user_profile['break_duration']} minutes\n"
             f"- Work Style: {user_profile['work_style']}\n"
-            f"- Habits: {user_profile.get('habits', '')}\n"
-            f"- Rest Days: {user_profile.get('rest_days', '')}\n\n"
+            f"- Habits: {user_profile.get('habits', '')}\n\n"
             f"Instructions:\n"
             f"- Break the main goal into milestones and actionable tasks.\n"
-            f"- Distribute tasks over the available focus periods.\n"
-            f"- Suggest a daily schedule.\n"
+            f"- Keep each task to one short sentence.\n"
         )
 
     def _generate_chat_plan_prompt(self, user_profile: dict, context_text: str) -> str:
@@ -116,7 +138,8 @@ class RAGSystem:
             context_text = "\n".join(rag_context)
             prompt = self._generate_plan_prompt(user_profile, context_text)
             try:
-                response = self.llm.generate_response(prompt)
+                response = self.llm.generate_response(prompt, task="plan",
+                                                      stored_query=f"Create a plan\nGoal: {user_profile['goal']}")
                 # Ensure response is valid JSON
                 plan_data = json.loads(response)
                 if not all(key in plan_data for key in ["header_note", "goal", "milestones"]):
@@ -148,35 +171,26 @@ class RAGSystem:
             if not msg:
                 return {"message": "Please enter a message to continue.", "context": context or {}, "history": history}
             
-            # Create new session if none provided
-            if not session_id:
-                session_id = str(uuid.uuid4())
+            # Previous turns from the client are only replayed when the
+            # server holds no history for this session
+            previous_turns = list(history)
             
             # Add the user's message to the history
             history.append({"role": "user", "content": msg})
             
-            # Build the prompt from the history
-            prompt = ""
-            for turn in history:
-                if turn["role"] == "user":
-                    prompt += f"User: {turn['content']}\n"
-                else:
-                    prompt += f"Assistant: {turn['content']}\n"
-            prompt += "Assistant:"
-            
             # Get relevant context from vector DB
-            rag_context = self.vector_db.search(msg, n_results=3)['documents']
-            context_text = "\n".join(rag_context)
+            retrieval = self.compressor.compress(msg, self.vector_db.search(msg, n_results=3))
             
-            # Add instructions for markdown formatting and structure
-            formatting_instructions = """
-Please format your response using Markdown. Use headings (## or ###), bullet points (* or -), and ensure there is a blank line between different sections or paragraphs for readability. Structure your answer clearly.
-"""
-
-            prompt = f"{formatting_instructions}\nContext from productivity literature:\n{context_text}\n\n" + prompt
-
             # Get LLM response
-            response = self.llm.generate_response(prompt, session_id=session_id)
+            response = self.llm.generate_response(
+                msg,
+                context=retrieval['documents'],
+                session_id=session_id,
+                instructions=CHAT_FORMATTING_INSTRUCTIONS,
+                context_refs=retrieval.get('refs'),
+                history=previous_turns
+            )
+            session_id = response["session_id"]
             
             # Add response to history
             history.append({"role": "assistant", "content": response["response"]})
@@ -188,6 +202,8 @@ Please format your response using Markdown. Use headings (## or ###), bullet poi
                 "session_id": session_id
             }
             
+        except (LLMGatewayError, LLMProviderError):
+            raise
         except Exception as e:
             logging.error(f"process_chat_interaction error: {e}")
             return {
@@ -197,21 +213,38 @@ Please format your response using Markdown. Use headings (## or ###), bullet poi
                 "session_id": session_id
             }
 
+    def stream_chat_interaction(self, message: str, session_id: str, on_token, cancelled=None) -> dict:
+        """
+        Answer one chat turn of a server-held session, passing the reply
+        to on_token chunk by chunk. Errors propagate to the caller, which
+        owns the connection the tokens go to.
+        """
+        retrieval = self.compressor.compress(message, self.vector_db.search(message, n_results=3))
+        return self.llm.stream_response(
+            message,
+            on_token,
+            session_id,
+            context=retrieval['documents'],
+            instructions=CHAT_FORMATTING_INSTRUCTIONS,
+            context_refs=retrieval.get('refs'),
+            cancelled=cancelled
+        )
+
     def query(self, message: str) -> str:
         """Handle general queries"""
         try:
             # Get relevant context from RAG
-            rag_context = self.vector_db.search(message, n_results=3)['documents']
-            context_text = "\n".join(rag_context)
+            retrieval = self.compressor.compress(message, self.vector_db.search(message, n_results=3))
 
             # Generate response
-            prompt = (
-                f"Context from productivity literature:\n{context_text}\n\n"
-                f"User question: {message}\n\n"
-                f"Provide a helpful and informative response based on the context above."
-            )
-
-            return self.llm.generate_response(prompt)["response"]
+            return self.llm.generate_response(
+                message,
+                context=retrieval['documents'],
+                instructions="Provide a helpful and informative response based on the provided context from productivity literature.",
+                context_refs=retrieval.get('refs')
+            )["response"]
+        except (LLMGatewayError, LLMProviderError):
+            raise
         except Exception as e:
             raise Exception(f"Error processing query: {str(e)}")
 
@@ -246,7 +279,9 @@ Ensure blank lines between sections.
 """
 
             # Get LLM response for the plan
-            response = self.llm.generate_response(plan_prompt)
+            goal = user_profile.get('goal') or user_profile.get('primaryGoal') or ''
+            response = self.llm.generate_response(plan_prompt, task="plan",
+                                                  stored_query=f"Create a plan\nGoal: {goal}")
 
             return {
                 "plan": response["response"],
@@ -0,0 +1,282 @@
+import math
+import re
+from datetime import date, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+DAY_ALIASES = {name.lower(): i for i, name in enumerate(WEEKDAYS)}
+DAY_ALIASES.update({name[:3].lower(): i for i, name in enumerate(WEEKDAYS)})
+DAY_ALIASES.update({"tues": 1, "wed": 2, "thur": 3, "thurs": 3})
+
+PEAK_TIMES = {"morning": 6 * 60, "afternoon": 12 * 60, "evening": 17 * 60, "night": 20 * 60}
+
+TIME_RANGE = re.compile(
+    r'(\d{1,2})(?::(\d{2}))?\s*(am|pm)?\s*(?:-|–|to)\s*(\d{1,2})(?::(\d{2}))?\s*(am|pm)?',
+    re.IGNORECASE
+)
+DAY_RANGE = re.compile(r'\b([a-z]{3,9})\s*(?:-|–|to)\s*([a-z]{3,9})\b', re.IGNORECASE)
+
+
+def _get(profile, key: str, default=None):
+    if isinstance(profile, dict):
+        value = profile.get(key, default)
+    else:
+        value = getattr(profile, key, default)
+    return default if value is None else value
+
+
+def parse_time(value: str, default: int) -> int:
+    """'07:30' / '7:30 pm' -> minutes after midnight."""
+    match = re.match(r'\s*(\d{1,2})(?::(\d{2}))?\s*(am|pm)?\s*$', str(value or ''), re.IGNORECASE)
+    if not match:
+        return default
+    return _to_minutes(match.group(1), match.group(2), match.group(3))
+
+
+def _to_minutes(hours: str, minutes: Optional[str], meridiem: Optional[str]) -> int:
+    h = int(hours) % 24
+    if meridiem:
+        h = h % 12 + (12 if meridiem.lower() == 'pm' else 0)
+    return h * 60 + int(minutes or 0)
+
+
+def parse_start_date(value) -> date:
+    """'2024-05-06' -> date; anything else is a ValueError."""
+    try:
+        return date.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"start_date must be a date like 2024-05-06, got {value!r}")
+
+
+def parse_week(value) -> Optional[int]:
+    """Week number of a plan phase; models return 1 or '1'. None if it is not a number."""
+    try:
+        return int(float(str(value).strip()))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def format_time(minutes: int) -> str:
+    minutes %= 24 * 60
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parse_days(text: str) -> List[int]:
+    """Weekday numbers named in free text ('Mon-Fri', 'weekends', 'Saturday, Sunday')."""
+    text = (text or '').lower()
+    days = set()
+    if 'weekday' in text:
+        days.update(range(5))
+    if 'weekend' in text:
+        days.update((5, 6))
+    if 'daily' in text or 'every day' in text:
+        days.update(range(7))
+    for first, last in DAY_RANGE.findall(text):
+        if first in DAY_ALIASES and last in DAY_ALIASES:
+            start, end = DAY_ALIASES[first], DAY_ALIASES[last]
+            days.update(range(start, end + 1) if start <= end else list(range(start, 7)) + list(range(end + 1)))
+    for word in re.findall(r'[a-z]+', text):
+        if word in DAY_ALIASES:
+            days.add(DAY_ALIASES[word])
+    return sorted(days)
+
+
+def parse_commitments(commitments) -> List[Dict[str, Any]]:
+    """
+    Normalize fixed commitments to {"title", "days", "start", "end"}.
+
+    Accepts a list of dicts ({"day"/"days", "start", "end", "title"}) or
+    the free-text field from the planner form, e.g.
+    "Work 9:00-17:00 Mon-Fri; Gym 6pm-7pm Tue, Thu".
+    """
+    if not commitments:
+        return []
+    if isinstance(commitments, str):
+        # Commas separate commitments and also list days ("Tue, Thu"), so a
+        # piece without its own time range continues the previous one.
+        items = []
+        for part in re.split(r'[;,\n]', commitments):
+            if not part.strip():
+                continue
+            if items and not TIME_RANGE.search(part):
+                items[-1] += "," + part
+            else:
+                items.append(part)
+        parsed = []
+        for item in items:
+            match = TIME_RANGE.search(item)
+            if not match:
+                continue
+            end_meridiem = match.group(6)
+            start = _to_minutes(match.group(1), match.group(2), match.group(3) or end_meridiem)
+            end = _to_minutes(match.group(4), match.group(5), end_meridiem)
+            rest = (item[:match.start()] + item[match.end():]).strip()
+            days = parse_days(rest) or list(range(7))
+            title = re.sub(r'\b(on|every|from|at)\b', '', DAY_RANGE.sub('', rest), flags=re.IGNORECASE)
+            title = re.sub(r'\b(' + '|'.join(DAY_ALIASES) + r'|weekdays?|weekends?|daily)\b', '', title, flags=re.IGNORECASE)
+            parsed.append({
+                "title": " ".join(title.replace(',', ' ').split()) or "Commitment",
+                "days": days,
+                "start": start,
+                "end": end if end > start else end + 24 * 60
+            })
+        return parsed
+
+    parsed = []
+    for item in commitments:
+        days = item.get("days", item.get("day", "daily"))
+        if isinstance(days, str):
+            days = parse_days(days) or list(range(7))
+        start = parse_time(item.get("start"), 0)
+        end = parse_time(item.get("end"), start)
+        parsed.append({
+            "title": item.get("title", "Commitment"),
+            "days": [DAY_ALIASES.get(str(d).lower(), d) for d in days],
+            "start": start,
+            "end": end if end > start else end + 24 * 60
+        })
+    return parsed
+
+
+def _day_blocks(window: Tuple[int, int],
+                busy: List[Tuple[int, int, str]],
+                focus_periods: int,
+                focus_length: int,
+                break_duration: int,
+                peak: Optional[int]) -> List[Dict[str, Any]]:
+    """Fit focus/break blocks into a day's waking window around busy intervals."""
+    day_start, day_end = window
+    segments = [(day_start, day_end)]
+    if peak is not None and day_start < peak < day_end:
+        segments = [(peak, day_end), (day_start, peak)]
+
+    focus = []
+    for seg_start, seg_end in segments:
+        cursor = seg_start
+        while len(focus) < focus_periods and cursor + focus_length <= seg_end:
+            block_end = cursor + focus_length
+            clash = next((b for b in busy if b[0] < block_end and cursor < b[1]), None)
+            if clash:
+                cursor = clash[1]
+                continue
+            if any(f[0] < block_end and cursor < f[1] for f in focus):
+                cursor = block_end
+                continue
+            focus.append((cursor, block_end))
+            cursor = block_end + break_duration
+
+    blocks = [{"type": "commitment", "start": s, "end": e, "title": t} for s, e, t in busy]
+    focus.sort()
+    for i, (start, end) in enumerate(focus):
+        blocks.append({"type": "focus", "start": start, "end": end, "task": None})
+        if i < len(focus) - 1:
+            break_end = min(end + break_duration, focus[i + 1][0])
+            if break_end > end:
+                blocks.append({"type": "break", "start": end, "end": break_end})
+    blocks.sort(key=lambda b: b["start"])
+    return blocks
+
+
+def build_schedule(profile, start_date: Optional[date] = None, default_focus_length: int = 50) -> Dict[str, Any]:
+    """
+    Compute focus and break blocks for every day of the plan.
+
+    Args:
+        profile: UserProfile model or dict (wake_time, sleep_time, focus_periods,
+            break_duration, rest_days, learning_duration, and optionally
+            focus_length, peak_focus_time, fixed_commitments, start_date)
+        start_date (date, optional): First day of the plan, defaults to today
+        default_focus_length (int): Minutes per focus block when the profile has none
+
+    Returns:
+        Dict[str, Any]: {"focus_length", "days": [...]} with one entry per day
+    """
+    wake = parse_time(_get(profile, 'wake_time'), 9 * 60)
+    sleep = parse_time(_get(profile, 'sleep_time'), 17 * 60)
+    if sleep <= wake:
+        sleep += 24 * 60
+    focus_periods = int(_get(profile, 'focus_periods', 4))
+    focus_length = int(_get(profile, 'focus_length', default_focus_length))
+    break_duration = int(_get(profile, 'break_duration', 5))
+    weeks = int(_get(profile, 'learning_duration', 4))
+    rest_days = set(parse_days(_get(profile, 'rest_days', '')))
+    commitments = parse_commitments(_get(profile, 'fixed_commitments'))
+
+    peak_value = str(_get(profile, 'peak_focus_time', '')).strip().lower()
+    peak = PEAK_TIMES.get(peak_value, parse_time(peak_value, -1) if peak_value else -1)
+    peak = peak if peak >= 0 else None
+
+    if start_date is None:
+        requested = _get(profile, 'start_date')
+        start_date = parse_start_date(requested) if requested else date.today()
+
+    # A day's layout only depends on its weekday, so compute each once
+    templates = {}
+    for weekday in range(7):
+        if weekday in rest_days:
+            templates[weekday] = []
+            continue
+        busy = sorted(
+            (c["start"], c["end"], c["title"]) for c in commitments if weekday in c["days"]
+        )
+        templates[weekday] = _day_blocks((wake, sleep), busy, focus_periods, focus_length, break_duration, peak)
+
+    days = []
+    for offset in range(weeks * 7):
+        day = start_date + timedelta(days=offset)
+        weekday = day.weekday()
+        days.append({
+            "date": day.isoformat(),
+            "weekday": WEEKDAYS[weekday],
+            "week": offset // 7 + 1,
+            "rest": weekday in rest_days,
+            "blocks": [
+                dict(b, start=format_time(b["start"]), end=format_time(b["end"]))
+                for b in templates[weekday]
+            ]
+        })
+
+    return {"focus_length": focus_length, "days": days}
+
+
+def assign_tasks(schedule: Dict[str, Any], weekly_phases: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Bin-pack each week's tasks into that week's focus blocks.
+
+    Tasks are strings or {"title", "minutes"} dicts; a task without an
+    estimate takes one focus block. Largest tasks go first, each into the
+    day with the most free focus time so load is spread across the week.
+    Tasks that do not fit are listed under schedule["unscheduled"].
+    """
+    focus_length = schedule["focus_length"]
+    unscheduled = []
+    days_by_week = {}
+    for day in schedule["days"]:
+        days_by_week.setdefault(day["week"], []).append(day)
+
+    for phase in weekly_phases:
+        week = parse_week(phase.get("week"))
+        week_days = days_by_week.get(week, [])
+        free = {
+            i: [b for b in day["blocks"] if b["type"] == "focus" and b["task"] is None]
+            for i, day in enumerate(week_days)
+        }
+        tasks = []
+        for task in phase.get("tasks", []):
+            title = task if isinstance(task, str) else task.get("title", "")
+            minutes = task.get("minutes") if isinstance(task, dict) else None
+            tasks.append((max(1, math.ceil((minutes or focus_length) / focus_length)), title))
+        tasks.sort(key=lambda t: -t[0])
+
+        for needed, title in tasks:
+            day_index = max(free, key=lambda i: len(free[i]), default=None)
+            if day_index is None or len(free[day_index]) < needed:
+                unscheduled.append({"week": week, "task": title})
+                continue
+            for block in free[day_index][:needed]:
+                block["task"] = title
+            free[day_index] = free[day_index][needed:]
+
+    schedule["unscheduled"] = unscheduled
+    return schedule
@@ -0,0 +1,575 @@
+import os
+import time
+import uuid
+import queue
+import heapq
+import pickle
+import random
+import argparse
+import threading
+import multiprocessing
+import numpy as np
+import faiss
+from concurrent.futures import ThreadPoolExecutor, wait
+from multiprocessing.connection import Listener, Client
+from typing import List, Dict, Any, Optional, Tuple
+from sklearn.feature_extraction.text import TfidfVectorizer
+from .vector_db import VectorDatabase, IndexGeneration, chunk_ref, new_generation_id
+from .config import Config
+
+COORDINATOR_FILE = "sharded.pkl"
+# A staged write not committed within this many seconds is dropped, so a
+# coordinator that died between stage and commit cannot block the shard
+STAGE_TIMEOUT_SECONDS = 60
+# Writes retried after losing a race with another coordinator
+ADD_ATTEMPTS = 8
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class ShardConflict(Exception):
+    """A shard write lost a race: the shard changed since the coordinator read its count."""
+
+
+class ShardIndex(VectorDatabase):
+    """
+    One partition of a sharded index. Vectors arrive already embedded by
+    the coordinator, which owns the vectorizer, so every shard scores in
+    the same TF-IDF space and distances are comparable across shards.
+    Shard 0 also keeps the vectorizer in its generation, so any
+    coordinator can pick it up from the shards.
+
+    Writes are two-phase: stage() checks the shard still holds the count
+    the coordinator allocated ids from and builds the new generation
+    without publishing it; commit() publishes it and rollback() undoes
+    that commit if another shard's commit failed.
+    """
+
+    def __init__(self, config: Config):
+        super().__init__(config)
+        self._staged = None
+        self._committed = None
+
+    def stage(self, txn: str, expected: int, embeddings: np.ndarray, chunks: List[str],
+              metadata: List[Dict[str, Any]], vectorizer=None) -> int:
+        with self._write_lock:
+            current = self._generation
+            if len(current.documents) != expected:
+                raise ShardConflict(f"shard holds {len(current.documents)} chunks, expected {expected}")
+            if (self._staged and self._staged[0] != txn
+                    and time.monotonic() - self._staged[3] < STAGE_TIMEOUT_SECONDS):
+                raise ShardConflict("another write is staged on this shard")
+            index = faiss.IndexFlatL2(embeddings.shape[1])
+            if current.index is not None and current.index.ntotal:
+                index.add(current.index.reconstruct_n(0, current.index.ntotal))
+            index.add(embeddings)
+            generation = IndexGeneration(vectorizer if vectorizer is not None else current.vectorizer, index,
+                                         current.documents + chunks, current.metadata + metadata)
+            self._staged = (txn, generation, expected, time.monotonic())
+            return len(generation.documents)
+
+    def commit(self, txn: str) -> int:
+        with self._write_lock:
+            if not self._staged or self._staged[0] != txn or len(self._generation.documents) != self._staged[2]:
+                raise RuntimeError(f"no staged write {txn} to commit")
+            generation = self._staged[1]
+            self._committed = (txn, self._generation, generation)
+            self._staged = None
+            self._publish(generation)
+            return len(generation.documents)
+
+    def abort(self, txn: str):
+        with self._write_lock:
+            if self._staged and self._staged[0] == txn:
+                self._staged = None
+
+    def rollback(self, txn: str) -> int:
+        """Republish the generation from before commit(txn), unless another write followed it."""
+        with self._write_lock:
+            if self._committed and self._committed[0] == txn and self._generation is self._committed[2]:
+                self._publish(self._committed[1])
+                self._committed = None
+            return len(self._generation.documents)
+
+    def search_local(self, embeddings: np.ndarray, n_results: int, where: Optional[Dict[str, Any]]) -> List[list]:
+        """Per query row, (local id, distance, chunk, metadata) for the shard's top n_results."""
+        generation = self._generation
+        if not generation.documents:
+            return [[] for _ in range(len(embeddings))]
+        distances, indices = generation.search_vectors(embeddings, n_results, where)
+        return [
+            [(int(idx), float(dist), generation.documents[idx], generation.metadata[idx])
+             for idx, dist in zip(row_indices, row_distances) if idx >= 0]
+            for row_indices, row_distances in zip(indices, distances)
+        ]
+
+    def get_local(self, ids: List[int]) -> List[tuple]:
+        generation = self._generation
+        return [(idx, generation.documents[idx], generation.metadata[idx])
+                for idx in ids if 0 <= idx < len(generation.documents)]
+
+    def get_refs(self, refs: List[str]) -> List[tuple]:
+        """(ref, local id, chunk, metadata) for every ref this shard holds."""
+        generation = self._generation
+        positions = generation.ref_positions()
+        return [(ref, positions[ref], generation.documents[positions[ref]], generation.metadata[positions[ref]])
+                for ref in refs if ref in positions]
+
+
+def _serve_connection(shard: ShardIndex, conn, data_dir: Optional[str]):
+    handlers = {
+        "stage": shard.stage,
+        "commit": shard.commit,
+        "abort": shard.abort,
+        "rollback": shard.rollback,
+        # Read at call time: the property follows the published generation
+        "vectorizer": lambda: shard.vectorizer,
+        "search": shard.search_local,
+        "get": shard.get_local,
+        "get_refs": shard.get_refs,
+        "count": shard.count,
+        "save": lambda: shard.save(data_dir) if data_dir else None,
+        "load": lambda: shard.reload(data_dir)["documents"] if data_dir and shard.snapshot_exists(data_dir) else shard.count()
+    }
+    try:
+        while True:
+            try:
+                op, args = conn.recv()
+            except EOFError:
+                break
+            try:
+                conn.send(("ok", handlers[op](*args)))
+            except ValueError as e:
+                # Bad requests (e.g. an unsupported filter) are the caller's error, not the shard's
+                conn.send(("invalid", str(e)))
+            except ShardConflict as e:
+                conn.send(("conflict", str(e)))
+            except Exception as e:
+                conn.send(("error", f"{op} failed: {str(e)}"))
+    finally:
+        conn.close()
+
+
+def serve_shard(address: Tuple[str, int], authkey: bytes, data_dir: Optional[str] = None, ready=None):
+    """
+    Run a shard server until the process exits.
+
+    Every accepted connection is served on its own thread, so one slow
+    request does not hold up the coordinator's other calls.
+
+    Args:
+        address (Tuple[str, int]): Host and port to listen on; port 0 picks a free one
+        authkey (bytes): Shared secret; connections that fail the handshake are dropped
+        data_dir (str, optional): Where the shard's snapshot is saved and loaded from
+        ready (Connection, optional): Receives the bound address once listening
+    """
+    shard = ShardIndex(Config())
+    if data_dir and shard.snapshot_exists(data_dir):
+        shard.load(data_dir)
+    listener = Listener(address, authkey=authkey)
+    if ready is not None:
+        ready.send(listener.address)
+        ready.close()
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            print(f"Error accepting shard connection: {str(e)}")
+            continue
+        threading.Thread(target=_serve_connection, args=(shard, conn, data_dir), daemon=True).start()
+
+
+class ShardClient:
+    """RPC client for one shard, with a pool of idle connections."""
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._idle = queue.LifoQueue()
+
+    def call(self, op: str, *args, timeout: Optional[float] = None):
+        """
+        Send one request and wait for its reply.
+
+        A connection whose reply did not arrive within timeout is closed,
+        never reused, so a late answer cannot be read by the next call.
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = Client(self.address, authkey=self.authkey)
+        try:
+            conn.send((op, args))
+            if not conn.poll(timeout):
+                raise TimeoutError(f"Shard {self.address[0]}:{self.address[1]} did not answer {op} within {timeout}s")
+            status, value = conn.recv()
+        except Exception:
+            conn.close()
+            raise
+        self._idle.put(conn)
+        if status == "invalid":
+            raise ValueError(value)
+        if status == "conflict":
+            raise ShardConflict(value)
+        if status != "ok":
+            raise RuntimeError(value)
+        return value
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ShardedVectorDatabase:
+    """
+    Scatter-gather front end over N shard servers, with the same search
+    interface as VectorDatabase.
+
+    The coordinator holds only the TF-IDF vectorizer; chunk text, metadata
+    and vectors live on the shards. Chunk g goes to shard g % N at local
+    position g // N, so global ids need no lookup table. Queries are
+    embedded once, fanned out in parallel, and the per-shard top-k lists
+    are merged by distance. A shard that errors or misses
+    VECTOR_SHARD_TIMEOUT_SECONDS is left out and the result is marked
+    partial instead of failing the request.
+
+    The shards, not the coordinator, are the source of truth for what the
+    index holds, so several API workers can each run a coordinator over
+    the same shards. add_documents() allocates ids from the counts the
+    shards report, stages the write on every shard it touches and commits
+    only once all have staged; a shard that changed in between makes the
+    whole write retry, and a failed commit rolls the others back.
+
+    The vocabulary is fit on the first add_documents batch and then kept,
+    since re-fitting would mean re-embedding every shard. It is stored
+    with shard 0, where other coordinators pick it up.
+    """
+
+    def __init__(self, config: Config, addresses: Optional[List[str]] = None):
+        self.config = config
+        self.timeout = config.vector_shard_timeout_seconds
+        self.vectorizer = None
+        self.generation_id = "empty"
+        self._count = 0
+        self._write_lock = threading.Lock()
+        self._processes = []
+
+        addresses = addresses or config.vector_shard_addresses
+        if addresses:
+            if not config.vector_shard_authkey:
+                raise ValueError("VECTOR_SHARD_AUTHKEY must be set to use remote vector shards")
+            authkey = config.vector_shard_authkey.encode('utf-8')
+            endpoints = [parse_address(address) for address in addresses]
+        else:
+            authkey = (config.vector_shard_authkey or '').encode('utf-8') or os.urandom(16)
+            endpoints = self._spawn_local_shards(config.vector_local_shards, authkey)
+        self.shards = [ShardClient(endpoint, authkey) for endpoint in endpoints]
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(self.shards), thread_name_prefix="vector-shard")
+
+    def _spawn_local_shards(self, count: int, authkey: bytes) -> List[Tuple[str, int]]:
+        """Start shard servers as child processes, each persisting under VECTOR_SHARD_DIR/shard-<i>."""
+        context = multiprocessing.get_context('spawn')
+        endpoints = []
+        for i in range(count):
+            receiver, sender = context.Pipe(duplex=False)
+            data_dir = os.path.join(self.config.vector_shard_dir, f"shard-{i}")
+            os.makedirs(data_dir, exist_ok=True)
+            process = context.Process(target=serve_shard, args=(('127.0.0.1', 0), authkey, data_dir, sender),
+                                      name=f"vector-shard-{i}", daemon=True)
+            process.start()
+            sender.close()
+            endpoints.append(receiver.recv())
+            self._processes.append(process)
+        return endpoints
+
+    def count(self) -> int:
+        """Chunks held by the shards; the last known count if some are unreachable."""
+        counts, failures = self._scatter("count", timeout=self.timeout)
+        if not failures:
+            self._count = sum(counts)
+        return self._count
+
+    def _shard_counts(self) -> List[int]:
+        """Per-shard chunk counts; raises if any shard is unreachable."""
+        counts, failures = self._scatter("count", timeout=self.timeout)
+        if failures:
+            raise RuntimeError(f"{len(failures)} vector shards are unreachable")
+        return counts
+
+    @staticmethod
+    def _in_layout(counts: List[int]) -> bool:
+        """Whether the counts fit the round-robin layout, i.e. no write is half committed."""
+        total, num_shards = sum(counts), len(counts)
+        return counts == [(total - number + num_shards - 1) // num_shards for number in range(num_shards)]
+
+    def _fetch_vectorizer(self):
+        """The vectorizer stored with shard 0 by whichever coordinator fit it."""
+        if self.vectorizer is None:
+            self.vectorizer = self.shards[0].call("vectorizer", timeout=self.timeout)
+        return self.vectorizer
+
+    def _call_all(self, op: str, numbers: List[int], *args) -> Dict[int, Exception]:
+        """Call op(txn...) on the given shards in parallel; the exception of each that failed."""
+        futures = {number: self._executor.submit(self.shards[number].call, op, *args, timeout=None)
+                   for number in numbers}
+        errors = {}
+        for number, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                errors[number] = e
+        return errors
+
+    def generation_info(self) -> Dict[str, Any]:
+        return {"generation": self.generation_id, "documents": self._count, "shards": len(self.shards)}
+
+    def _scatter(self, op: str, *args, timeout: Optional[float]) -> Tuple[List[Any], List[Dict[str, Any]]]:
+        """Call op on every shard in parallel; (per-shard results or None, failures)."""
+        futures = [self._executor.submit(shard.call, op, *args, timeout=timeout) for shard in self.shards]
+        wait(futures, timeout=timeout)
+        results, failures = [], []
+        for number, future in enumerate(futures):
+            try:
+                if not future.done():
+                    raise TimeoutError(f"no reply within {timeout}s")
+                results.append(future.result())
+            except ValueError:
+                raise
+            except Exception as e:
+                print(f"Error calling vector shard {number} ({op}): {str(e) or type(e).__name__}")
+                failures.append({"shard": number, "error": str(e) or type(e).__name__})
+                results.append(None)
+        return results, failures
+
+    def add_documents(self, chunks: List[str], metadata: List[Dict[str, Any]] = None):
+        """
+        Embed chunks and distribute them across the shards.
+
+        Args:
+            chunks (List[str]): List of text chunks
+            metadata (List[Dict[str, Any]], optional): List of metadata for each chunk
+        """
+        if metadata is None:
+            metadata = [{"source": "unknown"} for _ in chunks]
+        if not chunks:
+            return
+
+        num_shards = len(self.shards)
+        with self._write_lock:
+            for attempt in range(ADD_ATTEMPTS):
+                counts = self._shard_counts()
+                if not self._in_layout(counts):
+                    # Another coordinator is between its commits; wait for it to finish
+                    if attempt == ADD_ATTEMPTS - 1:
+                        raise RuntimeError(f"Vector shards are out of step: they hold {counts} chunks")
+                    time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+                    continue
+                total = sum(counts)
+                vectorizer = self._fetch_vectorizer() if total else self.vectorizer
+                fitted = vectorizer is None
+                if fitted:
+                    vectorizer = TfidfVectorizer(max_features=1000, stop_words='english', ngram_range=(1, 2))
+                    vectorizer.fit(chunks)
+                embeddings = vectorizer.transform(chunks).toarray().astype('float32')
+
+                rows = [[] for _ in range(num_shards)]
+                for offset in range(len(chunks)):
+                    rows[(total + offset) % num_shards].append(offset)
+                participants = [number for number in range(num_shards) if rows[number]]
+                txn = uuid.uuid4().hex
+                # Stage everywhere first: nothing is visible until every shard accepted its part
+                futures = {
+                    number: self._executor.submit(
+                        self.shards[number].call, "stage", txn, counts[number], embeddings[rows[number]],
+                        [chunks[i] for i in rows[number]], [metadata[i] for i in rows[number]],
+                        vectorizer if fitted and number == 0 else None, timeout=None)
+                    for number in participants
+                }
+                errors = {}
+                for number, future in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors[number] = e
+                if errors:
+                    self._call_all("abort", participants, txn)
+                    if all(isinstance(e, ShardConflict) for e in errors.values()):
+                        # Another coordinator wrote first: re-read the counts and try again
+                        time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+                        continue
+                    raise RuntimeError(f"Vector shard write failed: {next(iter(errors.values()))}")
+
+                failed = self._call_all("commit", participants, txn)
+                if failed:
+                    self._call_all("abort", sorted(failed), txn)
+                    self._call_all("rollback", [n for n in participants if n not in failed], txn)
+                    raise RuntimeError(f"Vector shard commit failed on shards {sorted(failed)}; the write was rolled back")
+
+                self.vectorizer = vectorizer
+                self._count = total + len(chunks)
+                self.generation_id = new_generation_id()
+                break
+            else:
+                raise RuntimeError("Vector shards stayed busy with other writers; the write was not applied")
+
+        if self.config.debug_mode:
+            print(f"Added {len(chunks)} chunks across {num_shards} vector shards")
+
+    def search_batch(self,
+                     queries: List[str],
+                     n_results: int = 5,
+                     where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Search all shards for many queries with one embedding pass and one round trip per shard.
+
+        Returns:
+            List[Dict[str, Any]]: One result dict per query, shaped like
+                VectorDatabase.search(); when shards were left out, each also
+                has 'partial': True and 'failed_shards'
+        """
+        vectorizer = self.vectorizer
+        if vectorizer is None and queries:
+            # Another coordinator may have filled the shards since this one started
+            try:
+                vectorizer = self._fetch_vectorizer()
+            except Exception as e:
+                print(f"Error fetching the vectorizer from vector shard 0: {str(e)}")
+        if not queries or vectorizer is None:
+            return [{'documents': [], 'metadatas': [], 'distances': [], 'ids': [], 'refs': []} for _ in queries]
+
+        embeddings = vectorizer.transform(queries).toarray().astype('float32')
+        shard_rows, failures = self._scatter("search", embeddings, n_results, where, timeout=self.timeout)
+
+        num_shards = len(self.shards)
+        results = []
+        for row in range(len(queries)):
+            hits = [
+                (dist, number + local * num_shards, doc, meta)
+                for number, rows in enumerate(shard_rows) if rows is not None
+                for local, dist, doc, meta in rows[row]
+            ]
+            top = heapq.nsmallest(n_results, hits, key=lambda hit: (hit[0], hit[1]))
+            result = {
+                'documents': [hit[2] for hit in top],
+                'metadatas': [hit[3] for hit in top],
+                'distances': [hit[0] for hit in top],
+                'ids': [hit[1] for hit in top],
+                'refs': [chunk_ref(hit[2]) for hit in top]
+            }
+            if failures:
+                result['partial'] = True
+                result['failed_shards'] = [failure["shard"] for failure in failures]
+            results.append(result)
+        return results
+
+    def search(self, query: str, n_results: int = 5, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Search all shards and merge the global top n_results, shaped like VectorDatabase.search()."""
+        return self.search_batch([query], n_results=n_results, where=where)[0]
+
+    def get_chunks(self, refs: List[Any]) -> Dict[str, Any]:
+        """
+        Chunks by chunk_ref (or legacy global id), skipping unknown ones and
+        ones on unreachable shards. A ref can be on any shard, so refs are
+        looked up on all of them.
+        """
+        num_shards = len(self.shards)
+        # Shards drop ids past their end themselves; the local count may lag other coordinators
+        positional = [ref for ref in refs if isinstance(ref, int) and ref >= 0]
+        keys = [ref for ref in refs if isinstance(ref, str)]
+        by_shard = {}
+        for idx in positional:
+            by_shard.setdefault(idx % num_shards, []).append(idx // num_shards)
+        calls = [(number, "get", local_ids) for number, local_ids in by_shard.items()]
+        if keys:
+            calls.extend((number, "get_refs", keys) for number in range(num_shards))
+        futures = [(number, op, self._executor.submit(self.shards[number].call, op, args, timeout=self.timeout))
+                   for number, op, args in calls]
+        found = {}
+        for number, op, future in futures:
+            try:
+                for row in future.result():
+                    if op == "get_refs":
+                        key, local, doc, meta = row
+                    else:
+                        local, doc, meta = row
+                        key = number + local * num_shards
+                    found[key] = (number + local * num_shards, doc, meta)
+            except Exception as e:
+                print(f"Error fetching chunks from vector shard {number}: {str(e)}")
+        hits = [found[ref] for ref in refs if isinstance(ref, (int, str)) and ref in found]
+        return {
+            'documents': [hit[1] for hit in hits],
+            'metadatas': [hit[2] for hit in hits],
+            'distances': [],
+            'ids': [hit[0] for hit in hits],
+            'refs': [chunk_ref(hit[1]) for hit in hits]
+        }
+
+    @staticmethod
+    def snapshot_exists(path: str = "vector_db") -> bool:
+        return os.path.exists(os.path.join(path, COORDINATOR_FILE))
+
+    def save(self, path: str = "vector_db"):
+        """Have every shard save its partition, then publish the coordinator state."""
+        with self._write_lock:
+            if self.vectorizer is None:
+                return
+            _, failures = self._scatter("save", timeout=None)
+            if failures:
+                raise RuntimeError(f"{len(failures)} vector shards failed to save")
+            os.makedirs(path, exist_ok=True)
+            state = {"vectorizer": self.vectorizer, "shards": len(self.shards),
+                     "count": self._count, "generation": self.generation_id, "saved_at": time.time()}
+            staging = os.path.join(path, COORDINATOR_FILE + ".tmp")
+            with open(staging, "wb") as f:
+                pickle.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(staging, os.path.join(path, COORDINATOR_FILE))
+
+    def load(self, path: str = "vector_db"):
+        """Load the coordinator state and have every shard load its saved partition."""
+        with open(os.path.join(path, COORDINATOR_FILE), "rb") as f:
+            state = pickle.load(f)
+        if state["shards"] != len(self.shards):
+            raise ValueError(f"Snapshot has {state['shards']} shards, {len(self.shards)} are configured")
+        with self._write_lock:
+            counts, failures = self._scatter("load", timeout=None)
+            if failures:
+                raise RuntimeError(f"{len(failures)} vector shards failed to load")
+            if sum(counts) != state["count"]:
+                raise ValueError(f"Shards hold {sum(counts)} chunks, the snapshot expects {state['count']}")
+            self.vectorizer = state["vectorizer"]
+            self._count = state["count"]
+            self.generation_id = state["generation"]
+
+    def reload(self, path: str = "vector_db") -> Dict[str, Any]:
+        """Reload the published snapshot on every shard and swap in its vectorizer."""
+        started = time.monotonic()
+        self.load(path)
+        return {"reloaded": True, "load_seconds": round(time.monotonic() - started, 3), **self.generation_info()}
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        for process in self._processes:
+            process.terminate()
+        self._executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve one partition of the sharded vector index")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--data-dir", help="Directory the shard saves its snapshot to and loads it from")
+    options = parser.parse_args()
+    shard_config = Config()
+    if not shard_config.vector_shard_authkey:
+        raise SystemExit("VECTOR_SHARD_AUTHKEY must be set")
+    print(f"Serving vector shard on {options.host}:{options.port}")
+    serve_shard((options.host, options.port), shard_config.vector_shard_authkey.encode('utf-8'), options.data_dir)
@@ -0,0 +1,267 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+from sklearn.feature_extraction.text import TfidfVectorizer
+from .vector_db import VectorDatabase
+from .document_processor import DocumentProcessor
+from .dedup import create_deduplicator, dedupe_chunks, new_report
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; ingest is then only serialized within one process
+    fcntl = None
+
+TENANT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+INGEST_LOCK_FILE = ".ingest.lock"
+# MinHash signatures of the namespace's chunks, saved next to its snapshot
+SIGNATURES_FILE = "dedup_signatures.npz"
+
+def validate_tenant_id(tenant_id: str) -> str:
+    """Tenant ids become directory names, so only allow a safe character set."""
+    if not TENANT_ID_PATTERN.match(tenant_id or ''):
+        raise ValueError("tenant_id must be 1-64 letters, digits, '-' or '_'")
+    return tenant_id
+
+
+def rerank(query: str, hits: List[tuple]) -> List[tuple]:
+    """
+    (distance, ...) hits with distances recomputed in a single TF-IDF space.
+
+    The space is fit on the query and the candidates with the indexes'
+    analyzer settings, so terms only one corpus knows still count. The
+    distance is squared L2 between normalized rows, like the indexes'.
+    """
+    vectorizer = TfidfVectorizer(stop_words='english', ngram_range=(1, 2))
+    try:
+        matrix = vectorizer.fit_transform([query] + [hit[1] for hit in hits])
+    except ValueError:
+        # Nothing but stop words: no space to compare in, keep the index distances
+        return hits
+    similarities = (matrix[1:] @ matrix[0].T).toarray().ravel()
+    return [(float(2.0 - 2.0 * similarity),) + tuple(hit[1:]) for hit, similarity in zip(hits, similarities)]
+
+
+class TenantKnowledgeBase:
+    """
+    Per-tenant document indexes next to the shared Study_Materials corpus.
+
+    Each tenant has its own VectorDatabase saved under
+    TENANT_KB_DIR/<tenant_id>. Namespaces are loaded on first use and kept
+    in an LRU cache bounded by TENANT_CACHE_MAX_NAMESPACES and
+    TENANT_CACHE_MAX_MB, so a worker only holds the tenants it is serving.
+    Uploads may be ingested by any worker: ingest holds a file lock on the
+    namespace, and cached namespaces are checked against the published
+    snapshot at most every INDEX_WATCH_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, config, shared: VectorDatabase):
+        self.config = config
+        self.shared = shared
+        self.root = config.tenant_kb_dir
+        self.max_namespaces = config.tenant_cache_max_namespaces
+        self.max_bytes = int(config.tenant_cache_max_mb * 1024 * 1024)
+        self.check_interval = config.index_watch_interval_seconds
+        self._cache = OrderedDict()
+        self._sizes = {}
+        # tenant_id -> monotonic time after which the cached namespace is checked against disk
+        self._next_check = {}
+        self._lock = threading.Lock()
+        self._ingest_locks = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    def namespace_path(self, tenant_id: str) -> str:
+        return os.path.join(self.root, validate_tenant_id(tenant_id))
+
+    @staticmethod
+    def _estimate_bytes(vector_db: VectorDatabase) -> int:
+        """Rough resident size: float32 vectors plus the chunk text."""
+        vectors = vector_db.index.ntotal * vector_db.index.d * 4 if vector_db.index is not None else 0
+        return vectors + sum(len(doc) for doc in vector_db.documents)
+
+    def _cache_put(self, tenant_id: str, vector_db: VectorDatabase):
+        with self._lock:
+            self._cache[tenant_id] = vector_db
+            self._cache.move_to_end(tenant_id)
+            self._sizes[tenant_id] = self._estimate_bytes(vector_db)
+            self._next_check[tenant_id] = time.monotonic() + self.check_interval
+            # Evict least recently used namespaces, never the one just added
+            while len(self._cache) > 1 and (len(self._cache) > self.max_namespaces
+                                            or sum(self._sizes.values()) > self.max_bytes):
+                evicted, _ = self._cache.popitem(last=False)
+                self._sizes.pop(evicted, None)
+                self._next_check.pop(evicted, None)
+                if self.config.debug_mode:
+                    print(f"Evicted tenant namespace {evicted}")
+
+    def _is_current(self, tenant_id: str, vector_db: VectorDatabase) -> bool:
+        """Whether the cached namespace is still the snapshot published on disk."""
+        manifest = VectorDatabase.read_manifest(self.namespace_path(tenant_id))
+        return manifest is None or manifest["generation"] == vector_db.generation_info()["generation"]
+
+    def get_namespace(self, tenant_id: str, fresh: bool = False) -> Optional[VectorDatabase]:
+        """
+        The tenant's index, loading it from disk on a cache miss; None if it has no documents.
+
+        A cached namespace another worker has since re-published is loaded
+        again; fresh=True checks for that now instead of on the usual interval.
+        """
+        with self._lock:
+            cached = self._cache.get(tenant_id)
+            if cached is not None:
+                self._cache.move_to_end(tenant_id)
+                due = fresh or time.monotonic() >= self._next_check.get(tenant_id, 0.0)
+                if due:
+                    self._next_check[tenant_id] = time.monotonic() + self.check_interval
+        if cached is not None and (not due or self._is_current(tenant_id, cached)):
+            return cached
+
+        path = self.namespace_path(tenant_id)
+        if not VectorDatabase.snapshot_exists(path):
+            return None
+        vector_db = VectorDatabase(self.config)
+        try:
+            vector_db.load(path)
+        except Exception as e:
+            print(f"Error loading tenant namespace {tenant_id}: {str(e)}")
+            return None
+        self._cache_put(tenant_id, vector_db)
+        return vector_db
+
+    @contextmanager
+    def _ingest_lock(self, tenant_id: str):
+        """Serialize ingests of one namespace across threads and, via flock, across workers."""
+        with self._lock:
+            thread_lock = self._ingest_locks.setdefault(tenant_id, threading.Lock())
+        with thread_lock:
+            if fcntl is None:
+                yield
+                return
+            path = self.namespace_path(tenant_id)
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, INGEST_LOCK_FILE), 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def ingest(self, tenant_id: str, file_path: str, source: str) -> Dict[str, Any]:
+        """
+        Chunk a document into the tenant's namespace.
+
+        The namespace is re-fit over all of its chunks so every vector
+        shares one vocabulary; tenant corpora are small enough for this.
+        Chunks that near-duplicate ones already in the namespace are dropped;
+        the namespace's signatures are saved with it, so only the new chunks
+        are signed.
+
+        Returns:
+            Dict[str, Any]: Dedup report; "kept" is the number of chunks added
+        """
+        validate_tenant_id(tenant_id)
+        chunks = DocumentProcessor(self.config).process_document(file_path)
+
+        with self._ingest_lock(tenant_id):
+            # Another worker may have published since this one cached the namespace
+            current = self.get_namespace(tenant_id, fresh=True)
+            # Dedup records also_in on matched entries; work on copies so the
+            # cached, published generation is never mutated in place
+            existing_metadata = [dict(meta) for meta in current.metadata] if current else []
+            new_metadata = [{"source": source} for _ in chunks]
+            report = new_report()
+            report["input"] = report["kept"] = len(chunks)
+            path = self.namespace_path(tenant_id)
+            signatures_path = os.path.join(path, SIGNATURES_FILE)
+            deduplicator = create_deduplicator(self.config)
+            if deduplicator:
+                # Signatures missing or saved for another generation: sign the namespace again
+                if current and not deduplicator.load(signatures_path, current.generation_info()["generation"],
+                                                     existing_metadata):
+                    for doc, meta in zip(current.documents, existing_metadata):
+                        deduplicator.add(meta, deduplicator.signature(doc))
+                chunks, new_metadata, report = dedupe_chunks(chunks, new_metadata, deduplicator)
+            if not chunks:
+                return report
+
+            documents = (current.documents if current else []) + chunks
+            metadata = existing_metadata + new_metadata
+
+            vector_db = VectorDatabase(self.config)
+            vector_db.add_documents(documents, metadata)
+            os.makedirs(path, exist_ok=True)
+            vector_db.save(path)
+            if deduplicator:
+                try:
+                    deduplicator.save(signatures_path, vector_db.generation_info()["generation"])
+                except Exception as e:
+                    print(f"Error saving dedup signatures: {str(e)}")
+            self._cache_put(tenant_id, vector_db)
+        return report
+
+    def search(self,
+               tenant_id: Optional[str],
+               query: str,
+               n_results: int = 5,
+               shared_results: Optional[Dict[str, Any]] = None,
+               where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Search the shared corpus and the tenant's namespace together.
+
+        Each index has its own TF-IDF vocabulary, so their distances are not
+        comparable. When the tenant contributes hits, every candidate is
+        re-scored in one space fit on the query and the candidates, and the
+        top n_results are merged by that distance. Tenant hits have no
+        shared chunk id; their `ids` and `refs` entries are None and their
+        metadata carries the namespace.
+
+        Args:
+            tenant_id (str, optional): Tenant namespace to include, None for shared only
+            query (str): Search query
+            n_results (int): Number of merged results
+            shared_results (Dict[str, Any], optional): Shared-corpus results already
+                computed for this query (e.g. by search_batch)
+            where (Dict[str, Any], optional): Metadata filter applied to both indexes
+        """
+        if shared_results is None:
+            shared_results = self.shared.search(query, n_results=n_results, where=where)
+        results = shared_results
+        refs = results.get('refs') or [None for _ in results['documents']]
+        hits = [
+            (dist, doc, dict(meta, namespace="shared"), idx, ref)
+            for doc, meta, dist, idx, ref in zip(results['documents'], results['metadatas'],
+                                                 results['distances'], results['ids'], refs)
+        ]
+
+        namespace = self.get_namespace(tenant_id) if tenant_id else None
+        if namespace is not None:
+            tenant_results = namespace.search(query, n_results=n_results, where=where)
+            hits.extend(
+                (dist, doc, dict(meta, namespace=tenant_id), None, None)
+                for doc, meta, dist in zip(tenant_results['documents'], tenant_results['metadatas'],
+                                           tenant_results['distances'])
+            )
+
+            hits = rerank(query, hits)
+
+        hits.sort(key=lambda hit: hit[0])
+        hits = hits[:n_results]
+        return {
+            'documents': [hit[1] for hit in hits],
+            'metadatas': [hit[2] for hit in hits],
+            'distances': [hit[0] for hit in hits],
+            'ids': [hit[3] for hit in hits],
+            'refs': [hit[4] for hit in hits]
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loaded_namespaces": len(self._cache),
+                "loaded_bytes": sum(self._sizes.values()),
+                "max_namespaces": self.max_namespaces,
+                "max_bytes": self.max_bytes
+            }
@@ -1,120 +1,571 @@
 import faiss
 import numpy as np
+from bisect import bisect_left, bisect_right
 from sklearn.feature_extraction.text import TfidfVectorizer
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import os
+import json
+import hashlib
+import time
+import shutil
 import pickle
+import threading
+import itertools
 from .config import Config
+from .query_featurizer import featurizer_for
+
+RANGE_OPERATORS = ('$gt', '$gte', '$lt', '$lte')
+MANIFEST_FILE = "MANIFEST.json"
+SNAPSHOT_FILES = ("index.faiss", "vectorizer.pkl", "documents.pkl", "metadata.pkl")
+
+_generation_counter = itertools.count()
+
+
+def chunk_ref(document: str) -> str:
+    """
+    Stable reference to a chunk: a hash of its text.
+
+    Positional ids change whenever the index is rebuilt, deduplicated or
+    resharded; a ref keeps naming the same text, so stored plans and chat
+    turns can find their chunks in any later generation.
+    """
+    return hashlib.sha1(document.encode('utf-8')).hexdigest()[:16]
+
+
+def new_generation_id() -> str:
+    return f"{int(time.time() * 1000)}-{os.getpid()}-{next(_generation_counter)}"
+
+
+def _filter_value(field: str, op: str, value: Any) -> Any:
+    """A filter operand usable as a bitmap key; unhashable values are a bad request."""
+    try:
+        hash(value)
+    except TypeError:
+        raise ValueError(f"Filter {op} on '{field}' needs a scalar value, not {type(value).__name__}")
+    return value
+
+
+class IndexGeneration:
+    """
+    One immutable version of the index: vectorizer, FAISS index, chunks
+    and metadata, plus the filter indexes derived from them.
+
+    A generation is never modified after it is published. Writers build
+    a new one and swap it in, so a search that already picked up a
+    generation finishes on it while the next one goes live.
+    """
+
+    def __init__(self, vectorizer, index, documents: List[str], metadata: List[Dict[str, Any]],
+                 generation_id: str = None):
+        self.vectorizer = vectorizer
+        self.index = index
+        self.documents = documents
+        self.metadata = metadata
+        self.generation_id = generation_id or new_generation_id()
+        # Per-field filter indexes, built on first use:
+        # field -> {value: bool id bitmap}, and field -> (sorted values, ids) for ranges
+        self._bitmaps = {}
+        self._sorted_values = {}
+        # Query featurizer compiled from the vectorizer on first search; False when unsupported
+        self._featurizer = None
+        # chunk_ref -> position, built on first lookup by ref
+        self._ref_positions = None
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        float32 query vectors, identical to vectorizer.transform(queries).
+
+        A single query is embedded into the calling thread's reusable
+        buffer, which is only valid until that thread's next search.
+        """
+        featurizer = self._featurizer
+        if featurizer is None:
+            featurizer = self._featurizer = featurizer_for(self.vectorizer) or False
+        if featurizer is False:
+            return self.vectorizer.transform(queries).toarray().astype('float32')
+        if len(queries) == 1:
+            return featurizer.embed(queries[0])
+        return featurizer.transform(queries)
+
+    def ref_positions(self) -> Dict[str, int]:
+        """Position of every chunk by its chunk_ref (the first one for repeated text)."""
+        positions = self._ref_positions
+        if positions is None:
+            positions = {}
+            for idx, document in enumerate(self.documents):
+                positions.setdefault(chunk_ref(document), idx)
+            self._ref_positions = positions
+        return positions
+
+    def field_bitmaps(self, field: str) -> Dict[Any, np.ndarray]:
+        """value -> bitmap of chunk ids whose metadata[field] equals or contains value."""
+        bitmaps = self._bitmaps.get(field)
+        if bitmaps is None:
+            bitmaps = {}
+            total = len(self.metadata)
+            for idx, meta in enumerate(self.metadata):
+                value = meta.get(field)
+                for item in (value if isinstance(value, (list, tuple, set)) else [value]):
+                    if item is None or isinstance(item, (dict, list)):
+                        continue
+                    if item not in bitmaps:
+                        bitmaps[item] = np.zeros(total, dtype=bool)
+                    bitmaps[item][idx] = True
+            self._bitmaps[field] = bitmaps
+        return bitmaps
+
+    def field_sorted(self, field: str):
+        """Scalar values of a field in sorted order, with their chunk ids, for range filters."""
+        entry = self._sorted_values.get(field)
+        if entry is None:
+            pairs = sorted(
+                (meta[field], idx) for idx, meta in enumerate(self.metadata)
+                if isinstance(meta.get(field), (int, float, str)) and not isinstance(meta.get(field), bool)
+            )
+            entry = ([value for value, _ in pairs], np.array([idx for _, idx in pairs], dtype=np.int64))
+            self._sorted_values[field] = entry
+        return entry
+
+    def filter_mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """
+        Bitmap of chunk ids matching every condition in `where`.
+
+        Conditions per field: a plain value (equality), or a dict with
+        $eq, $in, $contains (list-valued fields) and $gt/$gte/$lt/$lte.
+        Range bounds must be comparable with the stored values (numbers,
+        or ISO-8601 strings for timestamps).
+        """
+        if not isinstance(where, dict):
+            raise ValueError("Filter must be an object of field conditions")
+        total = len(self.metadata)
+        empty = np.zeros(total, dtype=bool)
+        mask = np.ones(total, dtype=bool)
+        for field, condition in where.items():
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            bitmaps = self.field_bitmaps(field)
+            for op, operand in condition.items():
+                if op in ('$eq', '$contains'):
+                    mask &= bitmaps.get(_filter_value(field, op, operand), empty)
+                elif op == '$in':
+                    if not isinstance(operand, (list, tuple)):
+                        raise ValueError(f"Filter $in on '{field}' needs a list of values")
+                    selected = np.zeros(total, dtype=bool)
+                    for value in operand:
+                        selected |= bitmaps.get(_filter_value(field, op, value), empty)
+                    mask &= selected
+                elif op in RANGE_OPERATORS:
+                    if isinstance(operand, bool) or not isinstance(operand, (int, float, str)):
+                        raise ValueError(f"Filter {op} on '{field}' needs a number or a string")
+                    values, ids = self.field_sorted(field)
+                    try:
+                        if op == '$gt':
+                            matched = ids[bisect_right(values, operand):]
+                        elif op == '$gte':
+                            matched = ids[bisect_left(values, operand):]
+                        elif op == '$lt':
+                            matched = ids[:bisect_left(values, operand)]
+                        else:
+                            matched = ids[:bisect_right(values, operand)]
+                    except TypeError:
+                        raise ValueError(f"Range filter on '{field}' is not comparable with its values")
+                    selected = np.zeros(total, dtype=bool)
+                    selected[matched] = True
+                    mask &= selected
+                else:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+        return mask
+
+    def search_vectors(self, embeddings: np.ndarray, n_results: int, where: Optional[Dict[str, Any]]):
+        """FAISS search, restricted to the chunks matching `where` via an ID selector."""
+        if not where:
+            return self.index.search(embeddings, n_results)
+        mask = self.filter_mask(where)
+        if not mask.any():
+            rows = embeddings.shape[0]
+            return np.zeros((rows, 0), dtype='float32'), np.zeros((rows, 0), dtype='int64')
+        # Only matching ids are scored, so a filter never costs more than a full scan
+        packed = np.packbits(mask, bitorder='little')
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(packed))
+        return self.index.search(embeddings, n_results, params=faiss.SearchParameters(sel=selector))
+
 
 class VectorDatabase:
+    """
+    TF-IDF + FAISS index with read-copy-update reloads.
+
+    Readers take the current IndexGeneration once per call and never lock.
+    Writers (add_documents, load, reload) build a complete generation off
+    to the side and publish it with a single reference swap. Snapshots
+    are saved under generations/<id>/ and published by atomically
+    replacing MANIFEST.json, so nobody ever loads a half-written index.
+    """
+
     def __init__(self, config: Config):
         self.config = config
-        # Initialize TF-IDF vectorizer
-        self.vectorizer = TfidfVectorizer(
-            max_features=1000,
-            stop_words='english',
-            ngram_range=(1, 2)  # Use both unigrams and bigrams
-        )
-        
+
         # Initialize FAISS index
         self.dimension = 1000  # Dimension for TF-IDF vectors
-        self.index = None  # Will be initialized when we add documents
-        
-        # Store documents and metadata
-        self.documents = []
-        self.metadata = []
-        
+
+        # The published generation; its index is created when we add documents
+        self._generation = IndexGeneration(self._new_vectorizer(), None, [], [], generation_id="empty")
+        self._write_lock = threading.Lock()
+        self.keep_generations = config.index_keep_generations
+
         # Create directory for persistence
         os.makedirs("vector_db", exist_ok=True)
-    
+
+    def _new_vectorizer(self) -> TfidfVectorizer:
+        # Initialize TF-IDF vectorizer
+        return TfidfVectorizer(
+            max_features=self.dimension,
+            stop_words='english',
+            ngram_range=(1, 2)  # Use both unigrams and bigrams
+        )
+
+    # Read-only views of the live generation, for callers that only need a snapshot
+    @property
+    def generation(self) -> IndexGeneration:
+        return self._generation
+
+    @property
+    def vectorizer(self):
+        return self._generation.vectorizer
+
+    @property
+    def index(self):
+        return self._generation.index
+
+    @property
+    def documents(self) -> List[str]:
+        return self._generation.documents
+
+    @property
+    def metadata(self) -> List[Dict[str, Any]]:
+        return self._generation.metadata
+
+    def _publish(self, generation: IndexGeneration):
+        # One reference assignment; searches already running keep the old generation
+        self._generation = generation
+        if self.config.debug_mode:
+            print(f"Published index generation {generation.generation_id} ({len(generation.documents)} chunks)")
+
     def add_documents(self, chunks: List[str], metadata: List[Dict[str, Any]] = None):
         """
         Add document chunks to the FAISS index.
-        
+
+        The vectorizer is re-fit over existing and new chunks together so
+        every vector in the new generation shares one vocabulary.
+
         Args:
             chunks (List[str]): List of text chunks
             metadata (List[Dict[str, Any]], optional): List of metadata for each chunk
         """
         if metadata is None:
             metadata = [{"source": "unknown"} for _ in chunks]
-            
-        # Generate TF-IDF embeddings
-        embeddings = self.vectorizer.fit_transform(chunks).toarray()
-        
-        # Initialize FAISS index if not already done
-        if self.index is None:
-            self.index = faiss.IndexFlatL2(embeddings.shape[1])
-        
-        # Add to FAISS index
-        self.index.add(embeddings.astype('float32'))
-        
-        # Store documents and metadata
-        self.documents.extend(chunks)
-        self.metadata.extend(metadata)
-        
+
+        with self._write_lock:
+            current = self._generation
+            documents = current.documents + list(chunks)
+
+            # Generate TF-IDF embeddings
+            vectorizer = self._new_vectorizer()
+            embeddings = vectorizer.fit_transform(documents).toarray()
+
+            # Build the FAISS index for the new generation
+            index = faiss.IndexFlatL2(embeddings.shape[1])
+            index.add(embeddings.astype('float32'))
+
+            self._publish(IndexGeneration(vectorizer, index, documents, current.metadata + list(metadata)))
+
         if self.config.debug_mode:
             print(f"Added {len(chunks)} chunks to FAISS index")
             print(f"Vector dimension: {embeddings.shape[1]}")
-    
-    def search(self, query: str, n_results: int = 5) -> Dict[str, Any]:
+
+    @staticmethod
+    def _results(generation: IndexGeneration, hits: List[tuple]) -> Dict[str, Any]:
+        return {
+            'documents': [generation.documents[idx] for idx, _ in hits],
+            'metadatas': [generation.metadata[idx] for idx, _ in hits],
+            'distances': [dist for _, dist in hits],
+            'ids': [idx for idx, _ in hits],
+            'refs': [chunk_ref(generation.documents[idx]) for idx, _ in hits]
+        }
+
+    def search(self, query: str, n_results: int = 5, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Search for relevant chunks in the FAISS index.
-        
+
         Args:
             query (str): Search query
             n_results (int): Number of results to return
-            
+            where (Dict[str, Any], optional): Metadata filter, e.g.
+                {"source": "Deep Work.pdf"} or {"source": {"$in": [...]}}
+
         Returns:
-            Dict[str, Any]: Dictionary containing relevant chunks and metadata
+            Dict[str, Any]: Dictionary containing relevant chunks, metadata,
+                distances, positional chunk ids and stable chunk refs
         """
-        if not self.documents:
-            return {'documents': [], 'metadatas': [], 'distances': []}
-            
+        # Pin one generation so a concurrent reload cannot mix two indexes
+        generation = self._generation
+        if not generation.documents:
+            return {'documents': [], 'metadatas': [], 'distances': [], 'ids': [], 'refs': []}
+
         # Generate query embedding
-        query_embedding = self.vectorizer.transform([query]).toarray()
-        
+        query_embedding = generation.embed_queries([query])
+
         # Search in FAISS index
-        distances, indices = self.index.search(
-            query_embedding.astype('float32'), 
-            n_results
+        distances, indices = generation.search_vectors(
+            query_embedding,
+            n_results,
+            where
         )
-        
-        # Prepare results
-        results = {
-            'documents': [self.documents[idx] for idx in indices[0]],
-            'metadatas': [self.metadata[idx] for idx in indices[0]],
-            'distances': distances[0].tolist()
-        }
-        
+
+        # FAISS pads with -1 when fewer than n_results chunks exist
+        hits = [(int(idx), float(dist)) for idx, dist in zip(indices[0], distances[0]) if idx >= 0]
+
+        return self._results(generation, hits)
+
+    def search_batch(self,
+                     queries: List[str],
+                     n_results: int = 5,
+                     where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Search for many queries with one vectorizer transform and one FAISS call.
+
+        Args:
+            queries (List[str]): Search queries
+            n_results (int): Number of results per query
+            where (Dict[str, Any], optional): Metadata filter applied to every query
+
+        Returns:
+            List[Dict[str, Any]]: One result dict per query, shaped like search()
+        """
+        generation = self._generation
+        if not generation.documents or not queries:
+            return [{'documents': [], 'metadatas': [], 'distances': [], 'ids': [], 'refs': []} for _ in queries]
+
+        query_embeddings = generation.embed_queries(queries)
+        distances, indices = generation.search_vectors(query_embeddings, n_results, where)
+
+        results = []
+        for row_indices, row_distances in zip(indices, distances):
+            hits = [(int(idx), float(dist)) for idx, dist in zip(row_indices, row_distances) if idx >= 0]
+            results.append(self._results(generation, hits))
         return results
-    
+
+    def get_chunks(self, refs: List[Any]) -> Dict[str, Any]:
+        """
+        Chunks by chunk_ref, shaped like search(), skipping ones no longer in the index.
+
+        Integer positional ids, as stored before refs existed, are still
+        accepted, but only name the right chunk if the index was not
+        rebuilt since.
+        """
+        generation = self._generation
+        positions = generation.ref_positions() if any(isinstance(ref, str) for ref in refs) else {}
+        ids = []
+        for ref in refs:
+            idx = positions.get(ref) if isinstance(ref, str) else ref
+            if isinstance(idx, int) and 0 <= idx < len(generation.documents):
+                ids.append(idx)
+        return {
+            'documents': [generation.documents[idx] for idx in ids],
+            'metadatas': [generation.metadata[idx] for idx in ids],
+            'distances': [],
+            'ids': ids,
+            'refs': [chunk_ref(generation.documents[idx]) for idx in ids]
+        }
+
+    def count(self) -> int:
+        return len(self._generation.documents)
+
+    def generation_info(self) -> Dict[str, Any]:
+        generation = self._generation
+        return {"generation": generation.generation_id, "documents": len(generation.documents)}
+
+    @staticmethod
+    def snapshot_exists(path: str = "vector_db") -> bool:
+        """Whether path holds a saved index, as a manifest or in the older flat layout."""
+        return (os.path.exists(os.path.join(path, MANIFEST_FILE))
+                or os.path.exists(os.path.join(path, "index.faiss")))
+
+    @staticmethod
+    def read_manifest(path: str = "vector_db") -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(path, MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
     def save(self, path: str = "vector_db"):
-        """Save the FAISS index and associated data."""
-        if self.index is not None:
+        """
+        Save the live generation and publish it as the current snapshot.
+
+        Files are written to a staging directory, fsynced and renamed to
+        generations/<id>; MANIFEST.json is then replaced in one rename, so
+        a reader sees either the previous snapshot or this one.
+        """
+        generation = self._generation
+        if generation.index is None:
+            return
+        generations_dir = os.path.join(path, "generations")
+        os.makedirs(generations_dir, exist_ok=True)
+        directory = os.path.join(generations_dir, generation.generation_id)
+
+        if not os.path.exists(directory):
+            staging = directory + ".tmp"
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+
             # Save FAISS index
-            faiss.write_index(self.index, os.path.join(path, "index.faiss"))
-            
+            faiss.write_index(generation.index, os.path.join(staging, "index.faiss"))
+
             # Save vectorizer
-            with open(os.path.join(path, "vectorizer.pkl"), "wb") as f:
-                pickle.dump(self.vectorizer, f)
-            
+            with open(os.path.join(staging, "vectorizer.pkl"), "wb") as f:
+                pickle.dump(generation.vectorizer, f)
+
             # Save documents and metadata
-            with open(os.path.join(path, "documents.pkl"), "wb") as f:
-                pickle.dump(self.documents, f)
-            with open(os.path.join(path, "metadata.pkl"), "wb") as f:
-                pickle.dump(self.metadata, f)
-    
-    def load(self, path: str = "vector_db"):
-        """Load the FAISS index and associated data."""
+            with open(os.path.join(staging, "documents.pkl"), "wb") as f:
+                pickle.dump(generation.documents, f)
+            with open(os.path.join(staging, "metadata.pkl"), "wb") as f:
+                pickle.dump(generation.metadata, f)
+
+            for name in SNAPSHOT_FILES:
+                with open(os.path.join(staging, name), "rb") as f:
+                    os.fsync(f.fileno())
+            os.replace(staging, directory)
+
+        manifest = {
+            "generation": generation.generation_id,
+            "directory": os.path.join("generations", generation.generation_id),
+            "documents": len(generation.documents),
+            "saved_at": time.time()
+        }
+        manifest_tmp = os.path.join(path, MANIFEST_FILE + ".tmp")
+        with open(manifest_tmp, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(manifest_tmp, os.path.join(path, MANIFEST_FILE))
+        self._prune_generations(generations_dir, keep=generation.generation_id)
+
+    def _prune_generations(self, generations_dir: str, keep: str):
+        """Delete snapshots beyond INDEX_KEEP_GENERATIONS, newest first, never the current one."""
+        older = sorted(
+            (name for name in os.listdir(generations_dir) if name != keep and not name.endswith(".tmp")),
+            key=lambda name: os.path.getmtime(os.path.join(generations_dir, name)),
+            reverse=True
+        )
+        for name in older[max(self.keep_generations - 1, 0):]:
+            shutil.rmtree(os.path.join(generations_dir, name), ignore_errors=True)
+
+    def read_snapshot(self, path: str = "vector_db") -> IndexGeneration:
+        """Load the snapshot published at path into a new, unpublished generation."""
+        manifest = self.read_manifest(path)
+        directory = os.path.join(path, manifest["directory"]) if manifest else path
+
         # Load FAISS index
-        self.index = faiss.read_index(os.path.join(path, "index.faiss"))
-        
+        index = faiss.read_index(os.path.join(directory, "index.faiss"))
+
         # Load vectorizer
-        with open(os.path.join(path, "vectorizer.pkl"), "rb") as f:
-            self.vectorizer = pickle.load(f)
-        
+        with open(os.path.join(directory, "vectorizer.pkl"), "rb") as f:
+            vectorizer = pickle.load(f)
+
         # Load documents and metadata
-        with open(os.path.join(path, "documents.pkl"), "rb") as f:
-            self.documents = pickle.load(f)
-        with open(os.path.join(path, "metadata.pkl"), "rb") as f:
-            self.metadata = pickle.load(f) 
\ No newline at end of file
+        with open(os.path.join(directory, "documents.pkl"), "rb") as f:
+            documents = pickle.load(f)
+        with open(os.path.join(directory, "metadata.pkl"), "rb") as f:
+            metadata = pickle.load(f)
+
+        if manifest:
+            generation_id = manifest["generation"]
+        else:
+            # The flat layout has no recorded id; derive one from the files so
+            # every process loading the same snapshot agrees on its generation
+            digest = hashlib.sha1()
+            for name in SNAPSHOT_FILES:
+                with open(os.path.join(directory, name), "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(block)
+            generation_id = f"flat-{digest.hexdigest()[:16]}"
+        return IndexGeneration(vectorizer, index, documents, metadata, generation_id=generation_id)
+
+    def load(self, path: str = "vector_db"):
+        """Load the FAISS index and associated data."""
+        generation = self.read_snapshot(path)
+        with self._write_lock:
+            self._publish(generation)
+
+    def reload(self, path: str = "vector_db") -> Dict[str, Any]:
+        """
+        Swap in the snapshot published at path if it is not already live.
+
+        The new generation is fully loaded before the swap; searches keep
+        running on the old one until then and finish on it afterwards.
+
+        Returns:
+            Dict[str, Any]: Whether a swap happened, load time and the live generation
+        """
+        manifest = self.read_manifest(path)
+        if manifest and manifest["generation"] == self._generation.generation_id:
+            return {"reloaded": False, **self.generation_info()}
+        started = time.monotonic()
+        generation = self.read_snapshot(path)
+        with self._write_lock:
+            self._publish(generation)
+        return {"reloaded": True, "load_seconds": round(time.monotonic() - started, 3), **self.generation_info()}
+
+
+class SnapshotWatcher:
+    """Polls a snapshot directory's MANIFEST.json and reloads the index when it changes."""
+
+    def __init__(self, vector_db: VectorDatabase, path: str = "vector_db", interval: float = 5.0):
+        self.vector_db = vector_db
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _manifest_stamp(self):
+        try:
+            stat = os.stat(os.path.join(self.path, MANIFEST_FILE))
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="index-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _watch(self):
+        stamp = self._manifest_stamp()
+        while not self._stop.wait(self.interval):
+            current = self._manifest_stamp()
+            if current is None or current == stamp:
+                continue
+            stamp = current
+            try:
+                result = self.vector_db.reload(self.path)
+                if result["reloaded"]:
+                    print(f"Reloaded vector index generation {result['generation']}")
+            except Exception as e:
+                print(f"Error reloading vector index: {str(e)}")
+
+
+def create_vector_database(config: Config):
+    """The shared knowledge base index: sharded when VECTOR_SHARD_ADDRESSES or VECTOR_LOCAL_SHARDS is set."""
+    if config.vector_shard_addresses or config.vector_local_shards:
+        from .sharded_index import ShardedVectorDatabase
+        return ShardedVectorDatabase(config)
+    return VectorDatabase(config)
@@ -0,0 +1,77 @@
+"""Shared fixtures: the FastAPI app against temporary storage and a fake LLM."""
+import importlib
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+ADMIN_TOKEN = "test-admin-token"
+
+
+class FakeLLM:
+    """Stands in for every model client; reply(messages) builds the response text."""
+
+    def __init__(self):
+        self.calls = []
+        self.reply = None
+        self.plan_reply = plan_reply
+
+    def invoke(self, messages):
+        self.calls.append(messages)
+        text = self.reply(messages) if self.reply else json.dumps(plan_reply(4))
+        return SimpleNamespace(content=text, response_metadata={})
+
+
+def plan_reply(weeks: int, goal: str = "g") -> dict:
+    return {"header_note": "n", "goal": goal,
+            "weekly_phases": [{"week": week, "milestone": f"m{week}", "tasks": [f"task {week}"]}
+                              for week in range(1, weeks + 1)]}
+
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    """The api module and a TestClient, with every database and directory under a temp dir."""
+    root = tmp_path_factory.mktemp("api")
+    os.environ.update({
+        "GOOGLE_API_KEY": "test",
+        "CHAT_DB_PATH": str(root / "chat.db"),
+        "PLAN_DB_PATH": str(root / "plans.db"),
+        "JOB_DB_PATH": str(root / "jobs.db"),
+        "TENANT_KB_DIR": str(root / "tenants"),
+        "UPLOAD_DIR": str(root / "uploads"),
+        "GOAL_CLUSTER_PATH": str(root / "goal_clusters.pkl"),
+        "CHAT_RETENTION_ENABLED": "false",
+        "GOAL_CLUSTERS_ENABLED": "false",
+        "INDEX_WATCH_ENABLED": "false",
+        "DEFER_INGEST": "true",
+        "ADMIN_TOKEN": ADMIN_TOKEN,
+    })
+    cwd = os.getcwd()
+    # The shared index is looked for in ./vector_db
+    os.chdir(root)
+    try:
+        module = importlib.import_module("src.services.api")
+    finally:
+        os.chdir(cwd)
+    from fastapi.testclient import TestClient
+
+    fake = FakeLLM()
+    module.rag_system.llm.llm = fake
+    module.rag_system.llm._client = lambda decision: fake
+    module.rag_system.vector_db.add_documents(
+        ["Time blocking protects focus time for deep work.",
+         "Spaced repetition helps you learn a new language.",
+         "A weekly review keeps long term goals on track."],
+        [{"source": "shared"}] * 3
+    )
+    # Startup (job workers, ingest) is not run: TestClient is not used as a context manager
+    return SimpleNamespace(module=module, client=TestClient(module.app), llm=fake, root=root, admin_token=ADMIN_TOKEN)
+
+
+@pytest.fixture
+def fake_llm(api):
+    api.llm.calls.clear()
+    api.llm.reply = None
+    yield api.llm
+    api.llm.reply = None
@@ -0,0 +1,73 @@
+"""Admission classes and background slots."""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.services.admission import AdmissionController
+from src.services.prefetch import PlanPrefetcher
+
+
+def make_controller(batch_slots=1):
+    return AdmissionController(SimpleNamespace(
+        admission_enabled=True, admission_max_concurrency=8,
+        admission_interactive_max_queue=10, admission_interactive_max_wait_seconds=1,
+        admission_standard_max_concurrency=4, admission_standard_max_queue=10, admission_standard_max_wait_seconds=1,
+        admission_batch_max_concurrency=batch_slots, admission_batch_max_queue=10, admission_batch_max_wait_seconds=1
+    ))
+
+
+@pytest.mark.parametrize("method, path, expected", [
+    ("POST", "/api/form", "batch"),
+    ("POST", "/api/form/batch", "batch"),
+    ("POST", "/api/form/prefetch", "batch"),
+    ("POST", "/api/tenants/acme/documents", "batch"),
+    ("GET", "/api/tenants/acme/search", "interactive"),
+    ("GET", "/api/health", None),
+])
+def test_classify(method, path, expected):
+    assert AdmissionController.classify(method, path) == expected
+
+
+def test_try_acquire_never_queues():
+    controller = make_controller(batch_slots=1)
+    slot = controller.try_acquire("batch")
+    assert slot is not None
+    assert controller.try_acquire("batch") is None
+    controller.release(*slot)
+    assert controller.classes["batch"].in_flight == 0
+
+
+def make_prefetcher():
+    config = SimpleNamespace(prefetch_ttl_seconds=60, prefetch_max_entries=10, prefetch_speculation_concurrency=1,
+                             llm_max_concurrency=4, llm_reserved_chat_slots=1)
+    gateway = SimpleNamespace(stats=lambda: {"queue_depth": 0, "in_flight": 0})
+    return PlanPrefetcher(config, None, None, gateway)
+
+
+def test_speculation_holds_its_slot_until_done_or_cancelled():
+    controller = make_controller(batch_slots=2)
+    prefetcher = make_prefetcher()
+
+    def admit():
+        slot = controller.try_acquire("batch")
+        return (lambda: controller.release(*slot)) if slot else None
+
+    gate = threading.Event()
+    assert prefetcher.speculate("d1", "a", lambda: gate.wait(5) and "plan", admit=admit)
+    # The single worker is busy, so this one is queued in the executor and can be cancelled
+    assert prefetcher.speculate("d2", "b", lambda: "plan", admit=admit)
+    assert controller.classes["batch"].in_flight == 2
+    assert not prefetcher.speculate("d3", "c", lambda: "plan", admit=admit)
+    assert prefetcher.metrics["speculations_skipped_busy"] == 1
+
+    assert prefetcher.speculate("d2", "changed", lambda: "plan", admit=lambda: None) is False
+    assert controller.classes["batch"].in_flight == 1
+    gate.set()
+    assert prefetcher.claim("d1", "a", timeout=5) == "plan"
+    # Done callbacks run just after the result is set
+    deadline = time.monotonic() + 2
+    while controller.classes["batch"].in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert controller.classes["batch"].in_flight == 0
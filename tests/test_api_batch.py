@@ -0,0 +1,67 @@
+"""POST /api/form/batch: shared generations and retrievals, one NDJSON line per submission."""
+import json
+import threading
+
+import pytest
+
+
+def form(goal, **extra):
+    return dict({"goal": goal, "wake_time": "08:00", "sleep_time": "18:00", "focus_periods": 2,
+                 "break_duration": 5, "learning_duration": 2}, **extra)
+
+
+def post_batch(api, submissions):
+    response = api.client.post("/api/form/batch", json={"submissions": submissions})
+    assert response.status_code == 200
+    return sorted((json.loads(line) for line in response.text.splitlines()), key=lambda line: line["index"])
+
+
+@pytest.fixture
+def searches(api, monkeypatch):
+    """Queries of every batched shared-corpus search, with the thread it ran on."""
+    calls = []
+    search_batch = api.module.rag_system.vector_db.search_batch
+
+    def recording(queries, **kwargs):
+        calls.append((list(queries), threading.current_thread()))
+        return search_batch(queries, **kwargs)
+
+    monkeypatch.setattr(api.module.rag_system.vector_db, "search_batch", recording)
+    return calls
+
+
+def test_identical_profiles_share_a_generation_and_goals_share_a_retrieval(api, fake_llm, searches):
+    fake_llm.reply = lambda messages: json.dumps(fake_llm.plan_reply(2))
+    lines = post_batch(api, [
+        {"form_data": form("Learn Spanish"), "user_id": "a"},
+        {"form_data": form("Learn Spanish"), "user_id": "b"},
+        {"form_data": form("learn spanish ", focus_periods=3), "user_id": "c"},
+    ])
+    assert [line["user_id"] for line in lines] == ["a", "b", "c"]
+    assert all(line["plan_id"] and line["plan"]["schedule"]["days"] for line in lines)
+    # Distinct plans per submission, even when the generation was shared
+    assert len({line["plan_id"] for line in lines}) == 3
+    assert len(fake_llm.calls) == 2
+    # The three goals normalize to one query, searched once, off the event loop
+    assert [queries for queries, _ in searches] == [["learn spanish"]]
+    assert searches[0][1] is not threading.main_thread()
+
+
+def test_failures_are_reported_per_submission(api, fake_llm, searches):
+    fake_llm.reply = lambda messages: "not json" if "Fail" in str(messages[-1].content) else json.dumps(fake_llm.plan_reply(2))
+    lines = post_batch(api, [
+        {"form_data": {"wake_time": "08:00"}, "user_id": "no-goal"},
+        {"form_data": form("Fail this goal"), "user_id": "bad-1"},
+        {"form_data": form("Fail this goal"), "user_id": "bad-2"},
+        {"form_data": form("Run a marathon"), "user_id": "ok"},
+        {"form_data": form("Run a marathon"), "tenant_id": "not a tenant!", "user_id": "bad-tenant"},
+    ])
+    assert [("error" in line, line["user_id"]) for line in lines] == [
+        (True, "no-goal"), (True, "bad-1"), (True, "bad-2"), (False, "ok"), (True, "bad-tenant")]
+    assert "Goal is required" in lines[0]["error"]
+
+
+def test_too_many_submissions_is_rejected(api, monkeypatch):
+    monkeypatch.setattr(api.module.config, "batch_max_submissions", 1)
+    response = api.client.post("/api/form/batch", json={"submissions": [{"form_data": form("a")}] * 2})
+    assert response.status_code == 413
@@ -0,0 +1,60 @@
+"""Who may queue which background jobs."""
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize("kind, payload", [("plan", {"form_data": {"goal": "learn go"}}),
+                                           ("roadmap", {"goal": "learn go"})])
+def test_anyone_can_queue_plans_and_roadmaps(api, kind, payload):
+    response = api.client.post("/api/jobs", json={"kind": kind, "payload": payload})
+    assert response.status_code == 202
+    assert api.module.job_queue.get_job(response.json()["job_id"])["kind"] == kind
+
+
+@pytest.mark.parametrize("kind", ["ingest", "goal_clusters", "no_such_kind"])
+def test_other_kinds_need_the_admin_token(api, kind):
+    assert api.client.post("/api/jobs", json={"kind": kind}).status_code == 403
+    assert api.client.post("/api/jobs", json={"kind": kind},
+                           headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+
+def test_admin_can_queue_maintenance_jobs(api):
+    response = api.client.post("/api/jobs", json={"kind": "goal_clusters"}, headers={"X-Admin-Token": api.admin_token})
+    assert response.status_code == 202
+
+
+def test_tenant_ingest_jobs_cannot_be_queued_directly(api):
+    job = {"kind": "tenant_ingest", "payload": {"tenant_id": "x", "path": "/etc/hosts.txt", "source": "s"}}
+    assert api.client.post("/api/jobs", json=job).status_code == 400
+    assert api.client.post("/api/jobs", json=job, headers={"X-Admin-Token": api.admin_token}).status_code == 400
+
+
+def test_tenant_ingest_only_reads_the_tenants_own_uploads(api, tmp_path):
+    elsewhere = tmp_path / "secret.txt"
+    elsewhere.write_text("not an upload")
+    other_tenant = api.root / "uploads" / "other" / "theirs.txt"
+    other_tenant.parent.mkdir(parents=True, exist_ok=True)
+    other_tenant.write_text("another tenant's upload")
+    for path in (str(elsewhere), str(other_tenant),
+                 str(api.root / "uploads" / "acme" / ".." / "other" / "theirs.txt")):
+        with pytest.raises(ValueError):
+            api.module.run_tenant_ingest_job({"tenant_id": "acme", "path": path, "source": "s"}, lambda *a: None)
+    # Nothing outside the tenant's directory is removed either
+    api.module.remove_tenant_upload({"tenant_id": "acme", "path": str(other_tenant)})
+    assert other_tenant.exists()
+
+
+def test_uploaded_file_is_ingested_and_then_removed(api):
+    response = api.client.post("/api/tenants/acme/documents",
+                               files={"file": ("notes.txt", b"Kanban boards limit work in progress.", "text/plain")})
+    assert response.status_code == 202
+    job = api.module.job_queue
+    row = job._claim()
+    while row is not None and row[1] != "tenant_ingest":
+        row = job._claim()
+    assert row is not None
+    job._run(*row)
+    assert job.get_job(row[0])["status"] == "succeeded"
+    assert api.module.knowledge_base.get_namespace("acme").documents == ["Kanban boards limit work in progress."]
+    assert os.listdir(api.root / "uploads" / "acme") == []
@@ -0,0 +1,82 @@
+"""POST /api/plans/{plan_id}/regenerate: partial re-planning guarded by the plan's ETag."""
+import json
+
+import pytest
+
+
+def form(weeks):
+    return {"goal": "Learn Go", "wake_time": "08:00", "sleep_time": "18:00", "focus_periods": 2,
+            "break_duration": 5, "learning_duration": weeks}
+
+
+def new_weeks(weeks):
+    return json.dumps({"weekly_phases": [{"week": week, "milestone": f"new {week}", "tasks": [f"new task {week}"]}
+                                         for week in weeks]})
+
+
+@pytest.fixture
+def plan(api, fake_llm):
+    """A stored 4-week plan and its current ETag."""
+    fake_llm.reply = lambda messages: json.dumps(fake_llm.plan_reply(4))
+    response = api.client.post("/api/form", json={"form_data": form(4)})
+    assert response.status_code == 200
+    plan_id = response.json()["plan_id"]
+    fake_llm.calls.clear()
+    return plan_id, api.client.get(f"/api/plans/{plan_id}").headers["etag"]
+
+
+def regenerate(api, plan_id, weeks, etag=None, feedback=None):
+    headers = {"If-Match": etag} if etag else {}
+    return api.client.post(f"/api/plans/{plan_id}/regenerate", json={"weeks": weeks, "feedback": feedback},
+                           headers=headers)
+
+
+def test_only_the_requested_weeks_are_replaced(api, fake_llm, plan):
+    plan_id, etag = plan
+    fake_llm.reply = lambda messages: new_weeks([2, 3])
+    response = regenerate(api, plan_id, "2-3", etag=etag, feedback="more practice")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [phase["milestone"] for phase in body["plan"]["weekly_phases"]] == ["m1", "new 2", "new 3", "m4"]
+    assert body["version"] == 2
+    assert response.headers["etag"] != etag
+    assert response.headers["etag"] == api.client.get(f"/api/plans/{plan_id}").headers["etag"]
+    assert len(fake_llm.calls) == 1
+    assert "more practice" in str(fake_llm.calls[0])
+
+
+def test_stale_if_match_is_rejected_before_calling_the_model(api, fake_llm, plan):
+    plan_id, etag = plan
+    fake_llm.reply = lambda messages: new_weeks([1])
+    assert regenerate(api, plan_id, "1", etag=etag).status_code == 200
+    fake_llm.calls.clear()
+
+    response = regenerate(api, plan_id, "1", etag=etag)
+    assert response.status_code == 412
+    assert fake_llm.calls == []
+
+
+def test_edit_landing_during_generation_is_a_conflict(api, fake_llm, plan):
+    plan_id, etag = plan
+    store = api.module.plan_store
+
+    def concurrent_edit(messages):
+        store.replace_weeks(plan_id, [{"week": 4, "milestone": "edited elsewhere", "tasks": ["t"]}])
+        return new_weeks([1])
+
+    fake_llm.reply = concurrent_edit
+    assert regenerate(api, plan_id, "1", etag=etag).status_code == 409
+    phases = store.get_plan(plan_id)["weekly_phases"]
+    assert [phase["milestone"] for phase in phases] == ["m1", "m2", "m3", "edited elsewhere"]
+
+
+@pytest.mark.parametrize("weeks", ["", "x", "3-2", "0", "4-5", "7"])
+def test_invalid_week_ranges_are_bad_requests(api, fake_llm, plan, weeks):
+    plan_id, etag = plan
+    assert regenerate(api, plan_id, weeks, etag=etag).status_code == 400
+    assert fake_llm.calls == []
+
+
+def test_unknown_plan_is_not_found(api, fake_llm):
+    assert regenerate(api, "no-such-plan", "1").status_code == 404
@@ -0,0 +1,80 @@
+"""Per-process chat history cache in front of a shared backend."""
+from types import SimpleNamespace
+
+from src.services.chat_cache import CachedChatStorage, MESSAGE_OVERHEAD_BYTES
+from src.services.chat_storage import SQLiteChatStorage
+
+
+def make_backend(tmp_path):
+    config = SimpleNamespace(chat_db_path=str(tmp_path / "chat.db"), chat_write_behind=False,
+                             chat_flush_interval_ms=1)
+    return SQLiteChatStorage(config)
+
+
+def make_cache(backend, max_sessions=8, max_mb=1.0, revalidate_seconds=60.0):
+    config = SimpleNamespace(chat_cache_max_sessions=max_sessions, chat_cache_max_mb=max_mb,
+                             chat_cache_revalidate_seconds=revalidate_seconds)
+    return CachedChatStorage(backend, config)
+
+
+def test_cached_history_matches_the_backend(tmp_path):
+    backend = make_backend(tmp_path)
+    cache = make_cache(backend)
+    cache.create_session("s1")
+    cache.add_message("s1", "user", "hello", context_refs=["a:1"])
+    cache.add_message("s1", "assistant", "hi")
+
+    assert cache.get_session_messages("s1") == backend.get_session_messages("s1")
+    assert cache.stats()["hits"] == 1
+
+
+def test_entry_is_revalidated_once_the_window_passes(tmp_path):
+    cache = make_cache(make_backend(tmp_path), revalidate_seconds=0)
+    cache.create_session("s1")
+    cache.add_message("s1", "user", "hello")
+
+    assert [m["content"] for m in cache.get_session_messages("s1")] == ["hello"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["revalidated"], stats["stale"]) == (0, 1, 0)
+
+
+def test_write_by_another_worker_reloads_the_history(tmp_path):
+    backend = make_backend(tmp_path)
+    mine, theirs = make_cache(backend, revalidate_seconds=0), make_cache(backend, revalidate_seconds=0)
+    mine.create_session("s1")
+    mine.add_message("s1", "user", "hello")
+    theirs.add_message("s1", "assistant", "from the other worker")
+
+    assert [m["content"] for m in mine.get_session_messages("s1")] == ["hello", "from the other worker"]
+    assert mine.stats()["stale"] == 1
+    # The reloaded entry is current again
+    mine.get_session_messages("s1")
+    assert mine.stats()["revalidated"] == 1
+
+
+def test_least_recently_used_session_is_evicted_by_count(tmp_path):
+    cache = make_cache(make_backend(tmp_path), max_sessions=2)
+    for session_id in ("s1", "s2"):
+        cache.create_session(session_id)
+    cache.get_session_messages("s1")
+    cache.create_session("s3")
+
+    stats = cache.stats()
+    assert (stats["sessions"], stats["evictions"]) == (2, 1)
+    cache.get_session_messages("s2")
+    assert cache.stats()["misses"] == 1
+
+
+def test_sessions_are_evicted_by_size(tmp_path):
+    content = "x" * 1000
+    cache = make_cache(make_backend(tmp_path), max_mb=(len(content) + MESSAGE_OVERHEAD_BYTES) * 1.5 / (1024 * 1024))
+    cache.create_session("s1")
+    cache.add_message("s1", "user", content)
+    cache.create_session("s2")
+    cache.add_message("s2", "user", content)
+
+    stats = cache.stats()
+    assert (stats["sessions"], stats["evictions"]) == (1, 1)
+    assert stats["bytes"] == len(content) + MESSAGE_OVERHEAD_BYTES
+    # The evicted session is read back from the backend
+    assert [m["content"] for m in cache.get_session_messages("s1")] == [content]
@@ -0,0 +1,79 @@
+"""Streaming chat export: time range, encodings and compression."""
+import gzip
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from src.services.chat_export import ChatExport, MESSAGE_COLUMNS, parse_export_time
+from src.services.chat_storage import InMemoryChatStorage
+
+TIMES = ["2026-01-01 10:00:00", "2026-01-01 10:00:05", "2026-01-01 10:00:10"]
+
+
+@pytest.fixture
+def storage():
+    storage = InMemoryChatStorage()
+    for i, timestamp in enumerate(TIMES):
+        storage.add_message("s1", "user", f"m{i}", context_refs=[f"r{i}"])
+        storage._messages["s1"][i]["timestamp"] = timestamp
+    return storage
+
+
+def export_bytes(export):
+    return b"".join(export)
+
+
+def test_parse_export_time_defaults_to_utc():
+    assert parse_export_time(None) is None
+    utc = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc)
+    assert parse_export_time("2026-01-01T10:00:00Z") == utc
+    assert parse_export_time("2026-01-01T10:00:00") == utc
+    assert parse_export_time("2026-01-01T12:00:00+02:00") == utc
+
+
+def test_range_includes_since_and_excludes_until(storage):
+    export = ChatExport(storage, since=parse_export_time("2026-01-01T10:00:05Z"),
+                        until=parse_export_time("2026-01-01T10:00:10Z"))
+    rows = [json.loads(line) for line in export_bytes(export).splitlines()]
+    assert [row["content"] for row in rows] == ["m1"]
+    assert export.rows == 1
+
+
+def test_empty_or_invalid_range_is_rejected(storage):
+    moment = parse_export_time("2026-01-01T10:00:00Z")
+    with pytest.raises(ValueError):
+        ChatExport(storage, since=moment, until=moment)
+    with pytest.raises(ValueError):
+        ChatExport(storage, fmt="csv")
+
+
+def test_ndjson_has_one_row_per_line(storage):
+    export = ChatExport(storage, batch_size=2)
+    rows = [json.loads(line) for line in export_bytes(export).splitlines()]
+    assert [row["content"] for row in rows] == ["m0", "m1", "m2"]
+    assert list(rows[0]) == list(MESSAGE_COLUMNS)
+    assert rows[0]["context_refs"] == ["r0"]
+    assert export.filename.endswith(".ndjson") and export.media_type == "application/x-ndjson"
+
+
+def test_columnar_has_one_line_of_columns_per_batch(storage):
+    lines = [json.loads(line) for line in export_bytes(ChatExport(storage, fmt="columnar", batch_size=2)).splitlines()]
+    assert [line["rows"] for line in lines] == [2, 1]
+    assert lines[0]["columns"]["content"] == ["m0", "m1"]
+    assert lines[1]["columns"]["timestamp"] == [TIMES[2]]
+    assert set(lines[0]["columns"]) == set(MESSAGE_COLUMNS)
+
+
+def test_sessions_export(storage):
+    rows = [json.loads(line) for line in export_bytes(ChatExport(storage, entity="sessions")).splitlines()]
+    assert [row["session_id"] for row in rows] == ["s1"]
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "columnar"])
+def test_gzip_output_decompresses_to_the_plain_export(storage, fmt):
+    until = parse_export_time("2026-01-02T00:00:00Z")
+    plain = export_bytes(ChatExport(storage, fmt=fmt, until=until, batch_size=2))
+    export = ChatExport(storage, fmt=fmt, compression="gzip", until=until, batch_size=2)
+    assert gzip.decompress(export_bytes(export)) == plain
+    assert export.filename.endswith(".gz") and export.media_type == "application/gzip"
@@ -0,0 +1,61 @@
+"""Chat retention: compaction and archival never drop messages they did not see."""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from src.services.chat_retention import RetentionEngine, iter_archive
+from src.services.chat_storage import InMemoryChatStorage
+
+
+def make_config(tmp_path, **overrides):
+    settings = dict(
+        chat_retention_interval_seconds=3600, chat_session_ttl_days=0, chat_archive_after_days=0,
+        chat_archive_dir=str(tmp_path / "archive"), chat_compact_after_messages=0, chat_compact_keep_last=2,
+        chat_vacuum_interval_hours=24, debug_mode=False
+    )
+    settings.update(overrides)
+    return SimpleNamespace(**settings)
+
+
+def test_compaction_keeps_messages_added_while_summarizing(tmp_path):
+    storage = InMemoryChatStorage()
+    for i in range(6):
+        storage.add_message("s1", "user", f"m{i}")
+
+    def summarizer(messages):
+        # Simulates a turn arriving while the summary is being written
+        storage.add_message("s1", "user", "late")
+        return "summary"
+
+    engine = RetentionEngine(storage, make_config(tmp_path, chat_compact_after_messages=4), summarizer=summarizer)
+    assert engine.run_once()["compacted"] == 0
+    assert [m["content"] for m in storage.get_session_messages("s1")][-1] == "late"
+    assert len(storage.get_session_messages("s1")) == 7
+
+
+def test_archive_keeps_sessions_that_changed(tmp_path):
+    storage = InMemoryChatStorage()
+    storage.add_message("cold", "user", "old")
+    storage.add_message("busy", "user", "old")
+    engine = RetentionEngine(storage, make_config(tmp_path))
+    get_messages = storage.get_session_messages
+
+    def racing_get_messages(session_id):
+        messages = get_messages(session_id)
+        if session_id == "busy":
+            storage.add_message("busy", "user", "new")
+        return messages
+
+    storage.get_session_messages = racing_get_messages
+    now = datetime.now(timezone.utc) + timedelta(days=1)
+    assert engine.archive_sessions([storage.get_session("cold"), storage.get_session("busy")], now) == 1
+    storage.get_session_messages = get_messages
+
+    assert storage.get_session("cold") is None
+    assert [m["content"] for m in storage.get_session_messages("busy")] == ["old", "new"]
+    archived = list(iter_archive(str(tmp_path / "archive" / f"chat-{now.strftime('%Y-%m')}.jsonl.gz")))
+    assert {record["session_id"] for record in archived} == {"cold", "busy"}
+
+
+def test_archive_dir_defaults_to_the_repository_data_dir(tmp_path):
+    engine = RetentionEngine(InMemoryChatStorage(), make_config(tmp_path, chat_archive_dir=None))
+    assert engine.archive_dir.endswith("data/archive") and engine.archive_dir.startswith("/")
@@ -0,0 +1,156 @@
+"""Contract tests every chat storage backend has to pass."""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from src.services.chat_storage import InMemoryChatStorage, SQLiteChatStorage
+
+
+@pytest.fixture(params=["sqlite", "sqlite-write-through", "memory"])
+def storage(request, tmp_path):
+    if request.param == "memory":
+        backend = InMemoryChatStorage()
+    else:
+        config = SimpleNamespace(
+            chat_db_path=str(tmp_path / "chat.db"),
+            chat_write_behind=request.param == "sqlite",
+            chat_flush_interval_ms=1
+        )
+        backend = SQLiteChatStorage(config)
+    yield backend
+    backend.close()
+
+
+def test_create_session_once(storage):
+    assert storage.create_session("s1", {"user": "u1"})
+    assert not storage.create_session("s1")
+    session = storage.get_session("s1")
+    assert session["session_id"] == "s1"
+    assert session["metadata"] == {"user": "u1"}
+    assert storage.get_session("missing") is None
+
+
+def test_messages_keep_order_and_refs(storage):
+    storage.create_session("s1")
+    storage.add_message("s1", "user", "hello", context_refs=[3, 1])
+    storage.add_message("s1", "assistant", "hi")
+    messages = storage.get_session_messages("s1")
+    assert [(m["role"], m["content"]) for m in messages] == [("user", "hello"), ("assistant", "hi")]
+    assert messages[0]["context_refs"] == [3, 1]
+    assert messages[1]["context_refs"] is None
+    assert storage.get_session_messages("missing") == []
+
+
+def test_add_message_returns_the_stored_timestamp(storage):
+    storage.create_session("s1")
+    timestamp = storage.add_message("s1", "user", "hello")
+    assert storage.get_session_messages("s1")[0]["timestamp"] == timestamp
+
+
+def test_add_message_creates_unknown_session(storage):
+    storage.add_message("client-named", "user", "hello")
+    storage.flush()
+    assert storage.get_session("client-named") is not None
+
+
+def test_version_counts_changes(storage):
+    storage.create_session("s1")
+    assert storage.get_session_version("s1") == 0
+    storage.add_message("s1", "user", "a")
+    storage.add_message("s1", "assistant", "b")
+    assert storage.get_session_version("s1") == 2
+    assert storage.get_session_version("missing") is None
+
+
+def test_delete_session(storage):
+    storage.create_session("s1")
+    storage.add_message("s1", "user", "a")
+    assert storage.delete_session("s1")
+    assert storage.get_session("s1") is None
+    assert storage.get_session_messages("s1") == []
+
+
+def test_list_and_find_sessions(storage):
+    for session_id, count in (("a", 1), ("b", 3)):
+        storage.create_session(session_id)
+        for i in range(count):
+            storage.add_message(session_id, "user", str(i))
+    storage.flush()
+    assert {s["session_id"] for s in storage.list_sessions(limit=10)} == {"a", "b"}
+    assert len(storage.list_sessions(limit=1)) == 1
+    found = storage.find_sessions(min_messages=2)
+    assert [(s["session_id"], s["message_count"]) for s in found] == [("b", 3)]
+    future = datetime.now(timezone.utc) + timedelta(minutes=1)
+    assert {s["session_id"] for s in storage.find_sessions(updated_before=future)} == {"a", "b"}
+    past = datetime.now(timezone.utc) - timedelta(minutes=1)
+    assert storage.find_sessions(updated_before=past) == []
+
+
+def test_find_expired_sessions(storage):
+    storage.create_session("default")
+    storage.create_session("own-ttl", {"ttl_seconds": 7200})
+    storage.create_session("no-ttl", {"ttl_seconds": 0})
+    later = datetime.now(timezone.utc) + timedelta(hours=1)
+    assert storage.find_expired_sessions(later, default_ttl_seconds=60) == ["default"]
+    assert storage.find_expired_sessions(later, default_ttl_seconds=0) == []
+
+
+def test_compact_session_keeps_latest_turns(storage):
+    storage.create_session("s1")
+    for i in range(5):
+        storage.add_message("s1", "user", f"m{i}")
+    version = storage.get_session_version("s1")
+    assert storage.compact_session("s1", "summary of m0-m2", keep_last=2) == 2
+    messages = storage.get_session_messages("s1")
+    assert [(m["role"], m["content"]) for m in messages] == [
+        ("summary", "summary of m0-m2"), ("user", "m3"), ("user", "m4")
+    ]
+    assert storage.get_session_version("s1") == version + 1
+    assert storage.compact_session("s1", "again", keep_last=2) == 0
+
+
+def test_compact_session_skips_a_changed_session(storage):
+    storage.create_session("s1")
+    for i in range(5):
+        storage.add_message("s1", "user", f"m{i}")
+    version = storage.get_session_version("s1")
+    # A message lands between reading the history and compacting it
+    storage.add_message("s1", "user", "m5")
+    assert storage.compact_session("s1", "summary of m0-m2", keep_last=2, expected_version=version) == 0
+    assert [m["content"] for m in storage.get_session_messages("s1")] == [f"m{i}" for i in range(6)]
+    version = storage.get_session_version("s1")
+    assert storage.compact_session("s1", "summary of m0-m3", keep_last=2, expected_version=version) == 3
+
+
+def test_delete_session_skips_a_changed_session(storage):
+    storage.create_session("s1")
+    storage.add_message("s1", "user", "m0")
+    version = storage.get_session_version("s1")
+    storage.add_message("s1", "user", "m1")
+    assert not storage.delete_session("s1", expected_version=version)
+    assert len(storage.get_session_messages("s1")) == 2
+    assert storage.delete_session("s1", expected_version=storage.get_session_version("s1"))
+    assert storage.get_session("s1") is None
+
+
+def test_iter_messages_batches_and_range(storage):
+    storage.create_session("s1")
+    storage.create_session("s2")
+    for i in range(5):
+        storage.add_message("s1" if i % 2 else "s2", "user", f"m{i}")
+    batches = list(storage.iter_messages(batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    rows = [row for batch in batches for row in batch]
+    assert sorted(row["content"] for row in rows) == [f"m{i}" for i in range(5)]
+    assert {row["session_id"] for row in rows} == {"s1", "s2"}
+    future = datetime.now(timezone.utc) + timedelta(minutes=1)
+    assert list(storage.iter_messages(since=future)) == []
+    assert list(storage.iter_messages(until=datetime.now(timezone.utc) - timedelta(minutes=1))) == []
+
+
+def test_iter_sessions(storage):
+    for session_id in ("c", "a", "b"):
+        storage.create_session(session_id)
+    batches = list(storage.iter_sessions(batch_size=2))
+    assert [[s["session_id"] for s in batch] for batch in batches] == [["a", "b"], ["c"]]
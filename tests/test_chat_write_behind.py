@@ -0,0 +1,131 @@
+"""SQLite write-behind queue: batched commits, flush on close, failed flushes."""
+import sqlite3
+from types import SimpleNamespace
+
+from src.services.chat_storage import SQLiteChatStorage
+
+
+def make_storage(path, interval_ms=50, max_batch=500):
+    config = SimpleNamespace(chat_db_path=str(path), chat_write_behind=True,
+                             chat_flush_interval_ms=interval_ms, chat_flush_max_batch=max_batch)
+    return SQLiteChatStorage(config)
+
+
+def reopen(path):
+    return SQLiteChatStorage(SimpleNamespace(chat_db_path=str(path), chat_write_behind=False))
+
+
+def record_batches(storage):
+    sizes = []
+    commit_batch = storage._commit_batch
+
+    def recording(conn, batch):
+        sizes.append(len(batch))
+        return commit_batch(conn, batch)
+
+    storage._commit_batch = recording
+    return sizes
+
+
+class FailingConnection:
+    """Writer connection whose next `failures` batches fail like a locked database."""
+
+    def __init__(self, conn, failures):
+        self.conn = conn
+        self.failures = failures
+
+    def cursor(self):
+        if self.failures[0]:
+            self.failures[0] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self.conn.cursor()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def fail_flushes(storage, failures):
+    remaining = [failures]
+    flush_batch = storage._flush_batch
+    storage._flush_batch = lambda conn: flush_batch(FailingConnection(conn, remaining))
+    return remaining
+
+
+def test_queued_messages_commit_in_one_batch(tmp_path):
+    storage = make_storage(tmp_path / "chat.db", interval_ms=200)
+    sizes = record_batches(storage)
+    for i in range(6):
+        storage.add_message("s1" if i % 2 else "s2", "user", f"m{i}")
+    assert storage.flush(timeout=5)
+
+    assert sizes == [6]
+    assert storage.get_session_version("s1") == storage.get_session_version("s2") == 3
+    storage.close()
+
+
+def test_batches_are_capped_at_max_batch(tmp_path):
+    storage = make_storage(tmp_path / "chat.db", interval_ms=200, max_batch=4)
+    sizes = record_batches(storage)
+    for i in range(10):
+        storage.add_message("s1", "user", f"m{i}")
+    assert storage.flush(timeout=5)
+
+    assert sizes == [4, 4, 2]
+    assert [m["content"] for m in storage.get_session_messages("s1")] == [f"m{i}" for i in range(10)]
+    storage.close()
+
+
+def test_close_flushes_queued_messages(tmp_path):
+    path = tmp_path / "chat.db"
+    storage = make_storage(path, interval_ms=500)
+    storage.add_message("s1", "user", "hello")
+    storage.add_message("s1", "assistant", "hi")
+    storage.close()
+
+    assert [m["content"] for m in reopen(path).get_session_messages("s1")] == ["hello", "hi"]
+
+
+def test_failed_flush_is_retried_in_order(tmp_path):
+    path = tmp_path / "chat.db"
+    storage = make_storage(path, interval_ms=1)
+    fail_flushes(storage, 1)
+    storage.add_message("s1", "user", "m0")
+    # Queued rows stay readable while the flush is retried
+    assert [m["content"] for m in storage.get_session_messages("s1")] == ["m0"]
+    storage.add_message("s1", "user", "m1")
+    assert storage.flush(timeout=5)
+
+    assert [m["content"] for m in reopen(path).get_session_messages("s1")] == ["m0", "m1"]
+    assert storage.get_session_version("s1") == 2
+    storage.close()
+
+
+def test_failed_flush_on_close_drops_the_batch(tmp_path):
+    path = tmp_path / "chat.db"
+    storage = make_storage(path, interval_ms=500)
+    fail_flushes(storage, 1)
+    storage.add_message("s1", "user", "lost")
+    storage.close()
+
+    assert reopen(path).get_session_messages("s1") == []
+
+
+def test_message_queued_during_delete_does_not_recreate_the_session(tmp_path):
+    storage = make_storage(tmp_path / "chat.db", interval_ms=1)
+    storage.create_session("s1")
+    storage.add_message("s1", "user", "m0")
+    connect = storage._connect
+
+    def connect_during_delete():
+        # Lands after delete_session holds the commit lock
+        storage._connect = connect
+        storage.add_message("s1", "user", "late")
+        return connect()
+
+    storage._connect = connect_during_delete
+    assert storage.delete_session("s1")
+    assert storage.flush(timeout=5)
+
+    assert storage.get_session("s1") is None
+    assert storage.get_session_messages("s1") == []
+    storage.close()
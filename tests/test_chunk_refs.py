@@ -0,0 +1,39 @@
+"""Chunk refs: stable references that survive reindexing."""
+from types import SimpleNamespace
+
+from src.services.vector_db import VectorDatabase, chunk_ref
+
+CHUNKS = [
+    "Deep work needs long focus blocks without interruptions.",
+    "Spaced repetition strengthens memory over weeks.",
+    "Weekly reviews align goals and tasks.",
+    "Habit stacking attaches new habits to old routines.",
+]
+
+
+def make_db(chunks):
+    db = VectorDatabase(SimpleNamespace(index_keep_generations=2, debug_mode=False))
+    db.add_documents(chunks, [{"source": f"s{i}"} for i in range(len(chunks))])
+    return db
+
+
+def test_search_results_carry_refs():
+    db = make_db(CHUNKS)
+    result = db.search("spaced repetition memory", n_results=2)
+    assert result["refs"] == [chunk_ref(doc) for doc in result["documents"]]
+
+
+def test_refs_find_the_same_chunks_after_a_rebuild():
+    refs = make_db(CHUNKS).search("weekly reviews goals", n_results=2)["refs"]
+    # Reindexing in a different order (or without some chunks) moves every position
+    rebuilt = make_db(list(reversed(CHUNKS[1:])))
+    found = rebuilt.get_chunks(refs)
+    original = {chunk_ref(doc): doc for doc in CHUNKS}
+    assert found["documents"] == [original[ref] for ref in refs if original[ref] in CHUNKS[1:]]
+    assert found["refs"] == [ref for ref in refs if original[ref] in CHUNKS[1:]]
+
+
+def test_unknown_refs_and_legacy_ids():
+    db = make_db(CHUNKS)
+    assert db.get_chunks(["0000000000000000"])["documents"] == []
+    assert db.get_chunks([1, 99])["documents"] == [CHUNKS[1]]
@@ -0,0 +1,54 @@
+"""Extractive compression of retrieved chunks to a token budget."""
+from types import SimpleNamespace
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from src.services.context_compression import ContextCompressor, estimate_tokens
+
+DOCUMENTS = [
+    "Spaced repetition schedules reviews just before you forget. Keep your desk tidy at all times.",
+    "Flashcards with spaced repetition beat rereading notes. Drink water during long sessions.",
+]
+RETRIEVAL = {"documents": DOCUMENTS, "metadatas": [{"source": "memory.pdf"}, {"source": "study.pdf"}],
+             "ids": [7, 9], "refs": ["r7", "r9"]}
+
+
+def make_compressor(vectorizer, budget=1000, enabled=True):
+    config = SimpleNamespace(context_compression_enabled=enabled, context_token_budget=budget,
+                             context_min_sentence_chars=10)
+    return ContextCompressor(SimpleNamespace(vectorizer=vectorizer), config)
+
+
+def fitted():
+    return TfidfVectorizer().fit(DOCUMENTS)
+
+
+def test_top_scoring_sentences_are_kept_within_budget():
+    compressor = make_compressor(fitted(), budget=estimate_tokens(DOCUMENTS[1].split(". ")[0] + ".") + 1)
+    result = compressor.compress("spaced repetition flashcards", RETRIEVAL)
+
+    assert result["documents"] == ["[study.pdf] Flashcards with spaced repetition beat rereading notes."]
+    assert result["ids"] == [9] and result["refs"] == ["r9"]
+    assert result["compression"]["sentences_kept"] == 1
+    assert result["compression"]["output_tokens"] <= result["compression"]["input_tokens"]
+
+
+def test_kept_sentences_are_grouped_per_source_in_reading_order():
+    result = make_compressor(fitted(), budget=30).compress("spaced repetition", RETRIEVAL)
+
+    assert [document.split("]")[0] for document in result["documents"]] == ["[memory.pdf", "[study.pdf"]
+    assert result["documents"][0].startswith("[memory.pdf] Spaced repetition schedules reviews")
+    assert "desk" not in " ".join(result["documents"])
+    assert [meta["chunks"] for meta in result["metadatas"]] == [1, 1]
+    assert result["compression"]["output_tokens"] <= 30 + 2 * estimate_tokens("[memory.pdf] ")
+
+
+def test_without_a_vectorizer_the_best_ranked_chunks_are_kept():
+    result = make_compressor(None, budget=30).compress("spaced repetition", RETRIEVAL)
+
+    assert result["documents"] == ["[memory.pdf] " + DOCUMENTS[0]]
+    assert result["compression"]["sentences_kept"] == 2
+
+
+def test_disabled_compression_returns_the_retrieval_unchanged():
+    assert make_compressor(fitted(), enabled=False).compress("spaced repetition", RETRIEVAL) is RETRIEVAL
@@ -0,0 +1,49 @@
+"""MinHash chunk dedup."""
+from types import SimpleNamespace
+
+from src.services.dedup import MinHashDeduplicator, dedupe_chunks
+from src.services.tenant_kb import TenantKnowledgeBase
+from src.services.vector_db import VectorDatabase
+
+TEXT = "Block two hours every morning for the hardest task of the day before email."
+
+
+def test_chunks_without_words_are_not_duplicates_of_each_other():
+    chunks = ["--- --- ---", "*** ***", TEXT, TEXT + " "]
+    kept, _, report = dedupe_chunks(chunks, [{"source": "a"} for _ in chunks], MinHashDeduplicator())
+    assert kept == chunks[:3]
+    assert report["duplicates"] == 1
+
+
+def test_saved_signatures_restore_the_same_matches(tmp_path):
+    path = str(tmp_path / "signatures.npz")
+    items = [{"source": "a"}, {"source": "b"}]
+    original = MinHashDeduplicator()
+    for item, text in zip(items, [TEXT, "==="]):
+        original.add(item, original.signature(text))
+    original.save(path, "gen-1")
+
+    restored = MinHashDeduplicator()
+    assert not restored.load(path, "gen-2", items)
+    assert not MinHashDeduplicator(shingle_size=3).load(path, "gen-1", items)
+    assert restored.load(path, "gen-1", items)
+    assert restored.find_duplicate(TEXT)[0] is items[0]
+    assert restored.find_duplicate("===")[0] is None
+
+
+def test_tenant_ingest_only_signs_the_new_chunks(tmp_path, monkeypatch):
+    config = SimpleNamespace(tenant_kb_dir=str(tmp_path / "tenants"), tenant_cache_max_namespaces=8,
+                             tenant_cache_max_mb=64, index_watch_interval_seconds=0, index_keep_generations=2,
+                             debug_mode=False, chunk_size=1000, chunk_overlap=0, dedup_enabled=True,
+                             dedup_threshold=0.85, dedup_num_perm=64, dedup_shingle_size=3)
+    kb = TenantKnowledgeBase(config, VectorDatabase(config))
+    signed = []
+    sign = MinHashDeduplicator.signature
+    monkeypatch.setattr(MinHashDeduplicator, "signature", lambda self, text: signed.append(text) or sign(self, text))
+
+    for i, text in enumerate([TEXT, "Review the week every Friday afternoon.", TEXT]):
+        (tmp_path / f"{i}.txt").write_text(text)
+        signed.clear()
+        report = kb.ingest("acme", str(tmp_path / f"{i}.txt"), f"{i}.txt")
+        assert signed == [text]
+    assert report["duplicates"] == 1
@@ -0,0 +1,61 @@
+"""Goal cluster packs shared between processes through the saved file."""
+import os
+import pickle
+from collections import Counter
+from types import SimpleNamespace
+
+import faiss
+
+from src.services.goal_clusters import GoalClusters
+from src.services.vector_db import SNAPSHOT_FILES, VectorDatabase
+
+CHUNKS = [
+    "Learning a language takes daily vocabulary practice.",
+    "Running a marathon needs a gradual mileage build-up.",
+    "Spaced repetition helps with vocabulary retention.",
+    "Long runs and recovery days prevent injuries.",
+]
+
+
+def make_db():
+    db = VectorDatabase(SimpleNamespace(index_keep_generations=2, debug_mode=False))
+    db.add_documents(CHUNKS, [{"source": "s"} for _ in CHUNKS])
+    return db
+
+
+def make_clusters(db, path):
+    config = SimpleNamespace(goal_cluster_path=str(path), goal_cluster_min_similarity=0.1,
+                             index_watch_interval_seconds=0, goal_cluster_count=2,
+                             goal_cluster_queries_per_pack=4)
+    compressor = SimpleNamespace(compress=lambda query, retrieval: {"documents": retrieval["documents"]})
+    return GoalClusters(config, db, compressor)
+
+
+def test_lookup_picks_up_a_model_saved_by_another_process(tmp_path):
+    db = make_db()
+    path = tmp_path / "goal_clusters.pkl"
+    builder, reader = make_clusters(db, path), make_clusters(db, path)
+    assert reader.lookup("learn vocabulary") is None
+
+    builder.save(builder.build(Counter({"learn vocabulary": 3, "marathon running": 2})))
+    hit = reader.lookup("learn vocabulary")
+    assert hit is not None and "vocabulary" in hit[1][0]
+
+    # A rebuild elsewhere replaces the file; the reader swaps to it
+    builder.save(builder.build(Counter({"marathon running": 5})))
+    assert reader.lookup("learn vocabulary") is None
+    assert reader.stats()["clusters"] == 1
+
+
+def test_flat_snapshot_generation_is_the_same_in_every_process(tmp_path):
+    generation = make_db()._generation
+    faiss.write_index(generation.index, str(tmp_path / "index.faiss"))
+    for name, value in zip(SNAPSHOT_FILES[1:], (generation.vectorizer, generation.documents, generation.metadata)):
+        with open(os.path.join(tmp_path, name), "wb") as f:
+            pickle.dump(value, f)
+
+    first, second = make_db(), make_db()
+    first.load(str(tmp_path))
+    second.load(str(tmp_path))
+    assert first.generation_info()["generation"].startswith("flat-")
+    assert first.generation_info() == second.generation_info()
@@ -0,0 +1,167 @@
+"""Job queue: lease-based recovery, permanent failures and webhook URL checks."""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.services.job_queue import JobQueue, validate_webhook_url
+
+
+def make_config(**overrides):
+    settings = dict(
+        job_db_path=None, job_workers=1, job_max_attempts=3, job_retry_base_delay=0.0,
+        job_poll_interval_seconds=0.05, job_webhook_timeout_seconds=1.0, job_lease_seconds=30.0
+    )
+    settings.update(overrides)
+    return SimpleNamespace(**settings)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+def wait_for(queue, job_id, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get_job(job_id)
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish: {queue.get_job(job_id)}")
+
+
+def test_live_lease_is_not_requeued_by_another_process(db_path):
+    first = JobQueue(make_config(), db_path=db_path)
+    first.register("echo", lambda payload, progress: payload)
+    job_id = first.enqueue("echo", {"n": 1})
+    assert first._claim()[0] == job_id
+
+    # A second worker process starting up must leave the leased job alone
+    second = JobQueue(make_config(), db_path=db_path)
+    second.register("echo", lambda payload, progress: payload)
+    assert second._claim() is None
+    assert second.get_job(job_id)["status"] == "running"
+
+
+def test_expired_lease_is_requeued_and_rerun(db_path):
+    first = JobQueue(make_config(job_lease_seconds=0.05), db_path=db_path)
+    first.register("echo", lambda payload, progress: payload)
+    job_id = first.enqueue("echo", {"n": 1})
+    assert first._claim()[0] == job_id
+    time.sleep(0.1)
+
+    second = JobQueue(make_config(), db_path=db_path)
+    second.register("echo", lambda payload, progress: payload)
+    second.start()
+    try:
+        job = wait_for(second, job_id)
+    finally:
+        second.stop()
+    assert job["status"] == "succeeded"
+    assert job["result"] == {"n": 1}
+    assert job["attempts"] == 2
+    # The original worker lost its lease and cannot overwrite the result
+    assert not first._update(job_id, status="failed", error="late")
+
+
+def test_value_error_fails_without_retrying(db_path):
+    calls = []
+
+    def handler(payload, progress):
+        calls.append(payload)
+        raise ValueError("Goal is required")
+
+    queue = JobQueue(make_config(), db_path=db_path)
+    queue.register("bad", handler)
+    job_id = queue.enqueue("bad")
+    queue.start()
+    try:
+        job = wait_for(queue, job_id)
+    finally:
+        queue.stop()
+    assert job["status"] == "failed"
+    assert job["attempts"] == 1
+    assert len(calls) == 1
+
+
+def test_transient_error_is_retried(db_path):
+    calls = []
+
+    def handler(payload, progress):
+        calls.append(payload)
+        if len(calls) < 2:
+            raise RuntimeError("connection reset")
+        return {"ok": True}
+
+    queue = JobQueue(make_config(), db_path=db_path)
+    queue.register("flaky", handler)
+    job_id = queue.enqueue("flaky")
+    queue.start()
+    try:
+        job = wait_for(queue, job_id)
+    finally:
+        queue.stop()
+    assert job["status"] == "succeeded"
+    assert job["attempts"] == 2
+
+
+@pytest.mark.parametrize("failures, status", [(1, "succeeded"), (3, "failed")])
+def test_on_finish_runs_once_when_the_job_is_done(db_path, failures, status):
+    calls, finished = [], []
+
+    def handler(payload, progress):
+        calls.append(payload)
+        if len(calls) <= failures:
+            raise RuntimeError("connection reset")
+        return {"ok": True}
+
+    queue = JobQueue(make_config(), db_path=db_path)
+    queue.register("flaky", handler, on_finish=finished.append)
+    job_id = queue.enqueue("flaky", {"path": "upload.txt"})
+    queue.start()
+    try:
+        assert wait_for(queue, job_id)["status"] == status
+        deadline = time.time() + 2
+        while not finished and time.time() < deadline:
+            time.sleep(0.02)
+    finally:
+        queue.stop()
+    # Not after the retried attempts, only once the job has its final state
+    assert finished == [{"path": "upload.txt"}]
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://93.184.216.34/hook",
+    "file:///etc/passwd",
+    "http://127.0.0.1:8000/hook",
+    "http://localhost/hook",
+    "http://10.0.0.5/hook",
+    "http://192.168.1.1/hook",
+    "http://169.254.169.254/latest/meta-data",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://0.0.0.0/hook",
+])
+def test_webhook_url_rejects_non_public_targets(url):
+    with pytest.raises(ValueError):
+        validate_webhook_url(url)
+
+
+def test_webhook_url_accepts_public_address():
+    assert validate_webhook_url("https://93.184.216.34/hook") == "https://93.184.216.34/hook"
+
+
+def test_enqueue_rejects_private_webhook(db_path):
+    queue = JobQueue(make_config(), db_path=db_path)
+    queue.register("echo", lambda payload, progress: payload)
+    with pytest.raises(ValueError):
+        queue.enqueue("echo", webhook_url="http://127.0.0.1/hook")
+
+
+def test_unique_enqueue_keeps_one_pending_job(db_path):
+    queue = JobQueue(make_config(), db_path=db_path)
+    queue.register("ingest", lambda payload, progress: {})
+    first = queue.enqueue("ingest", unique=True)
+    assert queue.enqueue("ingest", unique=True) == first
+    assert queue.enqueue("ingest") != first
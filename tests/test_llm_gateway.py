@@ -0,0 +1,84 @@
+"""LLM gateway: circuit breaker probing and error classification."""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.services.llm_gateway import (
+    CircuitOpenError, GatewayOverloadedError, LLMGateway, LLMUnavailableError, is_retryable
+)
+
+
+def make_gateway(**overrides):
+    settings = dict(
+        llm_rate_limit_per_sec=1000, llm_rate_limit_burst=1000,
+        llm_max_concurrency=2, llm_reserved_chat_slots=0, llm_max_queue=8,
+        llm_queue_timeout_seconds=0.2, llm_max_retries=0,
+        llm_retry_base_delay=0.0, llm_retry_max_delay=0.0,
+        llm_circuit_failure_threshold=1, llm_circuit_reset_seconds=0.05,
+        llm_hedging_enabled=False, llm_hedge_min_delay_ms=0
+    )
+    settings.update(overrides)
+    return LLMGateway(SimpleNamespace(**settings))
+
+
+def trip(gateway):
+    def failing():
+        raise ConnectionError("connection reset")
+    with pytest.raises(LLMUnavailableError):
+        gateway.invoke(failing)
+    assert gateway.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        gateway.invoke(lambda: "ok")
+    time.sleep(0.06)
+
+
+def test_half_open_probe_closes_breaker():
+    gateway = make_gateway()
+    trip(gateway)
+    assert gateway.invoke(lambda: "ok") == "ok"
+    assert gateway.breaker.state == "closed"
+
+
+def test_probe_rejected_before_the_call_is_not_lost():
+    gateway = make_gateway()
+    trip(gateway)
+    # Every slot is busy, so the would-be probe times out in the queue
+    for _ in range(2):
+        gateway.slots.acquire()
+    with pytest.raises(GatewayOverloadedError):
+        gateway.invoke(lambda: "ok")
+    for _ in range(2):
+        gateway.slots.release()
+    # The next caller still gets to probe and closes the breaker
+    assert gateway.invoke(lambda: "ok") == "ok"
+    assert gateway.breaker.state == "closed"
+
+
+def test_non_retryable_error_is_raised_as_is():
+    gateway = make_gateway(llm_max_retries=3)
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise ValueError("invalid argument")
+    with pytest.raises(ValueError):
+        gateway.invoke(bad_request)
+    assert len(calls) == 1
+    assert gateway.breaker.state == "closed"
+
+
+def test_stream_interrupted_is_never_retryable():
+    from src.services.llm_integration import StreamInterrupted
+
+    assert not is_retryable(StreamInterrupted("Stream failed after 500 chunks"))
+    assert not is_retryable(StreamInterrupted("503 Service Unavailable"))
+
+
+def test_status_codes_only_match_as_statuses():
+    assert is_retryable(Exception("503 Service Unavailable"))
+    assert is_retryable(Exception("429 Resource has been exhausted"))
+    assert is_retryable(Exception("HTTP 502 Bad Gateway"))
+    assert is_retryable(Exception("upstream returned status code: 500"))
+    assert not is_retryable(Exception("Stream failed after 500 chunks"))
+    assert not is_retryable(Exception("400 Invalid argument: context has 5030 tokens"))
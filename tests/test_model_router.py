@@ -0,0 +1,61 @@
+"""LLM routing: model tier, output cap and temperature per call."""
+from types import SimpleNamespace
+
+import pytest
+
+from src.services.model_router import DEFAULT_MAX_OUTPUT_TOKENS, DEFAULT_TEMPERATURE, ModelRouter
+
+
+def make_router(enabled=True):
+    config = SimpleNamespace(
+        llm_routing_enabled=enabled, llm_model_fast="fast-model", llm_model_standard="standard-model",
+        llm_fast_tasks=["chat", "plan"], llm_fast_max_input_tokens=100, llm_fast_max_plan_weeks=4,
+        llm_plan_output_tokens_base=512, llm_plan_output_tokens_per_week=300,
+        llm_max_output_tokens_roadmap=3000, llm_max_output_tokens_chat=1000, llm_max_output_tokens=4096,
+        llm_temperature_plan=0.4, llm_temperature_roadmap=0.5, llm_temperature_chat=0.8, debug_mode=False
+    )
+    return ModelRouter(config)
+
+
+@pytest.mark.parametrize("kind, text, weeks, tier", [
+    ("chat", "short question", None, "fast"),
+    ("chat", "x" * 401, None, "standard"),
+    ("plan_week", "short prompt", 4, "fast"),
+    ("plan", "short prompt", 5, "standard"),
+    ("roadmap", "short prompt", None, "standard"),
+])
+def test_tier_follows_task_input_size_and_weeks(kind, text, weeks, tier):
+    decision = make_router().route(kind, text, weeks=weeks)
+    assert (decision.tier, decision.model) == (tier, f"{tier}-model")
+
+
+def test_output_cap_is_sized_to_the_task():
+    router = make_router()
+    # 512 + 300 * 2 rounded up to a multiple of 256
+    assert router.route("plan_week", "p", weeks=2).max_output_tokens == 1280
+    assert router.route("plan_outline", "p", weeks=12).max_output_tokens == 1024
+    assert router.route("plan", "p", weeks=52).max_output_tokens == 4096
+    assert router.route("roadmap", "p").max_output_tokens == 3072
+    assert router.route("chat", "p").max_output_tokens == 1024
+
+
+def test_temperature_and_task_follow_the_call_kind():
+    router = make_router()
+    assert [(d.task, d.temperature) for d in (router.route("plan_outline", "p", weeks=8),
+                                              router.route("roadmap", "p"), router.route("chat", "p"))] == [
+        ("plan", 0.4), ("roadmap", 0.5), ("chat", 0.8)]
+
+
+def test_disabled_routing_uses_the_standard_tier_and_old_settings():
+    decision = make_router(enabled=False).route("chat", "short question", weeks=None)
+    assert (decision.tier, decision.model) == ("standard", "standard-model")
+    assert (decision.max_output_tokens, decision.temperature) == (DEFAULT_MAX_OUTPUT_TOKENS, DEFAULT_TEMPERATURE)
+
+
+def test_recorded_calls_are_totalled_per_task_and_tier():
+    router = make_router()
+    decision = router.route("chat", "short question")
+    router.record(decision, 0.5, "answer", usage={"input_tokens": 10, "output_tokens": 20})
+    router.record(decision, 1.5, "answer")
+    route = router.stats()["routes"]["chat:fast"]
+    assert (route["calls"], route["input_tokens"], route["latency_seconds_mean"]) == (2, 10 + decision.input_tokens, 1.0)
@@ -0,0 +1,70 @@
+"""PlanGenerator.regenerate: one small call for a slice of a stored plan."""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src.services.plan_generation import PlanGenerator
+
+PROFILE = SimpleNamespace(goal="Learn Go", learning_duration=5, focus_periods=2, work_style="deep work",
+                          habits="", rest_days="Sunday")
+
+PLAN = {
+    "header_note": "Build one small program a week.",
+    "weekly_phases": [{"week": week, "milestone": f"m{week}", "tasks": [f"task {week}"]} for week in range(1, 6)],
+}
+
+
+class ScriptedLLM:
+    """Returns the queued replies in order and records every request."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requests = []
+
+    def complete(self, prompt, context=None, kind="chat", weeks=None):
+        self.requests.append({"prompt": prompt, "context": context, "kind": kind, "weeks": weeks})
+        return self.replies.pop(0)
+
+
+def make_generator(llm):
+    config = SimpleNamespace(plan_fanout_weeks_per_call=4, plan_fanout_concurrency=1, plan_fanout_min_weeks=8)
+    return PlanGenerator(llm, config)
+
+
+def phases(*weeks):
+    return json.dumps({"weekly_phases": [{"week": week, "milestone": f"new {week}", "tasks": ["t"]}
+                                         for week in weeks]})
+
+
+def test_regenerate_returns_the_slice_in_week_order():
+    llm = ScriptedLLM('```json\n{"weekly_phases": [{"week": "3", "milestone": "new 3"}, {"week": 2, "milestone": "new 2"}]}\n```')
+    result = make_generator(llm).regenerate(PROFILE, PLAN, [2, 3], context=["chunk"], feedback="slower pace")
+
+    assert [(phase["week"], phase["milestone"]) for phase in result] == [(2, "new 2"), (3, "new 3")]
+    request = llm.requests[0]
+    assert (request["kind"], request["weeks"], request["context"]) == ("plan_week", 2, ["chunk"])
+
+
+def test_prompt_sends_milestones_and_only_the_neighbouring_tasks():
+    llm = ScriptedLLM(phases(3))
+    make_generator(llm).regenerate(PROFILE, PLAN, [3], feedback="slower pace")
+
+    prompt = llm.requests[0]["prompt"]
+    assert "Week 3 (regenerate): m3" in prompt
+    assert all(f"Week {week}: m{week}" in prompt for week in (1, 2, 4, 5))
+    assert "task 2" in prompt and "task 4" in prompt
+    assert "task 1" not in prompt and "task 5" not in prompt
+    assert "slower pace" in prompt
+
+
+def test_incomplete_answer_is_retried_once():
+    llm = ScriptedLLM(phases(2), phases(2, 3))
+    assert [phase["week"] for phase in make_generator(llm).regenerate(PROFILE, PLAN, [2, 3])] == [2, 3]
+    assert len(llm.requests) == 2
+
+
+def test_two_incomplete_answers_raise():
+    llm = ScriptedLLM(phases(2), phases(4))
+    with pytest.raises(ValueError):
+        make_generator(llm).regenerate(PROFILE, PLAN, [2, 3])
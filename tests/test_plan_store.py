@@ -0,0 +1,33 @@
+"""PlanStore week validation."""
+import pytest
+
+from src.services.plan_store import PlanStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PlanStore(db_path=str(tmp_path / "plans.db"))
+
+
+def plan(*weeks):
+    return {"goal": "g", "header_note": "n",
+            "weekly_phases": [{"week": week, "milestone": f"m{week}", "tasks": ["t"]} for week in weeks]}
+
+
+def test_string_weeks_are_stored_as_numbers(store):
+    stored = store.get_plan(store.save_plan(plan("1", "2")))
+    assert [phase["week"] for phase in stored["weekly_phases"]] == [1, 2]
+
+
+@pytest.mark.parametrize("weeks", [(1, 1), (1, "1"), (1, "soon"), (0,)])
+def test_bad_weeks_are_rejected_before_anything_is_stored(store, weeks):
+    with pytest.raises(ValueError, match="Invalid plan structure"):
+        store.save_plan(plan(*weeks))
+    assert store.list_plans() == []
+
+
+def test_replace_weeks_rejects_repeated_weeks(store):
+    plan_id = store.save_plan(plan(1, 2))
+    with pytest.raises(ValueError):
+        store.replace_weeks(plan_id, plan(2, 2)["weekly_phases"])
+    assert store.get_version(plan_id) == 1
@@ -0,0 +1,107 @@
+"""Onboarding-form prefetch: cached retrievals and speculative plan generation."""
+import threading
+from types import SimpleNamespace
+
+from src.services.prefetch import PlanPrefetcher
+
+
+class FakeKnowledgeBase:
+    def __init__(self):
+        self.generation = "g1"
+        self.searches = []
+        self.shared = SimpleNamespace(generation_info=lambda: {"generation": self.generation})
+
+    def search(self, tenant_id, goal, n_results=5, where=None):
+        self.searches.append(goal)
+        return {"documents": [f"chunk about {goal}"], "metadatas": [{}], "ids": [len(self.searches)]}
+
+
+class FakeGateway:
+    def __init__(self):
+        self.queue_depth = 0
+        self.in_flight = 0
+
+    def stats(self):
+        return {"queue_depth": self.queue_depth, "in_flight": self.in_flight}
+
+
+def make_prefetcher(kb=None, gateway=None):
+    config = SimpleNamespace(prefetch_ttl_seconds=60, prefetch_max_entries=10, prefetch_speculation_concurrency=1,
+                             llm_max_concurrency=4, llm_reserved_chat_slots=1)
+    compressor = SimpleNamespace(compress=lambda query, retrieval: {"documents": ["compressed " + query]})
+    return PlanPrefetcher(config, kb or FakeKnowledgeBase(), compressor, gateway or FakeGateway())
+
+
+def test_retrieval_is_cached_per_goal_and_index_generation():
+    kb = FakeKnowledgeBase()
+    prefetcher = make_prefetcher(kb)
+    first = prefetcher.retrieve(None, "Learn Spanish")
+    assert prefetcher.retrieve(None, " learn spanish") == first
+    assert kb.searches == ["Learn Spanish"]
+
+    # A new index generation makes the cached results stale
+    kb.generation = "g2"
+    prefetcher.retrieve(None, "Learn Spanish")
+    # So do different retrieval options
+    prefetcher.retrieve(None, "Learn Spanish", n_results=3)
+    prefetcher.retrieve("acme", "Learn Spanish")
+    assert len(kb.searches) == 4
+    assert (prefetcher.metrics["retrieval_hits"], prefetcher.metrics["retrieval_misses"]) == (1, 4)
+
+
+def test_matching_submit_adopts_the_speculative_plan():
+    prefetcher = make_prefetcher()
+    gate = threading.Event()
+    assert prefetcher.speculate("draft", "profile-a", lambda: gate.wait(5) and {"plan": "a"})
+    # Asking again for the same profile keeps the generation already running
+    assert prefetcher.speculate("draft", "profile-a", lambda: {"plan": "duplicate"})
+    gate.set()
+
+    assert prefetcher.claim("draft", "profile-a", timeout=5) == {"plan": "a"}
+    assert prefetcher.claim("draft", "profile-a") is None
+    assert (prefetcher.metrics["speculations_started"], prefetcher.metrics["speculations_adopted"]) == (1, 1)
+    prefetcher.close()
+
+
+def test_profile_mismatch_cancels_the_speculation():
+    prefetcher = make_prefetcher()
+    gate = threading.Event()
+    prefetcher.speculate("other", "profile-x", lambda: gate.wait(5))
+    # Queued behind the running one, so cancelling it means it never runs
+    ran = []
+    assert prefetcher.speculate("draft", "profile-a", lambda: ran.append("a"))
+
+    assert prefetcher.claim("draft", "profile-b") is None
+    gate.set()
+    prefetcher.claim("other", "profile-x", timeout=5)
+    assert ran == []
+    assert prefetcher.metrics["speculations_cancelled"] == 1
+    prefetcher.close()
+
+
+def test_newer_draft_replaces_the_earlier_speculation():
+    prefetcher = make_prefetcher()
+    gate = threading.Event()
+    prefetcher.speculate("other", "profile-x", lambda: gate.wait(5))
+    prefetcher.speculate("draft", "profile-a", lambda: "a")
+    assert prefetcher.speculate("draft", "profile-b", lambda: "b")
+    gate.set()
+
+    assert prefetcher.claim("draft", "profile-b", timeout=5) == "b"
+    assert prefetcher.metrics["speculations_cancelled"] == 1
+    prefetcher.close()
+
+
+def test_no_speculation_while_the_gateway_is_busy():
+    gateway = FakeGateway()
+    prefetcher = make_prefetcher(gateway=gateway)
+    started = []
+    gateway.queue_depth = 1
+    assert not prefetcher.speculate("d1", "a", lambda: started.append("d1"))
+    gateway.queue_depth, gateway.in_flight = 0, 3
+    assert not prefetcher.speculate("d2", "b", lambda: started.append("d2"))
+
+    assert started == []
+    assert prefetcher.metrics["speculations_skipped_busy"] == 2
+    assert prefetcher.claim("d1", "a") is None
+    prefetcher.close()
@@ -0,0 +1,100 @@
+"""Query featurizer: bit-identical to TfidfVectorizer.transform for supported configs."""
+import random
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from src.services.query_featurizer import QueryFeaturizer, featurizer_for
+
+CORPUS = [
+    "Spaced repetition improves long-term retention of new vocabulary.",
+    "Deep work sessions need long blocks without email or chat interruptions.",
+    "Weekly reviews keep goals, projects and daily tasks aligned.",
+    "The Pomodoro technique alternates 25 minute focus intervals with short breaks.",
+    "Habit stacking attaches a new habit to an existing daily routine.",
+    "Time blocking schedules every task, including breaks, on the calendar.",
+    "Active recall beats rereading notes for exam preparation.",
+    "Sleep, exercise and nutrition all affect focus and working memory.",
+]
+
+WORDS = sorted({word.strip(".,").lower() for text in CORPUS for word in text.split()}) + [
+    "unknownword", "Focus", "FOCUS", "e-mail", "25", "x", "naïve", "déjà", "the", "and", "a"
+]
+
+SUPPORTED = [
+    dict(max_features=1000, stop_words="english", ngram_range=(1, 2)),
+    dict(max_features=200, ngram_range=(1, 1)),
+    dict(max_features=500, ngram_range=(1, 3), lowercase=False),
+    dict(max_features=300, ngram_range=(2, 2), norm=None),
+    dict(max_features=300, use_idf=False),
+    dict(max_features=300, smooth_idf=False, token_pattern=r"(?u)\b\w+\b"),
+]
+
+UNSUPPORTED = [
+    dict(analyzer="char", ngram_range=(2, 3)),
+    dict(sublinear_tf=True),
+    dict(binary=True),
+    dict(norm="l1"),
+    dict(strip_accents="unicode"),
+    dict(tokenizer=str.split, token_pattern=None),
+    dict(preprocessor=str.lower),
+    dict(token_pattern=r"(\w)\w+"),
+]
+
+
+def fuzzed_queries(seed, count=200):
+    rng = random.Random(seed)
+    queries = ["", "   ", "!!!", "focus", " ".join(WORDS)]
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(1, 12))
+        separator = rng.choice([" ", "  ", ", ", "-", "\n"])
+        queries.append(separator.join(words))
+    return queries
+
+
+def expected(vectorizer, queries):
+    return vectorizer.transform(queries).toarray().astype("float32")
+
+
+@pytest.mark.parametrize("options", SUPPORTED)
+def test_matches_sklearn_on_fuzzed_queries(options):
+    vectorizer = TfidfVectorizer(**options).fit(CORPUS)
+    featurizer = featurizer_for(vectorizer)
+    assert featurizer is not None
+    queries = fuzzed_queries(seed=len(str(options)))
+    want = expected(vectorizer, queries)
+
+    assert np.array_equal(featurizer.transform(queries), want)
+    for row, query in enumerate(queries):
+        assert np.array_equal(featurizer.embed(query), want[row:row + 1]), query
+
+
+def test_embed_buffer_clears_the_previous_query():
+    vectorizer = TfidfVectorizer(max_features=1000, stop_words="english", ngram_range=(1, 2)).fit(CORPUS)
+    featurizer = featurizer_for(vectorizer)
+    featurizer.embed("pomodoro focus intervals breaks")
+    vector = featurizer.embed("sleep exercise")
+    assert np.array_equal(vector, expected(vectorizer, ["sleep exercise"]))
+    assert np.array_equal(featurizer.embed(""), np.zeros((1, featurizer.dimension), dtype="float32"))
+
+
+@pytest.mark.parametrize("options", UNSUPPORTED)
+def test_unsupported_configs_fall_back(options):
+    vectorizer = TfidfVectorizer(**options).fit(CORPUS)
+    assert not QueryFeaturizer.supports(vectorizer)
+    assert featurizer_for(vectorizer) is None
+
+
+def test_unfitted_vectorizer_is_unsupported():
+    assert featurizer_for(TfidfVectorizer()) is None
+
+
+def test_index_generation_embeds_like_transform():
+    from src.services.vector_db import IndexGeneration
+
+    vectorizer = TfidfVectorizer(max_features=1000, stop_words="english", ngram_range=(1, 2)).fit(CORPUS)
+    generation = IndexGeneration(vectorizer, None, CORPUS, [{} for _ in CORPUS])
+    queries = fuzzed_queries(seed=7, count=20)
+    assert np.array_equal(generation.embed_queries(queries), expected(vectorizer, queries))
+    assert np.array_equal(generation.embed_queries(queries[-1:]), expected(vectorizer, queries[-1:]))
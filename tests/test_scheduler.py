@@ -0,0 +1,48 @@
+"""Local schedule layout and task packing."""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src.services.plan_generation import PlanGenerator
+from src.services.scheduler import assign_tasks, build_schedule, parse_week
+
+PROFILE = {
+    "wake_time": "08:00",
+    "sleep_time": "18:00",
+    "focus_periods": 2,
+    "focus_length": 50,
+    "break_duration": 10,
+    "learning_duration": 2,
+    "start_date": "2024-05-06",
+}
+
+
+def test_weeks_given_as_strings_are_scheduled():
+    schedule = assign_tasks(build_schedule(PROFILE), [
+        {"week": "1", "tasks": ["read chapter 1"]},
+        {"week": 2.0, "tasks": ["read chapter 2"]},
+        {"week": "soon", "tasks": ["read chapter 3"]},
+    ])
+    tasks = {block["task"]: day["week"] for day in schedule["days"] for block in day["blocks"] if block.get("task")}
+    assert tasks == {"read chapter 1": 1, "read chapter 2": 2}
+    assert schedule["unscheduled"] == [{"week": None, "task": "read chapter 3"}]
+
+
+def test_bad_start_date_is_a_value_error():
+    with pytest.raises(ValueError, match="start_date"):
+        build_schedule(dict(PROFILE, start_date="next monday"))
+
+
+@pytest.mark.parametrize("value, expected", [(3, 3), ("3", 3), (" 3 ", 3), ("3.0", 3), (None, None), ("x", None)])
+def test_parse_week(value, expected):
+    assert parse_week(value) == expected
+
+
+def test_fanned_out_weeks_accept_string_week_numbers():
+    reply = json.dumps({"weekly_phases": [{"week": "2", "milestone": "b", "tasks": []},
+                                          {"week": "1", "milestone": "a", "tasks": []}]})
+    llm = SimpleNamespace(complete=lambda prompt, **kwargs: reply)
+    config = SimpleNamespace(plan_fanout_weeks_per_call=2, plan_fanout_concurrency=1)
+    phases = PlanGenerator(llm, config)._request_weeks("prompt", [1, 2])
+    assert [(phase["week"], phase["milestone"]) for phase in phases] == [(1, "a"), (2, "b")]
@@ -0,0 +1,112 @@
+"""Sharded vector index: shard-side id allocation and all-or-nothing writes."""
+import multiprocessing
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("faiss")
+
+from src.services.sharded_index import ShardedVectorDatabase, serve_shard
+
+AUTHKEY = "test-shard-key"
+
+CHUNKS = [
+    "spaced repetition helps long term memory retention",
+    "deep work blocks protect focus from interruptions",
+    "weekly reviews keep goals aligned with daily tasks",
+    "pomodoro intervals balance focus and short breaks",
+    "habit stacking links new habits to existing routines",
+]
+
+
+def start_shards(count):
+    addresses = []
+    for _ in range(count):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        threading.Thread(target=serve_shard, args=(("127.0.0.1", 0), AUTHKEY.encode("utf-8"), None, sender),
+                         daemon=True).start()
+        host, port = receiver.recv()
+        addresses.append(f"{host}:{port}")
+    return addresses
+
+
+def make_coordinator(addresses):
+    config = SimpleNamespace(vector_shard_timeout_seconds=5.0, vector_shard_addresses=addresses,
+                             vector_shard_authkey=AUTHKEY, vector_local_shards=0, debug_mode=False)
+    return ShardedVectorDatabase(config)
+
+
+@pytest.fixture
+def addresses():
+    return start_shards(2)
+
+
+def test_coordinators_share_id_allocation(addresses):
+    first, second = make_coordinator(addresses), make_coordinator(addresses)
+    try:
+        first.add_documents(CHUNKS[:3], [{"source": "a"}] * 3)
+        # The second coordinator never saw those writes; ids continue from the shards' counts
+        second.add_documents(CHUNKS[3:], [{"source": "b"}] * 2)
+        assert first.count() == second.count() == 5
+        chunks = first.get_chunks([0, 1, 2, 3, 4])
+        assert chunks["documents"] == CHUNKS
+        assert [meta["source"] for meta in chunks["metadatas"]] == ["a", "a", "a", "b", "b"]
+        # A fresh coordinator picks up the vectorizer from the shards and can search
+        assert first.shards[0].call("vectorizer").vocabulary_ == first.vectorizer.vocabulary_
+        third = make_coordinator(addresses)
+        result = third.search("pomodoro focus breaks", n_results=1)
+        assert result["ids"] == [3]
+        third.close()
+    finally:
+        first.close()
+        second.close()
+
+
+def test_failed_commit_rolls_back_every_shard(addresses):
+    coordinator = make_coordinator(addresses)
+    try:
+        coordinator.add_documents(CHUNKS[:2])
+        broken = coordinator.shards[1]
+        call = broken.call
+
+        def failing_call(op, *args, **kwargs):
+            if op == "commit":
+                raise RuntimeError("shard went away")
+            return call(op, *args, **kwargs)
+
+        broken.call = failing_call
+        with pytest.raises(RuntimeError):
+            coordinator.add_documents(CHUNKS[2:])
+        broken.call = call
+
+        assert coordinator.count() == 2
+        coordinator.add_documents(CHUNKS[2:])
+        assert coordinator.get_chunks(list(range(5)))["documents"] == CHUNKS
+    finally:
+        coordinator.close()
+
+
+def test_concurrent_writers_keep_the_layout(addresses):
+    coordinators = [make_coordinator(addresses) for _ in range(3)]
+    errors = []
+
+    def write(coordinator, number):
+        try:
+            coordinator.add_documents([f"{chunk} writer {number}" for chunk in CHUNKS])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(c, n)) for n, c in enumerate(coordinators)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert not errors
+        assert coordinators[0].count() == 15
+        documents = coordinators[0].get_chunks(list(range(15)))["documents"]
+        assert len(documents) == 15 and len(set(documents)) == 15
+    finally:
+        for coordinator in coordinators:
+            coordinator.close()
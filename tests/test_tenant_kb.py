@@ -0,0 +1,76 @@
+"""Tenant namespaces shared between workers, and the merged search."""
+import threading
+from types import SimpleNamespace
+
+from src.services.tenant_kb import TenantKnowledgeBase
+from src.services.vector_db import VectorDatabase
+
+SHARED = [
+    "Time blocking protects focus time for deep work.",
+    "Take short breaks between focus blocks to recover.",
+    "A weekly review keeps long term goals on track.",
+]
+
+
+def make_config(root):
+    return SimpleNamespace(tenant_kb_dir=str(root), tenant_cache_max_namespaces=8, tenant_cache_max_mb=64,
+                           index_watch_interval_seconds=0, index_keep_generations=2, debug_mode=False,
+                           chunk_size=1000, chunk_overlap=0, dedup_enabled=False)
+
+
+def make_kb(root):
+    config = make_config(root)
+    shared = VectorDatabase(config)
+    shared.add_documents(SHARED, [{"source": "shared"} for _ in SHARED])
+    return TenantKnowledgeBase(config, shared)
+
+
+def upload(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_tenant_hits_are_ranked_in_the_same_space_as_shared_ones(tmp_path):
+    kb = make_kb(tmp_path / "tenants")
+    kb.ingest("acme", upload(tmp_path, "k8s.txt", "Kubernetes operators reconcile cluster state."), "k8s.txt")
+    result = kb.search("acme", "kubernetes operators", n_results=2)
+    assert result["metadatas"][0]["namespace"] == "acme"
+    assert result["distances"] == sorted(result["distances"])
+    assert result["refs"][0] is None
+
+
+def test_other_workers_see_a_new_namespace_snapshot(tmp_path):
+    root = tmp_path / "tenants"
+    writer, reader = make_kb(root), make_kb(root)
+    writer.ingest("acme", upload(tmp_path, "a.txt", "Pomodoro sprints for writing reports."), "a.txt")
+    assert len(reader.get_namespace("acme").documents) == 1
+
+    writer.ingest("acme", upload(tmp_path, "b.txt", "Inbox zero every Friday afternoon."), "b.txt")
+    assert len(reader.get_namespace("acme").documents) == 2
+
+
+def test_concurrent_ingests_in_two_workers_keep_every_document(tmp_path):
+    root = tmp_path / "tenants"
+    workers = [make_kb(root), make_kb(root)]
+    files = [upload(tmp_path, f"doc{i}.txt", f"Document number {i} about habit {i} tracking.") for i in range(6)]
+    threads = [threading.Thread(target=workers[i % 2].ingest, args=("acme", path, f"doc{i}.txt"))
+               for i, path in enumerate(files)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(meta["source"] for meta in make_kb(root).get_namespace("acme").metadata) == \
+        sorted(f"doc{i}.txt" for i in range(6))
+
+
+def test_duplicate_upload_does_not_mutate_the_published_generation(tmp_path):
+    kb = make_kb(tmp_path / "tenants")
+    kb.config.__dict__.update(dedup_enabled=True, dedup_threshold=0.8, dedup_num_perm=64, dedup_shingle_size=3)
+    text = "Plan the week every Sunday evening and block time for deep work."
+    kb.ingest("acme", upload(tmp_path, "a.txt", text), "a.txt")
+    published = kb.get_namespace("acme")
+
+    report = kb.ingest("acme", upload(tmp_path, "b.txt", text), "b.txt")
+    assert report["kept"] == 0
+    assert "also_in" not in published.metadata[0]
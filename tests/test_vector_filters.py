@@ -0,0 +1,46 @@
+"""Metadata filters: matching and rejection of malformed operands."""
+import numpy as np
+import pytest
+
+from src.services.vector_db import IndexGeneration
+
+METADATA = [
+    {"source": "a.pdf", "tags": ["focus", "habits"], "page": 1},
+    {"source": "b.pdf", "tags": ["sleep"], "page": 5},
+    {"source": "a.pdf", "tags": ["focus"], "page": 9},
+]
+
+
+@pytest.fixture
+def generation():
+    return IndexGeneration(None, None, ["one", "two", "three"], METADATA)
+
+
+@pytest.mark.parametrize("where, expected", [
+    ({"source": "a.pdf"}, [0, 2]),
+    ({"source": {"$in": ["b.pdf", "c.pdf"]}}, [1]),
+    ({"tags": {"$contains": "focus"}}, [0, 2]),
+    ({"page": {"$gte": 5}}, [1, 2]),
+    ({"source": "a.pdf", "page": {"$lt": 5}}, [0]),
+    ({"source": {"$in": []}}, []),
+])
+def test_filters_match(generation, where, expected):
+    assert np.flatnonzero(generation.filter_mask(where)).tolist() == expected
+
+
+@pytest.mark.parametrize("where", [
+    {"source": {"$in": [["a.pdf"]]}},
+    {"source": {"$eq": []}},
+    {"source": {"$eq": {"x": 1}}},
+    {"tags": {"$contains": ["focus"]}},
+    {"source": {"$in": 5}},
+    {"source": {"$in": "a.pdf"}},
+    {"page": {"$gt": [1]}},
+    {"page": {"$gt": None}},
+    {"page": {"$gt": "3"}},
+    {"source": {"$regex": "a"}},
+    ["source"],
+])
+def test_malformed_filters_are_value_errors(generation, where):
+    with pytest.raises(ValueError):
+        generation.filter_mask(where)